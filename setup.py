@@ -32,6 +32,8 @@ def setup_package():
         tests_require=['pytest', 'pytest-cov'],
         install_requires=[
             'spacy>=2.1.0'],
+        entry_points={
+            'console_scripts': ['spacy-lefff=spacy_lefff.cli:main']},
         zip_safe=False,
         classifiers=[
             'Programming Language :: Python',
@@ -1,16 +1,38 @@
-from .lefff import LefffLemmatizer
-from .melt_tagger import POSTagger
-from .downloader import Downloader
-
 import logging
 import sys
 
-root = logging.getLogger()
-root.setLevel(logging.DEBUG)
+# the components, loaded along with their dependencies on first access
+__all__ = ['LefffLemmatizer', 'POSTagger', 'POSTaggerLemmatizer',
+           'Downloader']
+_MODULES = {
+    'LefffLemmatizer': 'lefff',
+    'POSTagger': 'melt_tagger',
+    'POSTaggerLemmatizer': 'tagger_lemmatizer',
+    'Downloader': 'downloader',
+}
+
+# logging is left for applications to configure
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(
+            "module '%s' has no attribute '%s'" % (__name__, name))
+    import importlib
+    module = importlib.import_module('.' + _MODULES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
 
-ch = logging.StreamHandler(sys.stdout)
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-ch.setFormatter(formatter)
-root.addHandler(ch)
+if sys.version_info < (3, 7):
+    # no module __getattr__: import the components up front
+    from .lefff import LefffLemmatizer
+    from .melt_tagger import POSTagger
+    from .tagger_lemmatizer import POSTaggerLemmatizer
+    from .downloader import Downloader
@@ -0,0 +1,229 @@
+# coding: utf8
+"""
+asyncio front end of the components (Python 3.6+ only).
+
+    pipeline = AsyncPipeline(POSTagger())
+    doc = await pipeline.atag(nlp.make_doc(text))
+    async for doc in pipeline.apipe(docs):
+        ...
+
+The components run in an executor, so tagging doesn't block the event
+loop. Pending items are grouped into batches of `batch_size`, and at most
+`max_pending` batches are in the executor at any time: `atag` waits for
+room in a queue of `max_queue` items, and `apipe` only reads its input as
+results are consumed, so memory stays bounded whatever the input rate.
+Results come back in input order.
+"""
+
+import asyncio
+import logging
+import pickle
+import sys
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 32
+MAX_PENDING = 4
+MAX_QUEUE = 1024
+
+# components unpickled in worker processes, by pipeline key
+_components = {}
+# component of a worker process of the pool created by a pipeline
+_worker = {}
+
+
+def _apply(component, items, batch_method=None):
+    """ results of a component on a batch of items """
+    if batch_method is None:
+        return [component(item) for item in items]
+    return list(getattr(component, batch_method)(items))
+
+
+def _apply_in_process(key, state, items, batch_method=None):
+    # the component is unpickled once per worker process
+    component = _components.get(key)
+    if component is None:
+        component = _components[key] = pickle.loads(state)
+    return _apply(component, items, batch_method)
+
+
+def _init_worker(state):
+    """ Load the component once per worker process """
+    _worker['component'] = pickle.loads(state)
+
+
+def _apply_in_worker(items, batch_method=None):
+    return _apply(_worker['component'], items, batch_method)
+
+
+def _fail(batch, error):
+    """ pass an error to the callers of a batch of `atag` items """
+    for _, future in batch:
+        if not future.done():
+            future.set_exception(error)
+
+
+async def _aiter(items):
+    """ async iterator over a sync or async iterable """
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class AsyncPipeline(object):
+    """
+    Run a component (`POSTagger`, `LefffLemmatizer`,
+    `POSTaggerLemmatizer`, or any callable) in an executor from asyncio
+    code.
+
+    Items are passed to the component one at a time, or as a whole batch
+    to its method `batch_method` (e.g. `'tag_sentences'` of `POSTagger`
+    for pre-tokenized sentences). `executor` defaults to the event loop's
+    thread pool; with `processes`, a process pool of that many workers is
+    used, each one loading the component once (items and results are then
+    pickled). The component is sent to these workers when they start
+    (Python 3.7+), while with a `ProcessPoolExecutor` given as `executor`,
+    it goes along with every batch.
+    """
+
+    def __init__(self, component, executor=None, processes=None,
+                 batch_size=BATCH_SIZE, max_pending=MAX_PENDING,
+                 max_queue=MAX_QUEUE, batch_method=None):
+        self.component = component
+        self.batch_method = batch_method
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_queue = max_queue
+        self._own_executor = executor is None and bool(processes)
+        # whether the workers hold the component, see _init_worker
+        self._in_workers = self._own_executor and sys.version_info >= (3, 7)
+        if self._in_workers:
+            executor = ProcessPoolExecutor(
+                processes, initializer=_init_worker, initargs=(
+                    pickle.dumps(component, pickle.HIGHEST_PROTOCOL),))
+        elif self._own_executor:
+            executor = ProcessPoolExecutor(processes)
+        self.executor = executor
+        self._state = None
+        if isinstance(executor, ProcessPoolExecutor) and \
+                not self._in_workers:
+            self._key = uuid.uuid4().hex
+            self._state = pickle.dumps(component, pickle.HIGHEST_PROTOCOL)
+        # atag queue and the task batching it, created in the running loop
+        self._loop = None
+        self._queue = None
+        self._collector = None
+
+    def _submit(self, items):
+        """ future of the results of a batch """
+        loop = asyncio.get_event_loop()
+        if self._in_workers:
+            return loop.run_in_executor(self.executor, _apply_in_worker,
+                                        items, self.batch_method)
+        if self._state is not None:
+            return loop.run_in_executor(
+                self.executor, _apply_in_process, self._key, self._state,
+                items, self.batch_method)
+        return loop.run_in_executor(self.executor, _apply, self.component,
+                                    items, self.batch_method)
+
+    async def atag(self, item):
+        """ result of the component on an item, batched with the items
+        submitted concurrently """
+        loop = asyncio.get_event_loop()
+        if self._collector is None or self._collector.done() \
+                or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._collector = asyncio.ensure_future(
+                self._collect(self._queue))
+        future = loop.create_future()
+        queue = self._queue
+        await queue.put((item, future))
+        if queue is not self._queue:
+            # closed while waiting for room in the queue
+            raise RuntimeError('AsyncPipeline closed')
+        return await future
+
+    async def _collect(self, queue):
+        slots = asyncio.Semaphore(self.max_pending)
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await slots.acquire()
+            except asyncio.CancelledError:
+                _fail(batch, RuntimeError('AsyncPipeline closed'))
+                raise
+            try:
+                results = self._submit([item for item, _ in batch])
+            except Exception as e:
+                # e.g. a shut down executor or a broken process pool
+                slots.release()
+                _fail(batch, e)
+                continue
+            results.add_done_callback(
+                lambda results, batch=batch: self._resolve(
+                    results, batch, slots))
+
+    @staticmethod
+    def _resolve(results, batch, slots):
+        slots.release()
+        error = results.exception()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results.result()[i])
+
+    async def apipe(self, items, batch_size=None):
+        """ async generator of the results of the component on a sync or
+        async iterable of items, in order """
+        batch_size = batch_size or self.batch_size
+        pending = deque()
+        batch = []
+        async for item in _aiter(items):
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+            pending.append(self._submit(batch))
+            batch = []
+            # bound the number of batches in flight
+            if len(pending) >= self.max_pending:
+                for result in await pending.popleft():
+                    yield result
+        if batch:
+            pending.append(self._submit(batch))
+        while pending:
+            for result in await pending.popleft():
+                yield result
+
+    def close(self):
+        """ stop batching `atag` calls, failing the ones not submitted
+        yet with a RuntimeError, and shut down the process pool created by
+        the pipeline """
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+        if self._queue is not None:
+            queue, self._queue = self._queue, None
+            while not queue.empty():
+                _fail([queue.get_nowait()],
+                      RuntimeError('AsyncPipeline closed'))
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
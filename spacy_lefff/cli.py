@@ -0,0 +1,319 @@
+# coding: utf8
+"""
+Command line interface.
+
+    spacy-lefff tag corpus.txt -o corpus.conllu --workers 4
+
+`tag` streams sentences from a file (or stdin), tags them with MElt and
+lemmatizes them with Lefff in worker processes, and writes the results in
+input order as CoNLL-U or JSONL. At most `2 * workers` batches are in
+flight at any time, so memory stays bounded whatever the input size.
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from collections import deque
+
+from .profiles import PROFILES
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 64
+PROFILE_NAMES = sorted(PROFILES)
+
+_worker = {}
+
+
+def _init_worker(beam_size, lemmatize, tokenize, profile=None):
+    """ Load the models once per worker process """
+    from .melt_tagger import POSTagger
+    from .lefff import LefffLemmatizer
+    _worker['tagger'] = POSTagger(profile=profile)
+    _worker['lemmatizer'] = LefffLemmatizer() if lemmatize else None
+    _worker['tokenizer'] = None
+    if tokenize:
+        import spacy
+        _worker['tokenizer'] = spacy.blank('fr').tokenizer
+    _worker['beam_size'] = beam_size
+
+
+def _init_pool_worker(*args):
+    # keep worker logs out of the output stream
+    logging.getLogger().setLevel(logging.WARNING)
+    _init_worker(*args)
+
+
+def _tag_batch(sentences):
+    """ Tag a batch of sentences given as token lists (or raw strings when
+    the worker tokenizes), returning (tokens, tags, lemmas, probas)
+    tuples """
+    from .melt_tagger import Token
+    tagger = _worker['tagger']
+    lemmatizer = _worker['lemmatizer']
+    tokenizer = _worker['tokenizer']
+    if tokenizer is not None:
+        sentences = [s if isinstance(s, list) else
+                     [t.text for t in tokenizer(s) if not t.is_space]
+                     for s in sentences]
+    tagged_sequences = tagger.tag_token_sequences(
+        [[Token(string=wd) for wd in words] for words in sentences],
+        beam_size=_worker['beam_size'])
+    lemmas = None
+    if lemmatizer is not None:
+        # lemmatize the whole batch at once
+        lemmas, _ = lemmatizer.lemmatize_batch(
+            [tok.string for tagged in tagged_sequences for tok in tagged],
+            [tok.label for tagged in tagged_sequences for tok in tagged],
+            from_melt=True)
+        lemmas = lemmas.tolist()
+    results = []
+    offset = 0
+    for tagged_tokens in tagged_sequences:
+        tokens = [tok.string for tok in tagged_tokens]
+        tags = [tok.label for tok in tagged_tokens]
+        if lemmas is None:
+            sentence_lemmas = [None] * len(tokens)
+        else:
+            sentence_lemmas = lemmas[offset:offset + len(tokens)]
+        offset += len(tokens)
+        probas = [tok.proba for tok in tagged_tokens]
+        results.append((tokens, tags, sentence_lemmas, probas))
+    return results
+
+
+def read_sentences(lines, input_format='text', tokenize=False):
+    """ Yield one sentence per input line: a list of tokens, or the raw
+    string when it is left to the workers to tokenize. Blank lines give
+    empty sentences, so that the output rows line up with the input
+    lines """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            yield u'' if tokenize else []
+            continue
+        if input_format == 'jsonl':
+            record = json.loads(line)
+            if 'tokens' in record:
+                yield record['tokens']
+                continue
+            line = record['text']
+        yield line if tokenize else line.split()
+
+
+def _batches(sentences, batch_size):
+    batch = []
+    for sentence in sentences:
+        batch.append(sentence)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def format_conllu(tokens, tags, lemmas, probas, with_probas=False):
+    if not tokens:
+        # an empty input line: a sentence block holding an empty text
+        # comment only, keeping one block per input line
+        return '# text = \n\n'
+    lines = []
+    for i, (wd, tag, lemma, proba) in enumerate(
+            zip(tokens, tags, lemmas, probas)):
+        misc = 'MeltProba=%.6f' % proba if with_probas else '_'
+        lines.append('\t'.join([str(i + 1), wd, lemma or '_', '_', tag,
+                                '_', '_', '_', '_', misc]))
+    return '\n'.join(lines) + '\n\n'
+
+
+def format_jsonl(tokens, tags, lemmas, probas, with_probas=False):
+    record = {'tokens': tokens, 'tags': tags, 'lemmas': lemmas}
+    if with_probas:
+        record['probas'] = probas
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+FORMATTERS = {'conllu': format_conllu, 'jsonl': format_jsonl}
+
+
+def tag_stream(sentences, workers=1, batch_size=BATCH_SIZE, beam_size=3,
+               lemmatize=True, tokenize=False, profile=None):
+    """ Tag an iterable of sentences, yielding (tokens, tags, lemmas,
+    probas) tuples in input order """
+    initargs = (beam_size, lemmatize, tokenize, profile)
+    if workers <= 1:
+        _init_worker(*initargs)
+        for batch in _batches(sentences, batch_size):
+            for result in _tag_batch(batch):
+                yield result
+        return
+    # fetch the model once, before the workers load it
+    from .melt_tagger import download_model
+    download_model()
+    pool = multiprocessing.Pool(workers, initializer=_init_pool_worker,
+                                initargs=initargs)
+    try:
+        pending = deque()
+        for batch in _batches(sentences, batch_size):
+            pending.append(pool.apply_async(_tag_batch, (batch,)))
+            # bound the number of batches in flight
+            if len(pending) >= 2 * workers:
+                for result in pending.popleft().get():
+                    yield result
+        while pending:
+            for result in pending.popleft().get():
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def tag_command(args):
+    if args.input == '-':
+        infile = io.open(sys.stdin.fileno(), encoding='utf-8',
+                         closefd=False)
+    else:
+        infile = io.open(args.input, encoding='utf-8')
+    if args.output == '-':
+        outfile = io.open(sys.stdout.fileno(), 'w', encoding='utf-8',
+                          closefd=False)
+    else:
+        outfile = io.open(args.output, 'w', encoding='utf-8')
+    formatter = FORMATTERS[args.output_format]
+    try:
+        sentences = read_sentences(infile, args.input_format, args.tokenize)
+        for tokens, tags, lemmas, probas in tag_stream(
+                sentences,
+                workers=args.workers,
+                batch_size=args.batch_size,
+                beam_size=args.beam_size,
+                lemmatize=not args.no_lemma,
+                tokenize=args.tokenize,
+                profile=args.profile):
+            outfile.write(formatter(tokens, tags, lemmas, probas,
+                                    with_probas=args.probas))
+    finally:
+        infile.close()
+        outfile.close()
+
+
+def train_command(args):
+    from .train import MaxEntTrainer, train_model
+    trainer = MaxEntTrainer(feat_options=PROFILES[args.profile],
+                            epochs=args.epochs,
+                            batch_size=args.batch_size,
+                            learning_rate=args.learning_rate,
+                            l2=args.l2,
+                            prune=args.prune)
+    kwargs = {}
+    if args.lexicon is not None:
+        kwargs['lexicon_file_name'] = args.lexicon
+    train_model(args.corpus, args.output, corpus_format=args.format,
+                init_model=args.init_model, trainer=trainer,
+                profile=args.profile, dev_path=args.dev, **kwargs)
+
+
+def evaluate_command(args):
+    from .melt_tagger import POSTagger
+    from .train import evaluate, read_corpus
+    config = {'profile': args.profile,
+              'constrained_softmax': args.constrained_softmax}
+    if args.model is None:
+        tagger = POSTagger(**config)
+    else:
+        tagger = POSTagger.from_files(
+            os.path.join(args.model, 'lexicon.json'),
+            os.path.join(args.model, 'tag_dict.json'),
+            args.model, **config)
+    result = evaluate(tagger, read_corpus(args.corpus, args.format),
+                      beam_size=args.beam_size)
+    result['profile'] = tagger.profile
+    result['constrained_softmax'] = tagger.constrained_softmax
+    print(json.dumps(result, sort_keys=True))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='spacy-lefff')
+    subparsers = parser.add_subparsers(dest='command')
+    tag = subparsers.add_parser(
+        'tag', help='tag and lemmatize a corpus, one sentence per line')
+    tag.add_argument('input', nargs='?', default='-',
+                     help='input file (default: stdin)')
+    tag.add_argument('-o', '--output', default='-',
+                     help='output file (default: stdout)')
+    tag.add_argument('--input-format', choices=['text', 'jsonl'],
+                     default='text',
+                     help='whitespace-tokenized lines, or JSON objects with '
+                          'a "tokens" list or a "text" string')
+    tag.add_argument('--output-format', choices=sorted(FORMATTERS),
+                     default='conllu')
+    tag.add_argument('--tokenize', action='store_true',
+                     help="tokenize raw text with spaCy's French tokenizer "
+                          "instead of splitting on whitespace")
+    tag.add_argument('-w', '--workers', type=int, default=1,
+                     help='number of worker processes')
+    tag.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                     help='number of sentences sent to a worker at once')
+    tag.add_argument('--beam-size', type=int, default=3)
+    tag.add_argument('--probas', action='store_true',
+                     help='output the probability of each tag')
+    tag.add_argument('--no-lemma', action='store_true',
+                     help='do not lemmatize')
+    tag.add_argument('--profile', choices=PROFILE_NAMES, default=None,
+                     help='feature template set (default: accurate)')
+    tag.set_defaults(func=tag_command)
+    train = subparsers.add_parser(
+        'train', help='train (or domain-adapt) a MElt model')
+    train.add_argument('corpus', help='tagged training corpus')
+    train.add_argument('-o', '--output', required=True,
+                       help='output model directory')
+    train.add_argument('--format', choices=['brown', 'conll'],
+                       default='brown',
+                       help='word/TAG lines, or CoNLL with tags in XPOS')
+    train.add_argument('--lexicon', default=None,
+                       help='lexicon.json (default: the shipped lexicon)')
+    train.add_argument('--init-model', default=None,
+                       help='model directory to start from')
+    train.add_argument('--epochs', type=int, default=10)
+    train.add_argument('--batch-size', type=int, default=256)
+    train.add_argument('--learning-rate', type=float, default=0.1)
+    train.add_argument('--l2', type=float, default=1e-6)
+    train.add_argument('--prune', type=float, default=0.,
+                       help='drop features whose weights are all below '
+                            'this absolute value')
+    train.add_argument('--profile', choices=PROFILE_NAMES,
+                       default='accurate',
+                       help='feature template set to train the model for')
+    train.add_argument('--dev', default=None,
+                       help='tagged corpus to measure the accuracy and '
+                            'speed of the model on')
+    train.set_defaults(func=train_command)
+    evaluate = subparsers.add_parser(
+        'evaluate', help='measure the accuracy and speed of a model')
+    evaluate.add_argument('corpus', help='tagged corpus')
+    evaluate.add_argument('--format', choices=['brown', 'conll'],
+                          default='brown')
+    evaluate.add_argument('--model', default=None,
+                          help='model directory (default: the installed '
+                               'model of the profile)')
+    evaluate.add_argument('--profile', choices=PROFILE_NAMES, default=None)
+    evaluate.add_argument('--beam-size', type=int, default=3)
+    evaluate.add_argument('--constrained-softmax', action='store_true',
+                          help='normalize the scores of known words over '
+                               'their tags in the lexicons only')
+    evaluate.set_defaults(func=evaluate_command)
+    args = parser.parse_args(argv)
+    if getattr(args, 'func', None) is None:
+        parser.print_help()
+        return 1
+    logging.getLogger().setLevel(logging.WARNING)
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,105 @@
 import os
 import sys
+import json
 import logging
-import tarfile
+import tempfile
+import hashlib
 import shutil
-import requests
 import re
-from tqdm import tqdm
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# environment variable pointing to a (shared) data directory, used instead
+# of the package data directory
+DATA_DIR_ENV = 'SPACY_LEFFF_DATA'
+MANIFEST_FILE_NAME = 'manifest.json'
+CHUNK_SIZE = 1024 * 1024
 LOGGER = logging.getLogger(__name__)
 
 
+def get_data_dir(data_dir=None):
+    """
+    Data directory: the given one, else $SPACY_LEFFF_DATA, else the package
+    data directory
+    """
+    return data_dir or os.environ.get(DATA_DIR_ENV) or DATA_DIR
+
+
+class DownloadError(Exception):
+    """Raised when model data couldn't be fetched or installed"""
+    pass
+
+
+@contextmanager
+def file_lock(path):
+    """ exclusive lock on file `path` (created if needed), held by one
+    process at a time """
+    f = open(path, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    # LK_LOCK gives up after 10 s: keep waiting
+                    continue
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+
 class Downloader(object):
-    def __init__(self, pkg, url=None, download_dir=DATA_DIR):
+    """
+    Download and install the data of `pkg` into `<download_dir>/<pkg>`.
+
+    The archive is downloaded to a partial file, resumed with HTTP range
+    requests after an interruption, checked against `sha256` when given,
+    and extracted into a temporary directory that is renamed into place
+    once complete, along with a manifest of the installed files. On warm
+    starts, checking the manifest only stats the installed files.
+
+    Processes sharing a data directory download and install the data one
+    at a time, under a lock file: the ones that waited find the data
+    installed and don't fetch it again.
+
+    `prepare`, when given, is called with the directory holding the
+    extracted (or adopted existing) data before its manifest is written,
+    to convert files in place.
+    """
+
+    def __init__(self, pkg, url=None, download_dir=None, sha256=None,
+                 required_files=None, chunk_size=CHUNK_SIZE, retries=3,
+                 prepare=None):
         self._error = None
         self.url = url
         self.pkg = pkg
-        if not os.path.exists(os.path.join(download_dir, pkg)):
-            os.mkdir(os.path.join(download_dir, pkg))
-            self.download_dir = os.path.join(os.path.join(download_dir, pkg))
-            self._download_data()
-        else:
+        self.sha256 = sha256
+        self.prepare = prepare
+        self.required_files = required_files or []
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.data_dir = get_data_dir(download_dir)
+        self.download_dir = os.path.join(self.data_dir, pkg)
+        if self.is_installed():
             LOGGER.info('data already set up')
+        else:
+            self._download_data()
 
     @staticmethod
     def get_filename_from_cd(cd):
@@ -35,29 +113,221 @@ class Downloader(object):
             return None
         return fname[0]
 
+    @property
+    def manifest_path(self):
+        return os.path.join(self.download_dir, MANIFEST_FILE_NAME)
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.data_dir, '.%s.lock' % self.pkg)
+
+    def is_installed(self):
+        """
+        Check the installed files against the manifest (sizes only). A
+        directory installed before manifests existed is adopted when all
+        `required_files` are there.
+        """
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return self._adopt_legacy_install()
+        if not manifest.get('files'):
+            return False
+        for name, size in manifest['files'].items():
+            try:
+                if os.path.getsize(
+                        os.path.join(self.download_dir, name)) != size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _adopt_legacy_install(self):
+        if not self.required_files or not all(
+                os.path.isfile(os.path.join(self.download_dir, name))
+                for name in self.required_files):
+            return False
+        LOGGER.info('adopting existing data for {}'.format(self.pkg))
+        try:
+            if self.prepare is not None:
+                self.prepare(self.download_dir)
+            self._write_manifest(self.download_dir, None)
+        except (IOError, OSError):
+            # read-only data directory: still usable
+            pass
+        return True
+
     def _download_data(self):
+        try:
+            os.makedirs(self.data_dir)
+        except OSError:
+            if not os.path.isdir(self.data_dir):
+                raise
+        with file_lock(self.lock_path):
+            # another process may have installed it while we waited
+            if self.is_installed():
+                LOGGER.info('data set up by another process')
+                return
+            self._download_locked()
+
+    def _download_locked(self):
+        # requests, tqdm and tarfile are slow to import, and only needed
+        # to download data: they are imported here and in the methods
+        # below
+        import tarfile
         LOGGER.info('downloading data for {}...'.format(self.pkg))
-        r = requests.get(self.url, stream=True)
-        total_length = r.headers.get('content-length', 0)
-        pbar = tqdm(
-                unit='B', unit_scale=True,
-                total=int(total_length))
-        if total_length is None:
-            LOGGER.error("Couldn't fetch model data.")
-            raise Exception("Couldn't fetch model data.")
+        archive, filename = self._fetch()
+        digest = self._verify(archive)
+        tmp_dir = tempfile.mkdtemp(prefix='.%s-' % self.pkg,
+                                   dir=self.data_dir)
+        try:
+            if tarfile.is_tarfile(archive):
+                self._extract(archive, tmp_dir)
+            else:
+                shutil.copyfile(archive, os.path.join(tmp_dir, filename))
+            if self.prepare is not None:
+                self.prepare(tmp_dir)
+            self._write_manifest(tmp_dir, digest)
+            self._install(tmp_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        # clean raw archive
+        os.remove(archive)
+        if os.path.exists(archive + '.json'):
+            os.remove(archive + '.json')
+        LOGGER.info('download complete')
+
+    def _fetch(self):
+        """
+        Download the archive to a partial file, resuming it if a previous
+        download was interrupted. Returns its path and its file name.
+        """
+        import requests
+        part = os.path.join(self.data_dir, '.%s.part' % self.pkg)
+        error = None
+        for attempt in range(self.retries):
+            try:
+                filename = self._fetch_once(part)
+                return part, filename
+            except (requests.RequestException, IOError) as e:
+                LOGGER.warning('download of {} interrupted ({}), '
+                               'resuming'.format(self.pkg, e))
+                error = e
+        raise DownloadError("Couldn't fetch model data: %s" % error)
+
+    def _part_source(self, part):
+        """ url and validators of the download a partial file belongs to,
+        None if unknown """
+        try:
+            with open(part + '.json') as f:
+                source = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return source if source.get('url') == self.url else None
+
+    def _fetch_once(self, part):
+        import requests
+        from tqdm import tqdm
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        source = self._part_source(part) if offset else None
+        headers = {}
+        if source is not None:
+            headers['Range'] = 'bytes=%d-' % offset
+            # the server sends the whole file if it changed since
+            validator = source.get('etag') or source.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        elif offset:
+            LOGGER.info('discarding partial download of another source')
+        r = requests.get(self.url, stream=True, headers=headers, timeout=60)
+        if r.status_code == 416:
+            # nothing left to fetch from this offset: start over
+            r = requests.get(self.url, stream=True, timeout=60)
+        if r.status_code == 206 and source is not None:
+            mode = 'ab'
+        elif r.status_code == 200:
+            mode = 'wb'
+            offset = 0
+            with open(part + '.json', 'w') as f:
+                json.dump({'url': self.url,
+                           'etag': r.headers.get('etag'),
+                           'last_modified': r.headers.get('last-modified')},
+                          f)
         else:
-            filename = self.get_filename_from_cd(
-                r.headers.get('content-disposition'))
-            path = os.path.join(self.download_dir, filename)
-            with open(path, 'wb') as f:
-                for data in r.iter_content(chunk_size=4096):
-                    f.write(data)
-                    pbar.update(len(data))
-            if filename.endswith('.tar.gz'):
-                tar = tarfile.open(path, "r:gz")
-                for tarinfo in tar:
-                    tar.extract(tarinfo, self.download_dir)
-                tar.close()
-            # clean raw tar gz
-            os.remove(path)
-            LOGGER.info('download complete')
+            raise DownloadError(
+                "Couldn't fetch model data (HTTP %s)." % r.status_code)
+        length = int(r.headers.get('content-length', 0))
+        filename = self.get_filename_from_cd(
+            r.headers.get('content-disposition')) or \
+            os.path.basename(self.url.split('?')[0]) or self.pkg
+        pbar = tqdm(unit='B', unit_scale=True, total=offset + length,
+                    initial=offset)
+        with open(part, mode) as f:
+            for data in r.iter_content(chunk_size=self.chunk_size):
+                f.write(data)
+                pbar.update(len(data))
+        pbar.close()
+        if length and os.path.getsize(part) != offset + length:
+            raise IOError('incomplete download')
+        return filename
+
+    def _verify(self, archive):
+        sha256 = hashlib.sha256()
+        with open(archive, 'rb') as f:
+            for data in iter(lambda: f.read(self.chunk_size), b''):
+                sha256.update(data)
+        digest = sha256.hexdigest()
+        if self.sha256 is None:
+            LOGGER.warning('no checksum to verify the data of {} against '
+                           '(sha256 {})'.format(self.pkg, digest))
+        elif digest != self.sha256:
+            os.remove(archive)
+            if os.path.exists(archive + '.json'):
+                os.remove(archive + '.json')
+            raise DownloadError(
+                'Checksum mismatch for {}: expected {}, got {}'.format(
+                    self.pkg, self.sha256, digest))
+        return digest
+
+    @staticmethod
+    def _extract(archive, target):
+        """ Extract regular files and directories only, rejecting members
+        that would end up outside of `target` """
+        import tarfile
+        with tarfile.open(archive, 'r:*') as tar:
+            members = tar.getmembers()
+            for member in members:
+                name = os.path.normpath(member.name)
+                if os.path.isabs(name) or name == '..' or \
+                        name.startswith('..' + os.sep) or \
+                        not (member.isfile() or member.isdir()):
+                    raise DownloadError(
+                        'Unsafe member in archive: %s' % member.name)
+            tar.extractall(target, members=members)
+
+    def _write_manifest(self, directory, digest):
+        files = {}
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, directory)
+                if rel != MANIFEST_FILE_NAME:
+                    files[rel] = os.path.getsize(path)
+        manifest = {'pkg': self.pkg, 'url': self.url, 'sha256': digest,
+                    'files': files}
+        with open(os.path.join(directory, MANIFEST_FILE_NAME), 'w') as f:
+            json.dump(manifest, f)
+
+    def _install(self, tmp_dir):
+        """ Move the extracted data into place, replacing an incomplete
+        install (called with the lock held) """
+        if os.path.exists(self.download_dir):
+            shutil.rmtree(self.download_dir)
+        try:
+            os.rename(tmp_dir, self.download_dir)
+        except OSError:
+            # another process installed the data in the meantime
+            if not self.is_installed():
+                raise
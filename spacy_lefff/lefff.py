@@ -1,22 +1,192 @@
 # coding: utf8
 
 import os
+import json
 import logging
 import io
+import time
+import threading
 
-from spacy.tokens import Token
-from .mappings import SPACY_LEFFF_DIC, MELT_TO_LEFFF_DIC
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from .mappings import (SPACY_LEFFF_DIC, MELT_TO_LEFFF_DIC,
+                       SPACY_LEFFF_FALLBACKS, MELT_LEFFF_FALLBACKS)
+from .memory import resource_usage
+from . import serialization
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 LEFFF_FILE_NAME = 'lefff-3.4.mlex'
+CONFIG_FILE_NAME = 'config.json'
 LOGGER = logging.getLogger(__name__)
 
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
 
 class POSNotFoundError(KeyError):
     """Raised when no lemma was found"""
     pass
 
 
+def read_lefff(filepath):
+    """ (form, category) -> lemma mapping of a .mlex file """
+    lemma_dict = {}
+    with io.open(filepath, encoding='utf-8') as lefff_file:
+        for line in lefff_file:
+            els = line.split('\t')
+            lemma_dict[(els[0], els[1])] = els[2]
+    return lemma_dict
+
+
+def read_lefff_index(filepath):
+    """ form -> (category, lemma, category, lemma, ...) index of a .mlex
+    file: all the lemmas of a form are found in a single probe, and each
+    form, category and lemma string is stored once """
+    index = {}
+    strings = {}
+    with io.open(filepath, encoding='utf-8') as lefff_file:
+        for line in lefff_file:
+            els = line.split('\t')
+            form = els[0]
+            category = strings.setdefault(els[1], els[1])
+            lemma = els[2]
+            lemma = form if lemma == form else strings.setdefault(lemma,
+                                                                  lemma)
+            entries = index.get(form)
+            if entries is None:
+                index[form] = (category, lemma)
+            elif category in entries[::2]:
+                # the last line wins, as in read_lefff
+                i = entries[::2].index(category) * 2
+                index[form] = entries[:i + 1] + (lemma,) + entries[i + 2:]
+            else:
+                index[form] = entries + (category, lemma)
+    return index
+
+
+def _check_types(form, pos):
+    """ raise TypeError unless `form` is a string and `pos` a string or
+    None (no tag) """
+    if not isinstance(form, STRING_TYPES):
+        raise TypeError('form must be a string, not %s (%r)'
+                        % (type(form).__name__, form))
+    if pos is not None and not isinstance(pos, STRING_TYPES):
+        raise TypeError('POS tag must be a string or None, not %s (%r)'
+                        % (type(pos).__name__, pos))
+
+
+def _find(entries, ranks):
+    """ lemma of the best ranked category of (category, lemma, ...)
+    entries, given the {category: rank} of the categories tried, None if
+    there is none """
+    if len(entries) == 2:
+        # most forms have a single entry
+        return entries[1] if entries[0] in ranks else None
+    lemma = None
+    best = len(ranks)
+    for i in range(0, len(entries), 2):
+        rank = ranks.get(entries[i], best)
+        if rank < best:
+            best = rank
+            lemma = entries[i + 1]
+    return lemma
+
+
+class LemmaPairs(Mapping):
+    """ read-only (form, category) -> lemma view of a lemma index """
+
+    def __init__(self, index):
+        self.index = index
+        self._len = sum(len(entries) // 2 for entries in index.values())
+
+    def __getitem__(self, key):
+        form, category = key
+        lemma = _find(self.index.get(form, ()), {category: 0})
+        if lemma is None:
+            raise KeyError(key)
+        return lemma
+
+    def __iter__(self):
+        for form, entries in self.index.items():
+            for category in entries[::2]:
+                yield (form, category)
+
+    def __len__(self):
+        return self._len
+
+
+def _to_list(column):
+    """ list of the values of a sequence, NumPy or Arrow array """
+    for method in ('to_pylist', 'tolist'):
+        if hasattr(column, method):
+            return getattr(column, method)()
+    return list(column)
+
+
+def write_lefff(lemma_dict, filepath):
+    """ write a (form, category) -> lemma mapping as a .mlex file """
+    with io.open(filepath, 'w', encoding='utf-8') as lefff_file:
+        for (form, category), lemma in sorted(lemma_dict.items()):
+            lefff_file.write(u'%s\t%s\t%s\t\n' % (form, category, lemma))
+
+
+def read_delta_log(filepath):
+    """ (form, category) -> lemma mapping of the changes recorded in a
+    delta log, None marking a removed entry """
+    overlay = {}
+    if not os.path.exists(filepath):
+        return overlay
+    with io.open(filepath, 'rb') as log_file:
+        for n, line in enumerate(log_file):
+            try:
+                change = json.loads(line.decode('utf-8'))
+            except ValueError:
+                # a change interrupted while being written
+                LOGGER.warning('Skipping line %d of delta log %s',
+                               n + 1, filepath)
+                continue
+            if not isinstance(change, dict) or \
+                    ('add' not in change and 'remove' not in change):
+                # valid JSON, but not a change
+                LOGGER.warning('Skipping line %d of delta log %s: not a '
+                               'change', n + 1, filepath)
+                continue
+            if 'add' in change:
+                form, category, lemma = change['add']
+                overlay[(form, category)] = lemma
+            else:
+                form, category = change['remove']
+                overlay[(form, category)] = None
+    return overlay
+
+
+def append_delta_log(filepath, changes):
+    """ append ((form, category), lemma or None) changes to a delta log
+    """
+    with io.open(filepath, 'a+b') as log_file:
+        log_file.seek(0, os.SEEK_END)
+        if log_file.tell():
+            log_file.seek(-1, os.SEEK_END)
+            if log_file.read(1) != b'\n':
+                # end the line of a change interrupted while being written,
+                # which would swallow the first change appended
+                log_file.write(b'\n')
+        for (form, category), lemma in changes:
+            if lemma is None:
+                change = {'remove': [form, category]}
+            else:
+                change = {'add': [form, category, lemma]}
+            log_file.write((u'%s\n' % json.dumps(
+                change, ensure_ascii=False)).encode('utf-8'))
+        log_file.flush()
+        os.fsync(log_file.fileno())
+
+
 class LefffLemmatizer(object):
     """
     Lefff Lemmatizer based on Lefff's extension file .mlex
@@ -25,6 +195,21 @@ class LefffLemmatizer(object):
     morphological and syntactic lexicon for French.
     In Proceedings of the 7th international conference on Language Resources
     and Evaluation (LREC 2010), Istanbul, Turkey
+
+    The component can be saved with `to_disk`/`to_bytes`. Pickling it
+    only carries the path of the .mlex file it was loaded from.
+
+    Entries can be added and removed without reloading the lexicon, see
+    `add_entries`/`remove_entries`: they are kept in an overlay looked up
+    before the .mlex entries and, with `delta_log`, appended to a log
+    file replayed when the lexicon is loaded again.
+
+    The lemmas are indexed by form: a token is lemmatized with the first
+    Lefff category of its tag, in the order of `fallbacks` (spaCy POS ->
+    categories, `SPACY_LEFFF_FALLBACKS` by default) or `melt_fallbacks`
+    (lowercased MElt tag -> categories, `MELT_LEFFF_FALLBACKS` by default),
+    that has an entry for the form. Tags missing from these tables use
+    `SPACY_LEFFF_DIC` and `MELT_TO_LEFFF_DIC`.
     """
 
     name = 'lefff_lemma'
@@ -32,43 +217,293 @@ class LefffLemmatizer(object):
     def __init__(self, data_dir=DATA_DIR,
                  lefff_file_name=LEFFF_FILE_NAME,
                  after_melt=False,
-                 default=False):
+                 default=False,
+                 delta_log=None,
+                 fallbacks=None,
+                 melt_fallbacks=None):
         LOGGER.info('New LefffLemmatizer instantiated.')
+        self._register_extension()
+        self.after_melt = after_melt
+        self.default = default
+        self.delta_log = delta_log
+        self._set_fallbacks(fallbacks, melt_fallbacks)
+        self.load(os.path.join(data_dir, lefff_file_name))
+
+    def _register_extension(self):
+        from spacy.tokens import Token
         # register your new attribute token._.lefff_lemma
         if not Token.get_extension(self.name):
             Token.set_extension(self.name, default=None)
         else:
             LOGGER.info('Token {} already registered'.format(self.name))
-        # In memory lemma mapping
-        self.lemma_dict = {}
-        self.after_melt = after_melt
-        self.default = default
-        with io.open(os.path.join(data_dir, lefff_file_name),
-                     encoding='utf-8') as lefff_file:
-            LOGGER.info('Reading lefff data...')
-            for line in lefff_file:
-                els = line.split('\t')
-                self.lemma_dict[(els[0], els[1])] = els[2]
+
+    def _set_fallbacks(self, fallbacks=None, melt_fallbacks=None):
+        if fallbacks is None:
+            fallbacks = SPACY_LEFFF_FALLBACKS
+        if melt_fallbacks is None:
+            melt_fallbacks = MELT_LEFFF_FALLBACKS
+        # spaCy tags are uppercase, MElt tags lowercased
+        self.fallbacks = dict((tag.upper(), list(categories))
+                              for tag, categories in fallbacks.items())
+        self.melt_fallbacks = dict(
+            (tag.lower(), list(categories))
+            for tag, categories in melt_fallbacks.items())
+        # tag -> (categories, {category: rank}) of spaCy tags, and of MElt
+        # tags (with from_melt), see categories()
+        self._chains = ({}, {})
+
+    def categories(self, pos, from_melt=False):
+        """ Lefff categories tried in turn to lemmatize a token of POS
+        `pos` (a MElt tag with `from_melt`), whatever the case of the tag
+        """
+        return self._chain(pos, from_melt)[0]
+
+    def _chain(self, pos, from_melt=False):
+        chain = self._chains[1 if from_melt else 0].get(pos)
+        if chain is None:
+            try:
+                lower, upper = pos.lower(), pos.upper()
+            except AttributeError:
+                # not a tag, e.g. a missing value
+                lower = upper = pos
+            if from_melt:
+                if lower in self.melt_fallbacks:
+                    categories = tuple(self.melt_fallbacks[lower])
+                elif upper in MELT_TO_LEFFF_DIC:
+                    categories = (MELT_TO_LEFFF_DIC[upper],)
+                else:
+                    # MElt tags are also Lefff categories
+                    categories = (pos,)
+            elif upper in self.fallbacks:
+                categories = tuple(self.fallbacks[upper])
+            elif upper in SPACY_LEFFF_DIC:
+                categories = (SPACY_LEFFF_DIC[upper],)
+            else:
+                categories = ()
+            ranks = {}
+            for rank, category in enumerate(categories):
+                ranks.setdefault(category, rank)
+            chain = (categories, ranks)
+            self._chains[1 if from_melt else 0][pos] = chain
+        return chain
+
+    def load(self, filepath):
+        """ load the lemma index of a .mlex file """
+        LOGGER.info('Reading lefff data...')
+        t0 = time.time()
+        # In memory form -> (category, lemma, ...) index
+        self.lemma_index = read_lefff_index(filepath)
+        # load time (s) of each resource, see memory_usage
+        self.load_times = {'lemma_index': time.time() - t0}
+        # (form, category) -> lemma view of the index
+        self.lemma_dict = LemmaPairs(self.lemma_index)
+        # file the lemmas were loaded from, see __getstate__
+        self.lefff_file = os.path.abspath(filepath)
+        # added (lemma) and removed (None) entries, replaced as a whole on
+        # each change so that readers never see a partial update
+        self.overlay = {}
+        # form -> {category: lemma or None} changes of the overlay
+        self._overlay_forms = {}
+        self._overlay_lock = threading.Lock()
+        if self.delta_log is not None:
+            t0 = time.time()
+            self._set_overlay(read_delta_log(self.delta_log))
+            self.load_times['overlay'] = time.time() - t0
         LOGGER.info('Successfully loaded lefff lemmatizer')
 
+    def get(self, key, default=None):
+        """ lemma of a (form, category) pair, from the overlay or the
+        .mlex entries """
+        overlay = self.overlay
+        if key in overlay:
+            lemma = overlay[key]
+            return default if lemma is None else lemma
+        lemma = _find(self.lemma_index.get(key[0], ()), {key[1]: 0})
+        return default if lemma is None else lemma
+
+    def _entries(self, form):
+        """ (category, lemma, ...) entries of a form, from the overlay and
+        the .mlex entries """
+        entries = self.lemma_index.get(form, ())
+        overlay_forms = self._overlay_forms
+        # no second probe unless there are changes
+        changes = overlay_forms.get(form) if overlay_forms else None
+        if changes:
+            merged = dict(zip(entries[::2], entries[1::2]))
+            merged.update(changes)
+            entries = tuple(el for category, lemma in merged.items()
+                            if lemma is not None
+                            for el in (category, lemma))
+        return entries
+
+    def lemmas(self, form):
+        """ category -> lemma mapping of all the entries of a form """
+        entries = self._entries(form)
+        return dict(zip(entries[::2], entries[1::2]))
+
+    def add_entries(self, entries):
+        """ add (or replace) (form, category, lemma) entries """
+        self._update([((form, category), lemma)
+                      for form, category, lemma in entries])
+
+    def remove_entries(self, keys):
+        """ remove (form, category) entries """
+        self._update([((form, category), None) for form, category in keys])
+
+    def _update(self, changes):
+        with self._overlay_lock:
+            if self.delta_log is not None:
+                append_delta_log(self.delta_log, changes)
+            overlay = dict(self.overlay)
+            overlay.update(changes)
+            self._set_overlay(overlay)
+
+    def _set_overlay(self, overlay):
+        overlay_forms = {}
+        for (form, category), lemma in overlay.items():
+            overlay_forms.setdefault(form, {})[category] = lemma
+        self._overlay_forms = overlay_forms
+        self.overlay = overlay
+
+    def entries(self):
+        """ (form, category) -> lemma mapping of the .mlex entries with
+        the changes of the overlay applied """
+        lemma_dict = dict(self.lemma_dict)
+        for key, lemma in self.overlay.items():
+            if lemma is None:
+                lemma_dict.pop(key, None)
+            else:
+                lemma_dict[key] = lemma
+        return lemma_dict
+
+    @property
+    def config(self):
+        return {'after_melt': self.after_melt, 'default': self.default,
+                'fallbacks': self.fallbacks,
+                'melt_fallbacks': self.melt_fallbacks}
+
+    def to_disk(self, path, exclude=tuple(), **kwargs):
+        """ write the configuration and the lemmas to directory `path` """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with io.open(os.path.join(path, CONFIG_FILE_NAME), 'w',
+                     encoding='utf-8') as f:
+            f.write(u'%s' % json.dumps(self.config))
+        write_lefff(self.entries(), os.path.join(path, LEFFF_FILE_NAME))
+
+    def from_disk(self, path, exclude=tuple(), **kwargs):
+        """ load a directory written by `to_disk` """
+        self._register_extension()
+        with io.open(os.path.join(path, CONFIG_FILE_NAME),
+                     encoding='utf-8') as f:
+            config = json.load(f)
+        self.after_melt = config['after_melt']
+        self.default = config['default']
+        self._set_fallbacks(config.get('fallbacks'),
+                            config.get('melt_fallbacks'))
+        # the changes are part of the written entries
+        self.delta_log = None
+        self.load(os.path.join(path, LEFFF_FILE_NAME))
+        return self
+
+    def to_bytes(self, exclude=tuple(), **kwargs):
+        return serialization.to_bytes(self, exclude=exclude)
+
+    def from_bytes(self, bytes_data, exclude=tuple(), **kwargs):
+        serialization.from_bytes(self, bytes_data, exclude=exclude)
+        # the unpacked file is gone: pickle the data itself
+        self.lefff_file = None
+        return self
+
+    def __getstate__(self):
+        if self.lefff_file is None or (
+                self.overlay and self.delta_log is None):
+            return {'config': self.config, 'bytes': self.to_bytes()}
+        return {'config': self.config, 'lefff_file': self.lefff_file,
+                'delta_log': self.delta_log}
+
+    def __setstate__(self, state):
+        if state.get('lefff_file') is None:
+            self.from_bytes(state['bytes'])
+            return
+        self._register_extension()
+        self.after_melt = state['config']['after_melt']
+        self.default = state['config']['default']
+        self._set_fallbacks(state['config'].get('fallbacks'),
+                            state['config'].get('melt_fallbacks'))
+        self.delta_log = state.get('delta_log')
+        self.load(state['lefff_file'])
+
     def lemmatize(self, text, pos, from_melt=False):
+        """ lemma of form `text` for POS `pos` (a MElt tag with
+        `from_melt`, None if untagged), None (or the form with `default`)
+        if there is none. Raises TypeError for a form that isn't a string
+        or a tag that isn't a string or None. """
+        _check_types(text, pos)
         text = text.lower() if pos != 'PROPN' else text
-        try:
-            if from_melt:
-                if pos in MELT_TO_LEFFF_DIC:
-                    pos = MELT_TO_LEFFF_DIC[pos]
-                return self.lemma_dict[(text, pos)]
-            else:
-                if (pos in SPACY_LEFFF_DIC) and (
-                        (text, SPACY_LEFFF_DIC[pos]) in self.lemma_dict):
-                    return self.lemma_dict[(text, SPACY_LEFFF_DIC[pos])]
-                else:
-                    raise POSNotFoundError
-        except:
+        lemma = self._lookup(text, pos, from_melt)
+        if lemma is None and self.default:
             # if nothing was matched in leff lemmatizer, notify it
-            if self.default:
-                return text
-            return None
+            return text
+        return lemma
+
+    def _lookup(self, text, pos, from_melt=False):
+        """ lemma of a form for a tag (of checked types), None if there is
+        none """
+        chain = self._chains[1 if from_melt else 0].get(pos) or \
+            self._chain(pos, from_melt)
+        if self._overlay_forms:
+            return _find(self._entries(text), chain[1])
+        return _find(self.lemma_index.get(text, ()), chain[1])
+
+    def lemmatize_batch(self, forms, tags, from_melt=False):
+        """
+        Lemmatize parallel columns of forms and POS tags: spaCy tags, or
+        MElt tags (as set by `POSTagger`) with `from_melt`. Columns can be
+        sequences, NumPy arrays or Arrow arrays.
+
+        Returns the lemma column, as a NumPy object array holding None (or
+        the form with `default`) where no lemma was found, and the boolean
+        mask of the found lemmas. Each distinct (form, tag) pair is looked
+        up once. A form of None is a missing value, and other forms and
+        tags raise TypeError as in `lemmatize`.
+        """
+        import numpy as np
+        forms = _to_list(forms)
+        tags = _to_list(tags)
+        if len(forms) != len(tags):
+            raise ValueError('forms and tags must have the same length '
+                             '({} != {})'.format(len(forms), len(tags)))
+        # index of the distinct (form, tag) pair of each row
+        pairs = {}
+        codes = np.array([pairs.setdefault(pair, len(pairs))
+                          for pair in zip(forms, tags)], dtype=np.int64)
+        lemmas = np.empty(len(pairs), dtype=object)
+        found = np.zeros(len(pairs), dtype=bool)
+        for (form, tag), code in pairs.items():
+            if form is None:
+                # missing value
+                continue
+            _check_types(form, tag)
+            if from_melt and tag:
+                tag = tag.lower()
+            text = form.lower() if tag != 'PROPN' else form
+            lemma = self._lookup(text, tag, from_melt)
+            found[code] = lemma is not None
+            if lemma is None and self.default:
+                lemma = text
+            lemmas[code] = lemma
+        return lemmas[codes], found[codes]
+
+    def memory_usage(self):
+        """ approximate size, number of entries (forms) and load time of
+        the lemma index and of its overlay """
+        return {
+            'lemma_index': resource_usage(
+                self.lemma_index, self.load_times.get('lemma_index')),
+            'overlay': resource_usage(
+                self.overlay, self.load_times.get('overlay')),
+        }
 
     def __call__(self, doc):
         for token in doc:
@@ -0,0 +1,109 @@
+# coding: utf8
+"""
+Export of the Lefff lemmas to spaCy's lookup tables (spaCy >= 2.2).
+
+    install_lookups(nlp, LefffLemmatizer())
+    nlp(u"Les abaissements de température")[1].lemma_  # abaissement
+
+The tables follow the layout of spaCy's rule-based lemmatizer:
+`lemma_exc` maps each Universal POS (lowercased) to a form -> [lemma]
+table, built with the categories `LefffLemmatizer.categories` gives for
+that POS (`SPACY_LEFFF_DIC` and its fallbacks), and `lemma_lookup` maps
+each form to a [lemma] whatever its POS (spaCy's French lemmatizer reads
+the first item of both). `lemma_rules` and `lemma_index`
+are empty: spaCy falls back to the form itself for unknown forms, as
+`LefffLemmatizer(default=True)` does.
+"""
+
+import logging
+
+from .mappings import SPACY_LEFFF_DIC
+
+LOGGER = logging.getLogger(__name__)
+
+TABLE_NAMES = ['lemma_lookup', 'lemma_exc', 'lemma_index', 'lemma_rules']
+# POS whose categories are tried in turn to fill lemma_lookup
+LOOKUP_POS_ORDER = ['NOUN', 'VERB', 'ADJ', 'ADV', 'DET', 'PRON', 'ADP',
+                    'CCONJ', 'SCONJ', 'AUX', 'PUNCT', 'PROPN']
+
+
+def _first_lemma(lemmas, categories):
+    for category in categories:
+        lemma = lemmas.get(category)
+        if lemma is not None:
+            return lemma
+    return None
+
+
+def lookups_tables(lemmatizer):
+    """ {table name: data} of spaCy lookup tables holding the lemmas of
+    `lemmatizer`, with the changes of its overlay applied """
+    pos_list = sorted(set(SPACY_LEFFF_DIC) | set(lemmatizer.fallbacks))
+    chains = dict((pos, lemmatizer.categories(pos)) for pos in pos_list)
+    lookup_chain = []
+    for pos in LOOKUP_POS_ORDER + pos_list:
+        for category in chains.get(pos, ()):
+            if category not in lookup_chain:
+                lookup_chain.append(category)
+    exc = dict((pos.lower(), {}) for pos in pos_list)
+    lookup = {}
+    forms = set(lemmatizer.lemma_index)
+    forms.update(form for form, _ in lemmatizer.overlay)
+    for form in forms:
+        lemmas = lemmatizer.lemmas(form)
+        if not lemmas:
+            continue
+        lemma = _first_lemma(lemmas, lookup_chain)
+        if lemma is not None:
+            lookup[form] = [lemma]
+        lowercase = form == form.lower()
+        for pos in pos_list:
+            # the lemmatizer lowercases all forms but proper nouns
+            if pos != 'PROPN' and not lowercase:
+                continue
+            lemma = _first_lemma(lemmas, chains[pos])
+            if lemma is not None:
+                exc[pos.lower()][form] = [lemma]
+    return {
+        'lemma_lookup': lookup,
+        'lemma_exc': exc,
+        'lemma_index': dict((pos, []) for pos in exc),
+        'lemma_rules': dict((pos, []) for pos in exc),
+    }
+
+
+def to_lookups(lemmatizer):
+    """ spaCy `Lookups` holding the lemma tables of `lemmatizer`, which can
+    be saved with its `to_disk` """
+    try:
+        from spacy.lookups import Lookups
+    except ImportError:
+        raise ImportError('spaCy lookup tables need spaCy >= 2.2')
+    lookups = Lookups()
+    for name, data in sorted(lookups_tables(lemmatizer).items()):
+        lookups.add_table(name, data)
+    return lookups
+
+
+def install_lookups(nlp, lemmatizer=None):
+    """ replace the lemma tables of `nlp`'s vocab with the lemmas of
+    `lemmatizer` (a new `LefffLemmatizer` by default), so that spaCy's
+    own lemmatizer sets `token.lemma_` from Lefff; returns the vocab's
+    `Lookups`
+
+    Lemmas are cached by spaCy once computed: install the tables before
+    processing any text. """
+    if lemmatizer is None:
+        from .lefff import LefffLemmatizer
+        lemmatizer = LefffLemmatizer()
+    lookups = getattr(nlp.vocab, 'lookups', None)
+    if lookups is None:
+        raise ImportError('spaCy lookup tables need spaCy >= 2.2')
+    tables = lookups_tables(lemmatizer)
+    for name in TABLE_NAMES:
+        if lookups.has_table(name):
+            lookups.remove_table(name)
+        lookups.add_table(name, tables[name])
+    LOGGER.info('Installed %d Lefff lemmas in the spaCy lookup tables',
+                len(tables['lemma_lookup']))
+    return lookups
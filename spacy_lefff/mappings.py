@@ -41,3 +41,84 @@ MELT_TO_LEFFF_DIC = {
     "PROWH": 'pro',
     "PUNCT": 'poncts'
 }
+
+MELT_TO_UPOS_DIC = {
+    "ADJ": 'ADJ',
+    "ADJWH": 'ADJ',
+    "ADV": 'ADV',
+    "ADVWH": 'ADV',
+    "CC": 'CCONJ',
+    "CLO": 'PRON',
+    "CLR": 'PRON',
+    "CLS": 'PRON',
+    "CS": 'SCONJ',
+    "DET": 'DET',
+    "DETWH": 'DET',
+    "ET": 'X',
+    "I": 'INTJ',
+    "NC": 'NOUN',
+    "NPP": 'PROPN',
+    "P": 'ADP',
+    "P+D": 'ADP',
+    "P+PRO": 'ADP',
+    "PONCT": 'PUNCT',
+    "PREF": 'X',
+    "PRO": 'PRON',
+    "PROREL": 'PRON',
+    "PROWH": 'PRON',
+    "V": 'VERB',
+    "VIMP": 'VERB',
+    "VINF": 'VERB',
+    "VPP": 'VERB',
+    "VPR": 'VERB',
+    "VS": 'VERB'
+}
+
+# Lefff categories tried in turn to lemmatize a token, by spaCy POS: the
+# category of SPACY_LEFFF_DIC first, then the other ones the POS covers
+SPACY_LEFFF_FALLBACKS = {
+    'ADJ': ['adj', 'v'],
+    'ADP': ['det', 'prep'],
+    'ADV': ['adv', 'advneg'],
+    'AUX': ['auxAvoir', 'auxEtre', 'v'],
+    'CCONJ': ['coo'],
+    'DET': ['det'],
+    'PRON': ['cln', 'pro', 'prel', 'pri', 'cla', 'cld', 'clr', 'cll',
+             'clar', 'cldr', 'clg', 'ilimp', 'ce'],
+    'PROPN': ['np'],
+    'NOUN': ['nc'],
+    'SCONJ': ['csu', 'que'],
+    'VERB': ['v', 'auxAvoir', 'auxEtre'],
+    'PUNCT': ['poncts', 'ponctw']
+}
+
+# Lefff categories tried in turn to lemmatize a token, by (lowercased)
+# MElt tag
+MELT_LEFFF_FALLBACKS = {
+    "adj": ['adj', 'v'],
+    "adjwh": ['adj'],
+    "adv": ['adv', 'advneg'],
+    "advwh": ['adv'],
+    "cc": ['coo'],
+    "clo": ['cla', 'cld', 'cll', 'clar', 'cldr', 'clg'],
+    "clr": ['clr'],
+    "cls": ['cln', 'ilimp', 'ce'],
+    "cs": ['csu', 'que'],
+    "det": ['det'],
+    "detwh": ['det'],
+    "nc": ['nc'],
+    "npp": ['np'],
+    "p": ['prep'],
+    "p+d": ['prep', 'det'],
+    "p+pro": ['prep', 'prel'],
+    "ponct": ['poncts', 'ponctw'],
+    "pro": ['pro'],
+    "prorel": ['prel', 'pro'],
+    "prowh": ['pri', 'pro'],
+    "v": ['v', 'auxAvoir', 'auxEtre'],
+    "vimp": ['v'],
+    "vinf": ['v'],
+    "vpp": ['v', 'adj'],
+    "vpr": ['v'],
+    "vs": ['v', 'auxAvoir', 'auxEtre']
+}
@@ -22,13 +22,11 @@ import os
 import sys
 import re
 import math
-import tempfile
 import codecs
-import operator
 import time
-import optparse
 import unicodedata
-import subprocess
+import threading
+import itertools
 from collections import defaultdict
 import logging
 
@@ -44,167 +42,790 @@ import numpy as np
 
 from json import dumps, loads
 import io
-from spacy.tokens import Token as tk
 from .lefff import LefffLemmatizer
-from .downloader import Downloader
+from .downloader import Downloader, get_data_dir
+from .mappings import MELT_TO_UPOS_DIC
+from .memory import resource_usage
+from . import serialization
+from .profiles import (DEFAULT_PROFILE, PROFILES, feat_select_options,
+                       ProfileMismatchError, check_profile)
 
 LOGGER = logging.getLogger(__name__)
 
 PACKAGE = 'tagger'
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-MODELS_DIR = os.path.join(DATA_DIR, PACKAGE, 'models/fr')
+MODELS_SUBDIR = 'models/fr'
+# models directory in the data directory (package data or $SPACY_LEFFF_DATA)
+MODELS_DIR = os.path.join(get_data_dir(), PACKAGE, MODELS_SUBDIR)
 
 LEXICON_FILE = os.path.join(MODELS_DIR, 'lexicon.json')
 TAG_DICT = os.path.join(MODELS_DIR, 'tag_dict.json')
 
 URL_MODEL = 'https://www.dropbox.com/s/xjn863wq4599vur/model.tar.gz?dl=1'
+# expected sha256 of the model archive (None: not verified, a warning is
+# logged and the digest is only recorded in the manifest)
+MODEL_SHA256 = None
+# files a complete model install must provide
+MODEL_FILES = [os.path.join(MODELS_SUBDIR, name) for name in (
+    'lexicon.json', 'tag_dict.json', 'classes.json', 'feature_map.json',
+    'weights.npy', 'bias_weights.npy')]
 
-# extra options dict for feature selection
-feat_select_options = {
-    # previous default values
-    # 'win':2, # context window size
-    # 'pwin':2, # context window size for predicted tags (left context)
-    # 'lex_wd':1, # lefff current word features
-    # 'lex_lhs':1, # lefff LHS context features
-    # 'lex_rhs':1, # lefff RHS context features
-    # 'pln':4,
-    # 'sln':4,
-    # 'rpln':1,
-    # 'rsln':0,
-    # 'ffthrsld':2, # min feat occ: will discard any features occurring (strictly) less than ffthrsld times in the training data
-    # 'norm':0, # normalization (0=none, 1=L1, 2=L2)
-    # new default values (Sagot HDR)
-    'win': 2,  # context window size
-    'pwin': 2,  # context window size for predicted tags (left context)
-    'lex_wd': 1,  # lefff current word features
-    'lex_lhs': 1,  # lefff LHS context features
-    'lex_rhs': 1,  # lefff RHS context features
-    'pln': 4,
-    'sln': 5,
-    'rpln': 3,
-    'rsln': 3,
-    'ffthrsld': 1,  # min feat occ: will discard any features occurring (strictly) less than ffthrsld times in the training data
-    'norm': 0,  # normalization (0=none, 1=L1, 2=L2)
+
+def save_plain_weights(directory):
+    """ re-save the pickled weights.npy/bias_weights.npy files found under
+    `directory` (as in the hosted model archive) as plain .npy arrays,
+    which np.load can memory-map; returns the paths of the files
+    converted """
+    converted = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name not in ('weights.npy', 'bias_weights.npy'):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                if f.read(len(np.lib.format.MAGIC_PREFIX)) == \
+                        np.lib.format.MAGIC_PREFIX:
+                    continue
+            array = np.asarray(np.load(path, allow_pickle=True,
+                                       encoding='latin1'))
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+            os.remove(path)
+            os.rename(tmp_path, path)
+            converted.append(path)
+    if converted:
+        LOGGER.info('  TAGGER: Saved %d pickled weight files as plain .npy '
+                    'arrays', len(converted))
+    return converted
+
+
+def download_model(data_dir=None):
+    """ download and install the MElt model in `data_dir` (see
+    `get_data_dir`) unless it is already there """
+    return Downloader(PACKAGE, url=URL_MODEL, download_dir=data_dir,
+                      sha256=MODEL_SHA256, required_files=MODEL_FILES,
+                      prepare=save_plain_weights)
+
+
+# files of a bundle written by POSTagger.to_disk
+CONFIG_FILE_NAME = 'config.json'
+BUNDLE_FILES = {
+    'lexicon': 'lexicon.json',
+    'tag_dict': 'tag_dict.json',
+    'model': 'model',
 }
 
+# keys of the (classes, array) pairs stored in doc.user_data: tag ids of
+# the tokens, and their tag probability distributions (float32, only with
+# print_probas)
+TAGS_KEY = 'melt_tags'
+PROBAS_KEY = 'melt_probas'
+# key of the decoding a doc was tagged with under a time budget (see
+# DEGRADATION_LEVELS), stored in doc.user_data
+DEGRADATION_KEY = 'melt_degradation'
+
+# decodings stepped down to when a time budget runs short: the full beam,
+# a beam half as wide (at least 2, see beam_widths), a single hypothesis,
+# and the most likely tag of each word according to the lexicons
+DEGRADATION_LEVELS = ('beam', 'narrow_beam', 'greedy', 'lexicon')
+LEXICON_LEVEL = DEGRADATION_LEVELS.index('lexicon')
+
+# profile a model was trained for, stored in its directory along with its
+# evaluation
+PROFILE_FILE_NAME = 'profile.json'
+
 ############################ pos_tagger.py ############################
 
 
 class POSTagger(Downloader):
+    """
+    MElt part-of-speech tagger, usable as a spaCy pipeline component.
+
+    MElt tags are stored in bulk as an array of tag ids in `doc.user_data`,
+    read and written through the `token._.melt_tagger` extension. With
+    `set_tag=True` (resp. `set_pos=True`), they are also written to spaCy's
+    native `TAG` attribute (resp. mapped to a coarse `POS`) through
+    `doc.from_array`.
+
+    Decoding state is local to each call, so with `thread_safe=True` a
+    single instance can be shared by several threads: the only state
+    shared between calls, the per-word feature cache, is then guarded by
+    lock striping (see `FeatureCache`). The NumPy scoring of a position is
+    done for all beam hypotheses at once, which releases the GIL for the
+    bulk of the arithmetic.
+
+    The component can be saved with `to_disk`/`to_bytes` (spaCy's
+    serialization protocol). Pickling it only carries the paths of the
+    files its resources were loaded from: the receiving process loads them
+    again, with the weights memory-mapped, without going through the
+    download check of `__init__`.
+
+    With `time_budget` (in seconds), tagging a doc steps down to faster
+    decodings when the budget is about to run out (see
+    `tag_token_sequence_budget`).
+
+    With `constrained_softmax`, the tags of a word found in the lexicons
+    are scored and normalized on their own, without computing the scores
+    of the other tags (see `MaxEntClassifier.class_distributions`).
+
+    The lexicons, model and feature cache form an immutable
+    `ModelSnapshot`, which each call reads once: reloading a resource, or
+    swapping in a whole new model with `swap`/`swap_async`, replaces the
+    snapshot at once, and calls in progress finish with the one they
+    started with.
+    """
 
     name = 'melt_tagger'
-    
+    probas_name = 'melt_probas'
+
     def __init__(
             self,
-            data_dir=DATA_DIR,
-            lexicon_file_name=LEXICON_FILE,
-            tag_file_name=TAG_DICT,
-            print_probas=False):
+            data_dir=None,
+            lexicon_file_name=None,
+            tag_file_name=None,
+            print_probas=False,
+            thread_safe=False,
+            set_tag=False,
+            set_pos=False,
+            profile=None,
+            time_budget=None,
+            constrained_softmax=False):
         super(
             POSTagger,
             self).__init__(
             PACKAGE,
             url=URL_MODEL,
-            download_dir=DATA_DIR)
+            download_dir=data_dir,
+            sha256=MODEL_SHA256,
+            required_files=MODEL_FILES,
+            prepare=save_plain_weights)
+        self.models_dir = os.path.join(self.download_dir, MODELS_SUBDIR)
+        lexicon_file_name = lexicon_file_name or os.path.join(
+            self.models_dir, 'lexicon.json')
+        tag_file_name = tag_file_name or os.path.join(
+            self.models_dir, 'tag_dict.json')
+        self._register_extensions()
+        self._configure(print_probas=print_probas,
+                        thread_safe=thread_safe,
+                        set_tag=set_tag,
+                        set_pos=set_pos,
+                        profile=profile,
+                        time_budget=time_budget,
+                        constrained_softmax=constrained_softmax)
+        self.load_lexicon(lexicon_file_name)
+        self.load_tag_dictionary(tag_file_name)
+        self.load_model()
+        return
+
+    @classmethod
+    def from_files(cls, lexicon_file_name, tag_file_name, model_path,
+                   mmap=True, **config):
+        """ tagger loading the given lexicon, tag dictionary and model
+        directory, without the download check of __init__. The profile
+        defaults to the one the model was trained for. """
+        if config.get('profile') is None:
+            profile_info = read_profile(model_path) or {}
+            config['profile'] = profile_info.get('name') or \
+                profile_info.get('feat_options')
+        tagger = cls.__new__(cls)
+        tagger._restore({'lexicon': lexicon_file_name,
+                         'tag_dict': tag_file_name,
+                         'model': model_path}, config, mmap=mmap)
+        return tagger
+
+    def _restore(self, files, config, mmap=True):
+        self.models_dir = None
+        self._register_extensions()
+        self._configure(**config)
+        self._load_files(files, mmap=mmap)
+
+    def _register_extensions(self):
+        from spacy.tokens import Token as tk
         if not tk.get_extension(self.name):
-            tk.set_extension(self.name, default=None)
+            tk.set_extension(self.name, getter=get_melt_tag,
+                             setter=set_melt_tag)
         else:
             LOGGER.info('Token {} already registered'.format(self.name))
-        LOGGER.info("  TAGGER: Loading lexicon...")
-        self.lex_dict = unserialize(lexicon_file_name)
-        LOGGER.info("  TAGGER: Loading tags...")
-        self.tag_dict = unserialize(tag_file_name)
-        self.classifier = MaxEntClassifier()
-        self.cache = {}
-        self.load_model()
-        # print the probability of the tag along to the tag itself
+        # token._.melt_probas: {tag: probability}, built on access (None
+        # unless print_probas)
+        if not tk.get_extension(self.probas_name):
+            tk.set_extension(self.probas_name, getter=get_melt_probas)
+
+    def _configure(self, print_probas=False, thread_safe=False,
+                   set_tag=False, set_pos=False, profile=None,
+                   time_budget=None, constrained_softmax=False):
+        # feature templates, which the model must have been trained for:
+        # the name of a profile, or custom feature options
+        profile = profile or DEFAULT_PROFILE
+        if isinstance(profile, dict):
+            self.feat_options = dict(profile)
+        elif profile in PROFILES:
+            self.feat_options = PROFILES[profile]
+        else:
+            raise ValueError('Unknown profile %s (expected one of %s)' % (
+                profile, ', '.join(sorted(PROFILES))))
+        self.profile = profile
+        # print the probability of the tag along to the tag itself, and
+        # keep the tag distributions of the tokens (token._.melt_probas)
         self.print_probas = print_probas
-        return
+        self.thread_safe = thread_safe
+        self.snapshot = ModelSnapshot(
+            cache=FeatureCache(thread_safe=thread_safe))
+        # write tags to the native TAG/POS attributes
+        self.set_tag = set_tag
+        self.set_pos = set_pos
+        # default time budget (s) of tagging a doc
+        self.time_budget = time_budget
+        # normalize the scores over the legal classes of a word only
+        self.constrained_softmax = constrained_softmax
+
+    @property
+    def config(self):
+        return {
+            'print_probas': self.print_probas,
+            'thread_safe': self.thread_safe,
+            'set_tag': self.set_tag,
+            'set_pos': self.set_pos,
+            'profile': self.profile,
+            'time_budget': self.time_budget,
+            'constrained_softmax': self.constrained_softmax,
+        }
 
-    def load_model(self, model_path=MODELS_DIR):
+    # resources of the current snapshot
+    lex_dict = property(lambda self: self.snapshot.lex_dict)
+    tag_dict = property(lambda self: self.snapshot.tag_dict)
+    classifier = property(lambda self: self.snapshot.classifier)
+    cache = property(lambda self: self.snapshot.cache)
+    # files the resources were loaded from, see __getstate__
+    files = property(lambda self: self.snapshot.files)
+    # load time (s) of each resource, see memory_usage
+    load_times = property(lambda self: self.snapshot.load_times)
+    profile_info = property(lambda self: self.snapshot.profile_info)
+
+    def load_model(self, model_path=None, mmap=False):
+        """ load a model directory, checking that it was trained for the
+        feature templates of the profile (ProfileMismatchError). A model
+        trained for the default profile is pruned to the templates of a
+        faster one. Reloads the current model by default. Raises
+        ModelLoadError, keeping the current model, when the model can't be
+        loaded. """
+        model_path = model_path or self.files.get('model')
+        if model_path is None:
+            if isinstance(self.profile, dict):
+                raise ProfileMismatchError(
+                    'No model given for the feature options %s' %
+                    self.feat_options)
+            model_path = profile_model_dir(self.models_dir, self.profile)
+            if not os.path.isdir(model_path):
+                # no model trained for the profile: prune the default one
+                model_path = profile_model_dir(self.models_dir,
+                                               DEFAULT_PROFILE)
+        classifier = MaxEntClassifier()
         try:
-            self.classifier.load(model_path)
+            classifier.load(model_path, mmap_mode='r' if mmap else None)
+            classifier.check()
         except Exception as e:
-            sys.exit(
-                "Error: Failure load POS model from %s (%s)" %
-                (model_path, e))
+            raise ModelLoadError(
+                "Failure to load POS model from %s (%s)" % (model_path, e))
+        profile_info = read_profile(model_path)
+        # models without a profile file were trained for the default
+        # templates
+        trained_for = (profile_info or {}).get('name', DEFAULT_PROFILE)
+        if trained_for == DEFAULT_PROFILE and \
+                not isinstance(self.profile, dict) and \
+                self.profile != DEFAULT_PROFILE:
+            from .train import prune_to_profile
+            LOGGER.warning(
+                "  TAGGER: No model trained for profile '%s', pruning the "
+                "model of profile '%s' (%s): train one with `spacy-lefff "
+                "train CORPUS -o %s --profile %s` for a better accuracy",
+                self.profile, DEFAULT_PROFILE, model_path,
+                profile_model_dir(self.models_dir or model_path,
+                                  self.profile), self.profile)
+            prune_to_profile(classifier, self.feat_options)
+            profile_info = {'name': self.profile,
+                            'feat_options': self.feat_options,
+                            'pruned_from': os.path.abspath(model_path)}
+        elif profile_info is not None or self.profile != DEFAULT_PROFILE:
+            check_profile(classifier.feature2int, self.feat_options,
+                          profile_info)
+        self.snapshot = self.snapshot.replace(
+            classifier=classifier,
+            profile_info=profile_info,
+            files=dict(self.files, model=os.path.abspath(model_path)))
         return
 
+    def _load_files(self, files, mmap=True):
+        self.snapshot = ModelSnapshot(
+            cache=FeatureCache(thread_safe=self.thread_safe))
+        self.load_lexicon(files['lexicon'])
+        self.load_tag_dictionary(files['tag_dict'])
+        self.load_model(files['model'], mmap=mmap)
+
+    def swap(self, lexicon_file_name=None, tag_file_name=None,
+             model_path=None, mmap=False):
+        """ load the given lexicon, tag dictionary and/or model directory
+        (keeping the current resources for the others) into a new
+        snapshot, check it by tagging a sentence, and make it the current
+        one. On failure, the current snapshot stays in use and the error
+        is raised. Returns the new snapshot. """
+        # load through a copy of the tagger, whose loads replace its own
+        # snapshot only
+        staged = object.__new__(type(self))
+        staged.__dict__.update(self.__dict__)
+        if lexicon_file_name is not None:
+            staged.load_lexicon(lexicon_file_name)
+        if tag_file_name is not None:
+            staged.load_tag_dictionary(tag_file_name)
+        if model_path is not None:
+            staged.load_model(model_path, mmap=mmap)
+        try:
+            staged.tag_sentences([SMOKE_TEST_SENTENCE])
+        except Exception as e:
+            raise ModelLoadError('Failure to tag with the new model (%s: %s)'
+                                 % (type(e).__name__, e))
+        self.snapshot = staged.snapshot
+        LOGGER.info('  TAGGER: Swapped in model %s', self.files.get('model'))
+        return self.snapshot
+
+    def swap_async(self, lexicon_file_name=None, tag_file_name=None,
+                   model_path=None, mmap=False, callback=None):
+        """ `swap` in a background thread, which is returned. When done,
+        `callback(snapshot, error)` is called with the new snapshot, or the
+        error (logged as well) that kept the current one in use. """
+        def run():
+            snapshot, error = None, None
+            try:
+                snapshot = self.swap(lexicon_file_name, tag_file_name,
+                                     model_path, mmap=mmap)
+            except Exception as e:
+                LOGGER.error('  TAGGER: Model swap failed: %s', e)
+                error = e
+            if callback is not None:
+                callback(snapshot, error)
+
+        thread = threading.Thread(target=run, name='melt-swap')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def to_disk(self, path, exclude=tuple(), **kwargs):
+        """ write the configuration, lexicons and model to directory
+        `path` (the weights as .npy files, which can be memory-mapped)
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        model_dir = os.path.join(path, BUNDLE_FILES['model'])
+        if not os.path.exists(model_dir):
+            os.makedirs(model_dir)
+        serialize(self.config, os.path.join(path, CONFIG_FILE_NAME))
+        if self.profile_info is not None:
+            serialize(self.profile_info,
+                      os.path.join(model_dir, PROFILE_FILE_NAME))
+        serialize(self.lex_dict, os.path.join(path, BUNDLE_FILES['lexicon']))
+        serialize(self.tag_dict,
+                  os.path.join(path, BUNDLE_FILES['tag_dict']))
+        self.classifier.dump(model_dir)
+
+    def from_disk(self, path, exclude=tuple(), mmap=True, **kwargs):
+        """ load a directory written by `to_disk`, memory-mapping the
+        weights unless `mmap` is False """
+        self._register_extensions()
+        self._configure(**unserialize(os.path.join(path, CONFIG_FILE_NAME)))
+        self._load_files(dict((name, os.path.join(path, filename))
+                              for name, filename in BUNDLE_FILES.items()),
+                         mmap=mmap)
+        return self
+
+    def to_bytes(self, exclude=tuple(), **kwargs):
+        return serialization.to_bytes(self, exclude=exclude)
+
+    def from_bytes(self, bytes_data, exclude=tuple(), **kwargs):
+        serialization.from_bytes(self, bytes_data, exclude=exclude)
+        # the unpacked files are gone: pickle the data itself
+        self.snapshot = self.snapshot.replace(files={})
+        return self
+
+    def __getstate__(self):
+        if set(self.files) != set(BUNDLE_FILES):
+            return {'config': self.config, 'bytes': self.to_bytes()}
+        return {'config': self.config, 'files': dict(self.files)}
+
+    def __setstate__(self, state):
+        if 'files' in state:
+            self._restore(state['files'], state['config'])
+        else:
+            self.models_dir = None
+            self.from_bytes(state['bytes'])
+
     def tag_token_sequence(
             self,
             tokens,
-            feat_options=feat_select_options,
+            feat_options=None,
             beam_size=3):
         ''' N-best breath search for the best tag sequence for each sentence'''
-        # maintain N-best sequences of tagged tokens
-        sequences = [([], 0.0)]  # log prob.
+        return self.tag_token_sequences([tokens],
+                                        feat_options=feat_options,
+                                        beam_size=beam_size)[0]
+
+    def tag_token_sequences(
+            self,
+            sentences,
+            feat_options=None,
+            beam_size=3):
+        ''' N-best breath search run in lockstep over a batch of sentences:
+        at each position, the hypotheses of every sentence still being
+        decoded are scored together in a single classifier call'''
+        # return sequence with highest prob. for each sentence
+        results = []
+        for tokens, (table, hyp) in zip(
+                sentences, self._decode(sentences, feat_options, beam_size)):
+            best_sequence = []
+            for token in reversed(tokens):
+                best_sequence.append(Token(
+                    string=token.string,
+                    pos=token.pos,
+                    comment=token.comment,
+                    wasCap=token.wasCap,
+                    label=table.classes[hyp.label],
+                    proba=float(hyp.proba),
+                    distribs=table,
+                    distrib_row=hyp.distrib_row))
+                hyp = hyp.parent
+            best_sequence.reverse()
+            results.append(best_sequence)
+        return results
+
+    def _decode(self, sentences, feat_options=None, beam_size=3,
+                snapshot=None):
+        ''' beam search over a batch of sentences, returning the
+        distribution table and best final hypothesis of each one '''
+        feat_options = feat_options or self.feat_options
+        snapshot = snapshot or self.snapshot
+        classes = snapshot.classifier.classes
+        lwin = max(feat_options.get('win', 2), feat_options.get('pwin', 2))
+        # maintain N-best hypotheses for each sentence, each one pointing
+        # back to the hypothesis it extends
+        beams = [[Hypothesis()] for _ in sentences]
+        # distribution of hypothesis j at position i: row i * beam_size + j
+        tables = [DistributionTable(classes, len(tokens) * beam_size)
+                  for tokens in sentences]
+        # per-token attributes used by the feature templates
+        attrs = [TokenAttributes(tokens, snapshot.lex_dict,
+                                 snapshot.tag_dict, feat_options,
+                                 snapshot.cache)
+                 for tokens in sentences]
+        max_len = max([len(tokens) for tokens in sentences] or [0])
+        for i in range(max_len):
+            active = [k for k, tokens in enumerate(sentences)
+                      if i < len(tokens)]
+            feature_vectors = []
+            legal = [snapshot.legal_classes(sentences[k][i].string)
+                     for k in active]
+            for k in active:
+                tokens = sentences[k]
+                # cache static features
+                cached_inst = Instance(label=tokens[i].label,
+                                       index=i, tokens=tokens,
+                                       feat_selection=feat_options,
+                                       lex_dict=snapshot.lex_dict,
+                                       tag_dict=snapshot.tag_dict,
+                                       cache=snapshot.cache,
+                                       attrs=attrs[k])
+                cached_inst.get_static_features()
+                for hyp in beams[k]:
+                    prev_labels = [classes[c]
+                                   for c in hyp.history(lwin)]
+                    feature_vectors.append(
+                        cached_inst.fv +
+                        cached_inst.sequential_features(prev_labels))
+            # classify the current token of every hypothesis at once
+            distributions = snapshot.classifier.class_distributions(
+                feature_vectors, self._row_legal_classes(
+                    [len(beams[k]) for k in active], legal))
+            row = 0
+            for k, legal_k in zip(active, legal):
+                beam = beams[k]
+                beams[k] = extend_beam(
+                    beam, distributions[row:row + len(beam)], legal_k,
+                    beam_size, tables[k], i * beam_size)
+                row += len(beam)
+        return [(table, beam[-1]) for table, beam in zip(tables, beams)]
+
+    def tag_sentences(
+            self,
+            sentences,
+            beam_size=3,
+            return_probas=False,
+            as_strings=False,
+            lowerCaseCapOnly=False,
+            batch_size=64,
+            feat_options=None):
+        ''' tag pre-tokenized sentences, given as lists of strings, without
+        spaCy: returns an array of tag ids (indices in
+        `classifier.classes`) per sentence, or a list of tags with
+        `as_strings`. With `return_probas`, returns (tags, probas) pairs,
+        probas being the probabilities of the tags. With
+        `lowerCaseCapOnly`, sentences without lowercase letters are tagged
+        lowercased, as in `__call__`. '''
+        snapshot = self.snapshot
+        classes = snapshot.classifier.classes
+        results = []
+        for start in range(0, len(sentences), batch_size):
+            batch = [[Token(string=wd, wasCap=was_cap) for wd in words]
+                     for words, was_cap in (
+                         lower_cap_only(words, lowerCaseCapOnly)
+                         for words in sentences[start:start + batch_size])]
+            for tokens, (_, hyp) in zip(
+                    batch, self._decode(batch, feat_options, beam_size,
+                                        snapshot)):
+                tags = np.empty(len(tokens), dtype=np.int32)
+                probas = np.empty(len(tokens), dtype=np.float32)
+                for i in range(len(tokens) - 1, -1, -1):
+                    tags[i] = hyp.label
+                    probas[i] = hyp.proba
+                    hyp = hyp.parent
+                if as_strings:
+                    tags = [classes[c] for c in tags]
+                results.append((tags, probas) if return_probas else tags)
+        return results
+
+    def tag_token_sequence_budget(
+            self,
+            tokens,
+            deadline,
+            feat_options=None,
+            beam_size=3):
+        ''' N-best breath search stepping down to faster decodings so as to
+        be done by `deadline` (a `time.time()` value): whenever the
+        remaining tokens would take longer than the time left at the pace
+        of the current decoding, the next one of `DEGRADATION_LEVELS` is
+        used for the rest of the sentence. Once the deadline is passed, the
+        remaining tokens get their most likely tag in the lexicons.
+        Returns the tagged tokens and the index of the last decoding
+        used. '''
+        feat_options = feat_options or self.feat_options
+        snapshot = self.snapshot
+        classes = snapshot.classifier.classes
+        lwin = max(feat_options.get('win', 2), feat_options.get('pwin', 2))
+        beam_sizes = beam_widths(beam_size)
+        table = DistributionTable(classes, len(tokens) * beam_size)
+        attrs = TokenAttributes(tokens, snapshot.lex_dict, snapshot.tag_dict,
+                                feat_options, snapshot.cache)
+        beam = [Hypothesis()]
+        level = 0
+        # pace of the current decoding
+        level_start = time.time()
+        level_tokens = 0
         for i, token in enumerate(tokens):
-            n_best_sequences = []
-            # cache static features
-            cached_inst = Instance(label=tokens[i].label,
-                                   index=i, tokens=tokens,
+            now = time.time()
+            if level < LEXICON_LEVEL:
+                if now >= deadline:
+                    level = LEXICON_LEVEL
+                elif level_tokens and (now - level_start) / level_tokens * (
+                        len(tokens) - i) > deadline - now:
+                    level = next_level(level, beam_sizes)
+                    level_start = now
+                    level_tokens = 0
+            row = i * beam_size
+            if level == LEXICON_LEVEL:
+                # extend the best hypothesis with the lexicon's best tag
+                hyp = beam[-1]
+                table.array[row] = snapshot.lexicon_distribution(
+                    token.string)
+                c = int(table.array[row].argmax())
+                proba = table.array[row, c]
+                beam = [Hypothesis(c, hyp.log_pr + math.log(proba), proba,
+                                   hyp, row)]
+                continue
+            cached_inst = Instance(label=token.label, index=i, tokens=tokens,
                                    feat_selection=feat_options,
-                                   lex_dict=self.lex_dict,
-                                   tag_dict=self.tag_dict,
-                                   cache=self.cache)
+                                   lex_dict=snapshot.lex_dict,
+                                   tag_dict=snapshot.tag_dict,
+                                   cache=snapshot.cache, attrs=attrs)
             cached_inst.get_static_features()
-            # get possible tags: union of tags found in tag_dict and
-            # lex_dict
-            wd = token.string
-            wasCap = token.wasCap
-            legit_tags1 = self.tag_dict.get(wd, {})
-            legit_tags2 = self.lex_dict.get(wd, {})
-#            legit_tags2 = {} # self.lex_dict.get(wd,{})
-#            print >> sys.stderr, "legit_tags1: ", [t for t in legit_tags1]
-            for j, seq in enumerate(sequences):
-                seq_j, log_pr_j = sequences[j]
-                tokens_j = seq_j + tokens[i:]  # tokens with previous labels
-                # classify token
-                inst = Instance(label=tokens[i].label,
-                                index=i, tokens=tokens_j,
-                                feat_selection=feat_options,
-                                lex_dict=self.lex_dict,
-                                tag_dict=self.tag_dict,
-                                cache=self.cache)
-                inst.fv = cached_inst.fv[:]
-                inst.get_sequential_features()
-                label_pr_distrib = self.classifier.class_distribution(inst.fv)
-                # extend sequence j with current token
-                for (cl, pr) in label_pr_distrib:
-                    # make sure that cl is a legal tag
-                    if legit_tags1 or legit_tags2:
-                        if (cl not in legit_tags1) and (cl not in legit_tags2):
-                            continue
-                    labelled_token = Token(
-                        string=token.string,
-                        pos=token.pos,
-                        comment=token.comment,
-                        wasCap=wasCap,
-                        label=cl,
-                        proba=pr,
-                        label_pr_distrib=label_pr_distrib)
-                    n_best_sequences.append(
-                        (seq_j + [labelled_token], log_pr_j + math.log(pr)))
-            # sort sequences
-            n_best_sequences.sort(key=operator.itemgetter(1))
-            # debug_n_best_sequence(n_best_sequences)
-            # keep N best
-            sequences = n_best_sequences[-beam_size:]
-        # return sequence with highest prob.
-        best_sequence = sequences[-1][0]
-        # print >> sys.stderr, "Best tok seq:", [(t.string,t.label) for t in best_sequence]
-        return best_sequence
+            legal = snapshot.legal_classes(token.string)
+            distributions = snapshot.classifier.class_distributions(
+                [cached_inst.fv + cached_inst.sequential_features(
+                    [classes[c] for c in hyp.history(lwin)])
+                 for hyp in beam],
+                self._row_legal_classes([len(beam)], [legal]))
+            beam = extend_beam(beam, distributions, legal,
+                               beam_sizes[level], table, row)
+            level_tokens += 1
+        best_sequence = []
+        hyp = beam[-1]
+        for token in reversed(tokens):
+            best_sequence.append(Token(
+                string=token.string,
+                pos=token.pos,
+                comment=token.comment,
+                wasCap=token.wasCap,
+                label=classes[hyp.label],
+                proba=float(hyp.proba),
+                distribs=table,
+                distrib_row=hyp.distrib_row))
+            hyp = hyp.parent
+        best_sequence.reverse()
+        return best_sequence, level
+
+    def tag_token_stream(
+            self,
+            tokens,
+            feat_options=None,
+            beam_size=3,
+            max_lookahead=50,
+            chunk_size=256):
+        ''' N-best breath search over an unsegmented stream of tokens
+        (Token objects or strings), yielding the tagged tokens in order.
+
+        A token is emitted as soon as all the hypotheses of the beam agree
+        on its tag, which can't change any more. When more than
+        max_lookahead tokens are pending, the oldest one is committed with
+        the tag of the best hypothesis, and the hypotheses disagreeing
+        with it are dropped, so memory and latency stay bounded. Tokens are
+        read and their attributes computed by chunks of chunk_size. '''
+        feat_options = feat_options or self.feat_options
+        snapshot = self.snapshot
+        classes = snapshot.classifier.classes
+        win = feat_options.get('win', 2)
+        lwin = max(win, feat_options.get('pwin', 2))
+        tokens = iter(tokens)
+        # tokens from absolute position offset: left context of the next
+        # position to decode, and tokens read ahead
+        buffer = []
+        offset = 0
+        position = 0
+        # decoded but uncommitted tokens, along with the distributions of
+        # the hypotheses at their position
+        pending = []
+        beam = [Hypothesis()]
+        exhausted = False
+        while not exhausted:
+            chunk = [tok if isinstance(tok, Token) else Token(string=tok)
+                     for tok in itertools.islice(tokens, chunk_size)]
+            exhausted = len(chunk) < chunk_size
+            buffer.extend(chunk)
+            attrs = TokenAttributes(buffer, snapshot.lex_dict,
+                                    snapshot.tag_dict, feat_options,
+                                    snapshot.cache)
+            # the right context of the last tokens is not read yet
+            end = offset + len(buffer) - (0 if exhausted else win)
+            while position < end:
+                index = position - offset
+                cached_inst = Instance(index=index, tokens=buffer,
+                                       feat_selection=feat_options,
+                                       lex_dict=snapshot.lex_dict,
+                                       tag_dict=snapshot.tag_dict,
+                                       cache=snapshot.cache,
+                                       attrs=attrs)
+                cached_inst.get_static_features()
+                legal = snapshot.legal_classes(buffer[index].string)
+                distributions = snapshot.classifier.class_distributions(
+                    [cached_inst.fv + cached_inst.sequential_features(
+                        [classes[c] for c in hyp.history(lwin)])
+                     for hyp in beam],
+                    self._row_legal_classes([len(beam)], [legal]))
+                table = DistributionTable(classes, beam_size)
+                beam = extend_beam(beam, distributions, legal,
+                                   beam_size, table, 0)
+                pending.append((buffer[index], table))
+                position += 1
+                for token in self._commit(beam, pending, max_lookahead,
+                                          lwin):
+                    yield token
+            # keep the left context of the next position
+            start = max(offset, position - lwin)
+            buffer = buffer[start - offset:]
+            offset = start
+        # end of stream: commit the best sequence
+        while pending:
+            for token in self._commit(beam, pending, 0, lwin):
+                yield token
+
+    def _commit(self, beam, pending, max_lookahead, lwin):
+        ''' pop the tokens of pending the hypotheses of beam agree on (or
+        the oldest one when more than max_lookahead are pending, pruning
+        beam), returning them tagged '''
+        # walk back to the last common ancestor of the hypotheses
+        ancestors = list(beam)
+        steps = 0
+        while steps < len(pending) and any(
+                hyp is not ancestors[0] for hyp in ancestors):
+            ancestors = [hyp.parent for hyp in ancestors]
+            steps += 1
+        n_commit = len(pending) - steps
+        if n_commit <= 0 and len(pending) > max_lookahead:
+            if max_lookahead == 0:
+                # commit the whole best sequence
+                ancestors = [beam[-1]]
+                n_commit = len(pending)
+            else:
+                # commit the oldest token with the tag of the best
+                # hypothesis, keeping the hypotheses which agree with it
+                ancestors = list(beam)
+                for _ in range(len(pending) - 1):
+                    ancestors = [hyp.parent for hyp in ancestors]
+                beam[:] = [hyp for hyp, ancestor in zip(beam, ancestors)
+                           if ancestor is ancestors[-1]]
+                ancestors = [ancestors[-1]]
+                n_commit = 1
+        if n_commit <= 0:
+            return []
+        hyps = []
+        hyp = ancestors[0]
+        for _ in range(n_commit):
+            hyps.append(hyp)
+            hyp = hyp.parent
+        hyps.reverse()
+        committed = []
+        for hyp, (token, table) in zip(hyps, pending[:n_commit]):
+            committed.append(Token(
+                string=token.string,
+                pos=token.pos,
+                comment=token.comment,
+                wasCap=token.wasCap,
+                label=table.classes[hyp.label],
+                proba=float(hyp.proba),
+                distribs=table,
+                distrib_row=hyp.distrib_row))
+        del pending[:n_commit]
+        # drop the hypotheses out of the context of the next positions
+        hyp = hyps[-1]
+        for _ in range(max(0, lwin - len(pending))):
+            if hyp.parent is None:
+                break
+            hyp = hyp.parent
+        hyp.parent = None
+        return committed
+
+    def legal_classes(self, wd):
+        ''' ids of the possible tags of a word (see
+        `ModelSnapshot.legal_classes`) '''
+        return self.snapshot.legal_classes(wd)
+
+    def _row_legal_classes(self, n_rows, legal):
+        ''' legal classes of each row of a classifier call, for tokens with
+        n_rows[k] hypotheses and legal[k] legal classes (None unless the
+        scores are constrained to the legal classes) '''
+        if not self.constrained_softmax:
+            return None
+        return [legal_k for n, legal_k in zip(n_rows, legal)
+                for _ in range(n)]
 
     def __call__(
             self,
             doc,
             handle_comments=False,
-            feat_options=feat_select_options,
+            feat_options=None,
             beam_size=3,
             lowerCaseCapOnly=False,
-            zh_mode=False):
+            zh_mode=False,
+            time_budget=None):
         LOGGER.info("  TAGGER: POS Tagging...")
         t0 = time.time()
+        time_budget = time_budget or self.time_budget
         # process sentences
         s_ct = 0
         if (handle_comments):
@@ -215,13 +836,7 @@ class POSTagger(Downloader):
             split_re = re.compile(r' ')
             token_re = re.compile(r'[^ ]+')
         line = " ".join([w.text for w in doc])
-        wasCapOnly = 0
-        if (lowerCaseCapOnly and len(line) > 10):
-            wasCapOnly = CAPONLYLINE_RE.match(line)
-        if (wasCapOnly):
-            wasCapOnly = 1
-        else:
-            wasCapOnly = 0
+        wasCapOnly = int(lowerCaseCapOnly and is_cap_only(line))
         if (wasCapOnly):
             line = line.lower()
 #                LOGGER.info( "CAPONLY: "+line
@@ -237,34 +852,334 @@ class POSTagger(Downloader):
         for wd in wds:
             token = Token(string=wd, wasCap=wasCapOnly)
             tokens.append(token)
-        tagged_tokens = self.tag_token_sequence(tokens,
-                                                feat_options=feat_options,
-                                                beam_size=beam_size)
+        if time_budget:
+            tagged_tokens, level = self.tag_token_sequence_budget(
+                tokens, t0 + time_budget, feat_options=feat_options,
+                beam_size=beam_size)
+            doc.user_data[DEGRADATION_KEY] = DEGRADATION_LEVELS[level]
+        else:
+            tagged_tokens = self.tag_token_sequence(
+                tokens, feat_options=feat_options, beam_size=beam_size)
         if (self.print_probas):
             tagged_sent = " ".join([tok.__pstr__() for tok in tagged_tokens])
         else:
             tagged_sent = " ".join([tok.__str__() for tok in tagged_tokens])
-        for w, t in zip(doc, tagged_tokens):
-            w._.melt_tagger = t.label
+        self._set_annotations(doc, tagged_tokens)
+        return doc
+
+    def _set_annotations(self, doc, tagged_tokens):
+        labels = [t.label for t in tagged_tokens][:len(doc)]
+        set_melt_tags(doc, labels)
+        if self.set_tag or self.set_pos:
+            self.set_native_attrs(doc, labels)
+        if self.print_probas and tagged_tokens:
+            # keep the distributions of the best sequence only
+            table = tagged_tokens[0].distribs
+            doc.user_data[PROBAS_KEY] = (
+                list(table.classes),
+                table.array[[t.distrib_row for t in tagged_tokens]].astype(
+                    np.float32))
+        return labels
+
+    def set_native_attrs(self, doc, labels):
+        ''' write the tags of the first len(labels) tokens of doc into the
+        TAG and/or POS attributes, in bulk '''
+        from spacy.attrs import TAG, POS
+        from spacy.parts_of_speech import IDS as POS_IDS
+        n = len(labels)
+        # TAG first: the tag map may set POS along with it
+        attrs = ([TAG] if self.set_tag else []) + \
+            ([POS] if self.set_pos else [])
+        if not attrs:
+            return doc
+        # spaCy returns a 1-D array for a single attribute
+        array = doc.to_array(attrs).reshape((len(doc), len(attrs)))
+        col = 0
+        if self.set_tag:
+            array[:n, col] = [doc.vocab.strings.add(label)
+                              for label in labels]
+            col += 1
+        if self.set_pos:
+            array[:n, col] = [POS_IDS[MELT_TO_UPOS_DIC.get(label, 'X')]
+                              for label in labels]
+        doc.from_array(attrs, array)
         return doc
 
+    def memory_usage(self):
+        """ approximate size, number of entries and load time of the
+        lexicons, of the model (see `MaxEntClassifier.memory_usage`) and of
+        the feature cache """
+        usage = {
+            'lex_dict': resource_usage(self.lex_dict,
+                                       self.load_times.get('lex_dict')),
+            'tag_dict': resource_usage(self.tag_dict,
+                                       self.load_times.get('tag_dict')),
+            'cache': resource_usage(self.cache._data),
+        }
+        usage.update(self.classifier.memory_usage())
+        return usage
+
     def load_tag_dictionary(self, filepath):
         LOGGER.info("  TAGGER: Loading tag dictionary...")
-        self.tag_dict = unserialize(filepath)
+        t0 = time.time()
+        tag_dict = unserialize(filepath)
+        self.snapshot = self.snapshot.replace(
+            tag_dict=tag_dict,
+            cache=FeatureCache(thread_safe=self.thread_safe),
+            files=dict(self.files, tag_dict=os.path.abspath(filepath)),
+            load_times=dict(self.load_times, tag_dict=time.time() - t0))
         LOGGER.info("  TAGGER: Loading tag dictionary: done")
         return
 
     def load_lexicon(self, filepath):
         LOGGER.info("  TAGGER: Loading external lexicon...")
-        self.lex_dict = unserialize(filepath)
+        t0 = time.time()
+        lex_dict = unserialize(filepath)
+        self.snapshot = self.snapshot.replace(
+            lex_dict=lex_dict,
+            cache=FeatureCache(thread_safe=self.thread_safe),
+            files=dict(self.files, lexicon=os.path.abspath(filepath)),
+            load_times=dict(self.load_times, lex_dict=time.time() - t0))
         LOGGER.info("  TAGGER: Loading external lexicon: done")
         return
 
 
+############################ snapshot.py ############################
+
+# sentence tagged to check a model before swapping it in
+SMOKE_TEST_SENTENCE = [u'Le', u'chat', u'dort', u'.']
+
+
+class ModelLoadError(Exception):
+    """ A model couldn't be loaded, or failed its checks """
+
+
+class ModelSnapshot(object):
+    """ Resources of a tagger: lexicons, model, the feature cache
+    computed from them, and the files and load times they come from.
+
+    A snapshot is not modified once in use (only its cache fills up):
+    changing a resource builds a new one with `replace`.
+    """
+
+    def __init__(self, lex_dict=None, tag_dict=None, classifier=None,
+                 cache=None, files=None, load_times=None, profile_info=None,
+                 legal_cache=None):
+        self.lex_dict = lex_dict if lex_dict is not None else {}
+        self.tag_dict = tag_dict if tag_dict is not None else {}
+        self.classifier = classifier or MaxEntClassifier()
+        self.cache = cache if cache is not None else FeatureCache()
+        self.files = files or {}
+        self.load_times = load_times or {}
+        self.profile_info = profile_info
+        # legal class ids of the word forms seen, see legal_classes
+        self.legal_cache = legal_cache if legal_cache is not None else \
+            FeatureCache(thread_safe=self.cache.thread_safe)
+
+    def replace(self, **changes):
+        """ copy of the snapshot with some of its resources replaced """
+        fields = dict(self.__dict__)
+        fields.update(changes)
+        if 'legal_cache' not in changes and set(changes) & set(
+                ['lex_dict', 'tag_dict', 'classifier']):
+            # computed from the lexicons and the classes of the model
+            fields['legal_cache'] = None
+        return ModelSnapshot(**fields)
+
+    def legal_classes(self, wd):
+        ''' ids of the possible tags of a word: union of tags found in
+        tag_dict and lex_dict, or all the tags if none is found. The
+        (read-only) array is computed once per word form. '''
+        legal = self.legal_cache.get(wd)
+        if legal is not None:
+            return legal
+        classes = self.classifier.classes
+        legit_tags1 = self.tag_dict.get(wd, {})
+        legit_tags2 = self.lex_dict.get(wd, {})
+        legal = [c for c, cl in enumerate(classes)
+                 if cl in legit_tags1 or cl in legit_tags2]
+        if not legal:
+            legal = range(len(classes))
+        legal = np.array(legal, dtype=np.intp)
+        legal.flags.writeable = False
+        return self.legal_cache.setdefault(wd, legal)
+
+    def lexicon_distribution(self, wd):
+        ''' tag distribution of a word according to the lexicons alone:
+        relative frequencies of its tags in tag_dict, or uniform over its
+        tags in lex_dict, or the prior of the model (softmax of the bias
+        weights) for an unknown word '''
+        classes = self.classifier.classes
+        distribution = np.zeros(len(classes))
+        for tag, count in self.tag_dict.get(wd, {}).items():
+            if tag in classes:
+                distribution[classes.index(tag)] = count
+        if not distribution.any():
+            legal = self.legal_classes(wd)
+            if len(legal) < len(classes):
+                distribution[legal] = 1.
+            else:
+                distribution = np.exp(self.classifier.bias_weights -
+                                      self.classifier.bias_weights.max())
+        return distribution / distribution.sum()
+
+
 ############################ my_token.py ############################
 
 
-class Token:
+class Hypothesis(object):
+    """ Beam search hypothesis: class id of the current token, log prob.
+    of the sequence, back pointer to the hypothesis it extends and row of
+    the distribution the class was picked from """
+
+    __slots__ = ('label', 'log_pr', 'proba', 'parent', 'distrib_row')
+
+    def __init__(self, label=None, log_pr=0.0, proba=None, parent=None,
+                 distrib_row=None):
+        self.label = label
+        self.log_pr = log_pr
+        self.proba = proba
+        self.parent = parent
+        self.distrib_row = distrib_row
+
+    def history(self, n):
+        """ class ids of the (at most) n last tokens, oldest first """
+        labels = []
+        hyp = self
+        while hyp.parent is not None and len(labels) < n:
+            labels.append(hyp.label)
+            hyp = hyp.parent
+        labels.reverse()
+        return labels
+
+
+def is_cap_only(line):
+    ''' whether a line of more than 10 characters has no lowercase
+    letter '''
+    return len(line) > 10 and CAPONLYLINE_RE.match(line) is not None
+
+
+def lower_cap_only(words, lowerCaseCapOnly=True):
+    ''' words lowercased if their sentence has no lowercase letter (with
+    `lowerCaseCapOnly`), and 1 if they were, 0 otherwise '''
+    if lowerCaseCapOnly and is_cap_only(" ".join(words)):
+        return [wd.lower() for wd in words], 1
+    return words, 0
+
+
+def profile_model_dir(models_dir, profile):
+    """ directory of the model of a profile: models_dir for the default
+    profile, <models_dir>-<profile> for the others """
+    if profile == DEFAULT_PROFILE:
+        return models_dir
+    return '%s-%s' % (models_dir.rstrip(os.sep), profile)
+
+
+def read_profile(model_path):
+    """ content of the profile file of a model directory, if any """
+    filepath = os.path.join(model_path, PROFILE_FILE_NAME)
+    if not os.path.exists(filepath):
+        return None
+    return unserialize(filepath)
+
+
+def beam_widths(beam_size):
+    ''' beam widths of the beam, narrow_beam and greedy decodings of
+    DEGRADATION_LEVELS '''
+    return [beam_size, max(2, beam_size // 2) if beam_size > 2 else 1, 1]
+
+
+def next_level(level, beam_sizes):
+    ''' decoding stepped down to from `level`, skipping the beams as wide
+    as the next decoding, which wouldn't be any faster '''
+    level += 1
+    while level < LEXICON_LEVEL - 1 and \
+            beam_sizes[level] == beam_sizes[level + 1]:
+        level += 1
+    return level
+
+
+def extend_beam(beam, distributions, legal, beam_size, table, first_row):
+    """ extend every hypothesis of the beam with every legal class, given
+    the class distributions of the hypotheses (stored in rows first_row,
+    first_row + 1, ... of table), and keep the beam_size best ones """
+    table.array[first_row:first_row + len(beam)] = distributions
+    probas = table.array[first_row:first_row + len(beam), legal]
+    with np.errstate(divide='ignore'):
+        log_prs = np.log(probas) + np.array(
+            [hyp.log_pr for hyp in beam])[:, np.newaxis]
+    # keep N best, ties broken as a stable sort would
+    order = np.argsort(log_prs, axis=None, kind='mergesort')
+    new_beam = []
+    for flat in order[-beam_size:].tolist():
+        j, c = divmod(flat, len(legal))
+        new_beam.append(Hypothesis(
+            int(legal[c]), log_prs[j, c], probas[j, c],
+            beam[j], first_row + j))
+    return new_beam
+
+
+class DistributionTable(object):
+    """ Class probability distributions of the hypotheses of a sentence,
+    stored as the rows of one preallocated array and only turned into
+    (class, prob) lists when read """
+
+    def __init__(self, classes, n_rows):
+        self.classes = classes
+        self.array = np.empty((n_rows, len(classes)))
+
+    def distribution(self, row):
+        return list(zip(self.classes, self.array[row].tolist()))
+
+
+def set_melt_tags(doc, labels):
+    """ store the tags of the first len(labels) tokens of doc as an array
+    of ids into a list of distinct tags """
+    tags, inverse = np.unique(labels, return_inverse=True)
+    ids = np.full(len(doc), -1, dtype=np.int32)
+    ids[:len(labels)] = inverse
+    doc.user_data[TAGS_KEY] = (tags.tolist(), ids)
+    return doc
+
+
+def get_melt_tag(token):
+    """ getter of token._.melt_tagger """
+    store = token.doc.user_data.get(TAGS_KEY)
+    if store is None:
+        return None
+    tags, ids = store
+    tag_id = ids[token.i]
+    return tags[tag_id] if tag_id >= 0 else None
+
+
+def set_melt_tag(token, value):
+    """ setter of token._.melt_tagger """
+    doc = token.doc
+    store = doc.user_data.get(TAGS_KEY)
+    if store is None:
+        store = ([], np.full(len(doc), -1, dtype=np.int32))
+        doc.user_data[TAGS_KEY] = store
+    tags, ids = store
+    if value is None:
+        ids[token.i] = -1
+        return
+    if value not in tags:
+        tags.append(value)
+    ids[token.i] = tags.index(value)
+
+
+def get_melt_probas(token):
+    """ getter of token._.melt_probas """
+    probas = token.doc.user_data.get(PROBAS_KEY)
+    if probas is None:
+        return None
+    classes, array = probas
+    if token.i >= len(array):
+        return None
+    return dict(zip(classes, array[token.i].tolist()))
+
+
+class Token(object):
 
     def __init__(
             self,
@@ -274,9 +1189,11 @@ class Token:
             label=None,
             proba=None,
             comment=None,
-            label_pr_distrib=[],
+            label_pr_distrib=None,
             index=None,
-            position=None):
+            position=None,
+            distribs=None,
+            distrib_row=None):
         if isinstance(
                 string,
                 tuple) and isinstance(
@@ -299,11 +1216,25 @@ class Token:
         self.label = label
         self.proba = proba
         self.comment = comment
+        # distribution either given as a list, or as a DistributionTable
+        # row materialized on access
         self.label_pr_distrib = label_pr_distrib
+        self.distribs = distribs
+        self.distrib_row = distrib_row
         if (self.comment is None):
             self.comment = ""
         return
 
+    @property
+    def label_pr_distrib(self):
+        if self._label_pr_distrib is None and self.distribs is not None:
+            return self.distribs.distribution(self.distrib_row)
+        return self._label_pr_distrib or []
+
+    @label_pr_distrib.setter
+    def label_pr_distrib(self, label_pr_distrib):
+        self._label_pr_distrib = label_pr_distrib
+
     def set_label(self, label):
         self.label = label
         return
@@ -343,34 +1274,73 @@ class MaxEntClassifier:
         self.feature2int = {}
         self.weights = np.zeros((0, 0))
         self.bias_weights = np.zeros((0, 0))
+        self.load_times = {}
         return
 
-    def load(self, dirpath):
+    def load(self, dirpath, mmap_mode=None):
+        """ load a model directory; with `mmap_mode`, weights saved as
+        .npy files are memory-mapped """
         LOGGER.info("  TAGGER: Loading model from %s..." % dirpath)
         self.classes = unserialize(os.path.join(dirpath, 'classes.json'))
+        t0 = time.time()
         self.feature2int = unserialize(
             os.path.join(dirpath, 'feature_map.json'))
+        self.load_times['feature2int'] = time.time() - t0
+        t0 = time.time()
         self.weights = np.load(
             os.path.join(
                 dirpath,
                 'weights.npy'),
+            mmap_mode=mmap_mode,
             allow_pickle=True,
             encoding='latin1')
+        if mmap_mode and not isinstance(self.weights, np.memmap):
+            LOGGER.warning(
+                "  TAGGER: The weights in %s are pickled and can't be "
+                "memory-mapped, see save_plain_weights" % dirpath)
+        self.load_times['weights'] = time.time() - t0
+        t0 = time.time()
         self.bias_weights = np.load(
             os.path.join(
                 dirpath,
                 'bias_weights.npy'),
             allow_pickle=True,
             encoding='latin1')
+        self.load_times['bias_weights'] = time.time() - t0
         LOGGER.info("  TAGGER: Loading model from %s: done" % dirpath)
         return
 
+    def check(self):
+        """ raise ValueError if the shapes of the weights don't match
+        the classes and feature map """
+        n_classes = len(self.classes)
+        if not n_classes:
+            raise ValueError('no classes')
+        if self.weights.ndim != 2 or self.weights.shape[1] != n_classes:
+            raise ValueError('weights of shape %s for %d classes' % (
+                self.weights.shape, n_classes))
+        if self.bias_weights.shape != (n_classes,):
+            raise ValueError('bias weights of shape %s for %d classes' % (
+                self.bias_weights.shape, n_classes))
+        if self.feature2int and \
+                max(self.feature2int.values()) >= self.weights.shape[0]:
+            raise ValueError('features beyond the %d weight rows' %
+                             self.weights.shape[0])
+
+    def memory_usage(self):
+        """ approximate size, number of entries and load time of the
+        feature map and weights """
+        return dict(
+            (name, resource_usage(getattr(self, name),
+                                  self.load_times.get(name)))
+            for name in ('feature2int', 'weights', 'bias_weights'))
+
     def dump(self, dirpath):
         LOGGER.info("  TAGGER (TRAIN): Dumping model in %s..." % dirpath)
         serialize(self.classes, os.path.join(dirpath, 'classes.json'))
         serialize(self.feature2int, os.path.join(dirpath, 'feature_map.json'))
-        self.weights.dump(os.path.join(dirpath, 'weights.npy'))
-        self.bias_weights.dump(os.path.join(dirpath, 'bias_weights.npy'))
+        np.save(os.path.join(dirpath, 'weights.npy'), self.weights)
+        np.save(os.path.join(dirpath, 'bias_weights.npy'), self.bias_weights)
         LOGGER.info("  TAGGER (TRAIN): Dumping model in %s: done." % dirpath)
         return
 
@@ -413,25 +1383,270 @@ class MaxEntClassifier:
         # return class/prob map
         return list(zip(self.classes, probs))
 
+    def class_distributions(self, feature_lists, legal=None):
+        """ probability distributions over the different classes for a
+        batch of feature vectors, computed in a single vectorized pass:
+        returns an array of shape (len(feature_lists), len(classes))
+
+        `legal` optionally gives the ids of the classes each feature
+        vector can take (None: all of them): only the weights of these
+        classes are then gathered, and the distribution is normalized over
+        them, the other classes getting a probability of 0.
+        """
+        feature_ids = [[self.feature2int[f] for f in features
+                        if f in self.feature2int]
+                       for features in feature_lists]
+        if legal is None:
+            return self._distributions(feature_ids)
+        n_classes = len(self.classes)
+        distributions = np.zeros((len(feature_ids), n_classes))
+        constrained = []
+        unconstrained = []
+        for r, classes in enumerate(legal):
+            if classes is not None and len(classes) < n_classes:
+                constrained.append(r)
+            else:
+                unconstrained.append(r)
+        if unconstrained:
+            distributions[unconstrained] = self._distributions(
+                [feature_ids[r] for r in unconstrained])
+        if constrained:
+            rows = np.array(constrained)
+            # legal classes of each row, padded with a masked repeat: the
+            # hypotheses of a token share the same legal classes, padded
+            # once
+            width = max(len(legal[r]) for r in constrained)
+            padded = {}
+            for r in constrained:
+                if id(legal[r]) not in padded:
+                    padded[id(legal[r])] = np.concatenate(
+                        [legal[r], np.repeat(legal[r][:1],
+                                             width - len(legal[r]))])
+            columns = np.array([padded[id(legal[r])] for r in constrained])
+            mask = np.arange(width) < np.array(
+                [len(legal[r]) for r in constrained])[:, np.newaxis]
+            scores = self.bias_weights[columns].astype(float)
+            lengths = np.array([len(feature_ids[r]) for r in constrained])
+            nonempty = lengths > 0
+            if nonempty.any():
+                ids = [f for r in constrained for f in feature_ids[r]]
+                # row of the constrained block each feature belongs to
+                owners = np.repeat(np.arange(len(constrained)), lengths)
+                offsets = np.cumsum(lengths) - lengths
+                scores[nonempty] += np.add.reduceat(
+                    self.weights[np.array(ids)[:, np.newaxis],
+                                 columns[owners]],
+                    offsets[nonempty], axis=0)
+            scores[~mask] = -np.inf
+            scores -= scores.max(axis=1)[:, np.newaxis]
+            np.exp(scores, out=scores)
+            scores /= scores.sum(axis=1)[:, np.newaxis]
+            distributions[np.repeat(rows, mask.sum(axis=1)),
+                          columns[mask]] = scores[mask]
+        return distributions
+
+    def _distributions(self, feature_ids):
+        """ distributions over all the classes for lists of feature ids
+        """
+        ids = []
+        lengths = []
+        for fints in feature_ids:
+            ids.extend(fints)
+            lengths.append(len(fints))
+        scores = np.tile(self.bias_weights, (len(lengths), 1))
+        if ids:
+            # sum the weight rows of each feature vector
+            lengths = np.array(lengths)
+            offsets = np.cumsum(lengths) - lengths
+            nonempty = lengths > 0
+            scores[nonempty] += np.add.reduceat(
+                self.weights[ids], offsets[nonempty], axis=0)
+        # exponentiation of weight sums, normalized per row
+        scores -= scores.max(axis=1)[:, np.newaxis]
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1)[:, np.newaxis]
+        return scores
+
+
+############################ cache.py ############################
+
+
+class FeatureCache(object):
+    """ Mapping of words to their cached (immutable) features.
+
+    Once `max_size` entries are stored, new words are no longer cached.
+    With `thread_safe`, reads stay lock-free and writes take one of
+    `n_stripes` locks picked from the key hash, so concurrent writers of
+    different words rarely contend.
+    """
+
+    def __init__(self, thread_safe=False, n_stripes=16, max_size=200000):
+        self._data = {}
+        self.thread_safe = thread_safe
+        self._locks = [threading.Lock()
+                       for _ in range(n_stripes if thread_safe else 0)]
+        self.max_size = max_size
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def setdefault(self, key, value):
+        if not self._locks:
+            return self._setdefault(key, value)
+        with self._locks[hash(key) % len(self._locks)]:
+            return self._setdefault(key, value)
+
+    def _setdefault(self, key, value):
+        if key not in self._data and len(self._data) >= self.max_size:
+            return value
+        return self._data.setdefault(key, value)
+
+    def clear(self):
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._data = {}
+        finally:
+            for lock in self._locks:
+                lock.release()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+############################ token_attributes.py ############################
+
+SHAPE_NUMBER = 1
+SHAPE_HYPHEN = 2
+SHAPE_UPPER = 4
+SHAPE_ALLCAPS = 8
+
+
+def word_features(word, lex_dict, pln=4, sln=4):
+    ''' word string-based features: word form itself and its
+    prefix/suffix-es, suffixes being marked with the suffix confidence
+    class of the word found in the lexicon'''
+    lex_tags = lex_dict.get(word, {})
+    # selecting the suffix confidence class for the word
+    val = 1
+    if len(lex_tags) == 1:
+        val = list(lex_tags.values())[0]
+    else:
+        val = 1
+        for v in list(lex_tags.values()):
+            if v == "0":
+                val = 0
+                break
+    feats = ['wd=%s' % word]
+    wd_ln = len(word)
+    for i in range(1, min(pln, wd_ln) + 1):
+        feats.append('pref%i=%s' % (i, word[:i]))
+    for i in range(1, min(sln, wd_ln) + 1):
+        feats.append('suff%i=%s=%s' % (i, word[-i:], val))
+    return tuple(feats)
+
+
+def right_affix_features(word, rpln=1, rsln=1):
+    ''' light prefix/suffix information on the right context word '''
+    wd_ln = len(word)
+    feats = []
+    for i in range(1, min(rpln, wd_ln) + 1):
+        feats.append('pref+1-%i=%s' % (i, word[:i]))
+    for i in range(1, min(rsln, wd_ln) + 1):
+        feats.append('suff+1-%i=%s' % (i, word[-i:]))
+    return tuple(feats)
+
+
+def word_shape(word):
+    shape = 0
+    if number.search(word) is not None:
+        shape |= SHAPE_NUMBER
+    if hyphen.search(word) is not None:
+        shape |= SHAPE_HYPHEN
+    if upper.search(word) is not None:
+        shape |= SHAPE_UPPER
+    if allcaps.match(word) is not None:
+        shape |= SHAPE_ALLCAPS
+    return shape
+
+
+class TokenAttributes(object):
+    """ Attributes of the tokens of a sentence (or a whole document) read
+    by the feature templates, computed in a single pass.
+
+    Tokens are mapped to interned word ids (`word_ids`); lexicon and tag
+    dictionary signatures, shape flags and affix features are then
+    computed once per distinct word form and indexed by word id.
+    """
+
+    def __init__(self, tokens, lex_dict=None, tag_dict=None,
+                 feat_selection=None, cache=None):
+        feat_selection = feat_selection or {}
+        lex_dict = lex_dict or {}
+        tag_dict = tag_dict or {}
+        pln = feat_selection.get('pln', 4)
+        sln = feat_selection.get('sln', 4)
+        rpln = feat_selection.get('rpln', 1)
+        rsln = feat_selection.get('rsln', 1)
+        self.words = [tok.string for tok in tokens]
+        vocab = {}
+        self.word_ids = [vocab.setdefault(wd, len(vocab))
+                         for wd in self.words]
+        self.types = sorted(vocab, key=vocab.get)
+        self.lex_sigs = []
+        self.tdict_sigs = []
+        self.word_feats = []
+        self.right_affix_feats = []
+        self.shapes = np.zeros(len(self.types), dtype=np.uint8)
+        for t, wd in enumerate(self.types):
+            self.lex_sigs.append(
+                "|".join(list(lex_dict.get(wd, {"unk": 1}).keys())))
+            self.tdict_sigs.append(
+                "|".join(list(tag_dict.get(wd, {"unk": 1}).keys())))
+            feats = None
+            key = (wd, pln, sln)
+            if cache is not None:
+                feats = cache.get(key)
+            if feats is None:
+                feats = word_features(wd, lex_dict, pln, sln)
+                if cache is not None:
+                    feats = cache.setdefault(key, feats)
+            self.word_feats.append(feats)
+            self.right_affix_feats.append(
+                right_affix_features(wd, rpln, rsln))
+            self.shapes[t] = word_shape(wd)
+        return
+
 
 ############################ instance.py ############################
 
 
 class Instance:
 
-    def __init__(self, index, tokens, label=None, lex_dict={}, tag_dict={},
-                 feat_selection={}, cache={}):
+    def __init__(self, index, tokens, label=None, lex_dict=None,
+                 tag_dict=None, feat_selection=None, cache=None,
+                 attrs=None):
         self.label = label
         self.fv = []
-        self.feat_selection = feat_selection
+        self.feat_selection = feat_selection or {}
+        feat_selection = self.feat_selection
         # token
         self.token = tokens[index]
         self.index = index
         self.word = self.token.string
         # lexicons
-        self.lex_dict = lex_dict
-        self.tag_dict = tag_dict
-        self.cache = cache  # TODO
+        self.lex_dict = lex_dict or {}
+        self.tag_dict = tag_dict or {}
+        # word -> word string-based features, None disables caching
+        self.cache = cache
+        # per-token attributes, shared by all the instances of a sentence
+        if attrs is None:
+            attrs = TokenAttributes(tokens, self.lex_dict, self.tag_dict,
+                                    feat_selection, cache)
+        self.attrs = attrs
         # contexts
         win = feat_selection.get('win', 2)
         pwin = feat_selection.get('pwin', 2)
@@ -443,43 +1658,26 @@ class Instance:
     def set_contexts(self, toks, idx, win, pwin):
         rwin = win
         lwin = max(win, pwin)
-        lconx = toks[:idx][-lwin:]
-        rconx = toks[idx + 1:][:rwin]
-        self.left_wds = [tok.string for tok in lconx]
+        lstart = max(0, idx - lwin)
+        rend = idx + 1 + rwin
+        attrs = self.attrs
+        self.left_wds = attrs.words[lstart:idx]
         if len(self.left_wds) < lwin:
             self.left_wds = ["<s>"] + self.left_wds
-        self.left_labels = [tok.label for tok in lconx]
-        self.right_wds = [tok.string for tok in rconx]
+        self.left_labels = [tok.label for tok in toks[lstart:idx]]
+        self.right_wds = attrs.words[idx + 1:rend]
         if len(self.right_wds) < rwin:
             self.right_wds += ["</s>"]
+        left_ids = attrs.word_ids[lstart:idx]
+        right_ids = attrs.word_ids[idx + 1:rend]
         self.lex_left_tags = {}
         self.lex_right_tags = {}
         if self.lex_dict:
-            self.lex_left_tags = [
-                "|".join(
-                    list(
-                        self.lex_dict.get(
-                            tok.string, {
-                                "unk": 1}).keys())) for tok in lconx if tok is not None]
-            self.lex_right_tags = [
-                "|".join(
-                    list(
-                        self.lex_dict.get(
-                            tok.string, {
-                                "unk": 1}).keys())) for tok in rconx if tok is not None]
+            self.lex_left_tags = [attrs.lex_sigs[t] for t in left_ids]
+            self.lex_right_tags = [attrs.lex_sigs[t] for t in right_ids]
         if self.tag_dict:
-            self.train_left_tags = [
-                "|".join(
-                    list(
-                        self.tag_dict.get(
-                            tok.string, {
-                                "unk": 1}).keys())) for tok in lconx if tok is not None]
-            self.train_right_tags = [
-                "|".join(
-                    list(
-                        self.tag_dict.get(
-                            tok.string, {
-                                "unk": 1}).keys())) for tok in rconx if tok is not None]
+            self.train_left_tags = [attrs.tdict_sigs[t] for t in left_ids]
+            self.train_right_tags = [attrs.tdict_sigs[t] for t in right_ids]
         return
 
     def add(self, name, key, value=-1):
@@ -490,6 +1688,16 @@ class Instance:
         self.fv.append(f)
         return f
 
+    def sequential_features(self, prev_labels):
+        ''' sequential features for a given sequence of predicted tags,
+        returned without being added to the instance features '''
+        fv = self.fv
+        self.fv = []
+        self.left_labels = prev_labels
+        self.get_sequential_features()
+        seq_fv, self.fv = self.fv, fv
+        return seq_fv
+
     def add_cached_feats(self, features):
         self.fv.extend(features)
         return
@@ -545,47 +1753,19 @@ class Instance:
         ''' features computed based on word form: word form itself,
         prefix/suffix-es of length ln: 0 < n < ln, and certain regex
         patterns'''
-        pln = self.feat_selection.get('pln', 4)  # 5
-        sln = self.feat_selection.get('sln', 4)  # 5
-        word = self.word
         index = self.index
-        dico = self.lex_dict
-        lex_tags = dico.get(word, {})
-        # selecting the suffix confidence class for the word
-        val = 1
-        if len(lex_tags) == 1:
-            val = list(lex_tags.values())[0]
-        else:
-            val = 1
-            for v in list(lex_tags.values()):
-                if v == "0":
-                    val = 0
-                    break
+        t = self.attrs.word_ids[index]
         # word string-based features
-        if word in self.cache:
-            # if wd has been seen, use cache
-            self.add_cached_features(self.cache[word])
-        else:
-            # word string
-            self.add('wd', word)
-            # suffix/prefix
-            wd_ln = len(word)
-            if pln > 0:
-                for i in range(1, pln + 1):
-                    if wd_ln >= i:
-                        self.add('pref%i' % i, word[:i])
-            if sln > 0:
-                for i in range(1, sln + 1):
-                    if wd_ln >= i:
-                        self.add('suff%i' % i, word[-i:], val)
+        self.add_cached_feats(self.attrs.word_feats[t])
         # regex-based features
-        self.add('nb', number.search(word) is not None)
-        self.add('hyph', hyphen.search(word) is not None)
+        shape = self.attrs.shapes[t]
+        self.add('nb', bool(shape & SHAPE_NUMBER))
+        self.add('hyph', bool(shape & SHAPE_HYPHEN))
 #        self.add( 'eq', equals.search(word) != None )
-        uc = upper.search(word)
-        self.add('uc', uc is not None)
-        self.add('niuc', uc is not None and index > 0)
-        self.add('auc', allcaps.match(word) is not None)
+        uc = bool(shape & SHAPE_UPPER)
+        self.add('uc', uc)
+        self.add('niuc', uc and index > 0)
+        self.add('auc', bool(shape & SHAPE_ALLCAPS))
         return
 
     def get_conx_features(self):
@@ -616,17 +1796,12 @@ class Instance:
                 self.add('wd+%s' % n, right_unigram)
                 if n == 1:
                     # adding light suffix information for the right context
-                    wd_ln = len(right_unigram)
-                    #                    print >> sys.stderr, "right_unigram = %s (wd_ln = %i)" %(right_unigram,wd_ln)
-                    #                    print >> sys.stderr, "  rsln = %i" %(rsln)
-                    if rpln > 0:
-                        for i in range(1, rpln + 1):
-                            if wd_ln >= i:
-                                self.add('pref+1-%i' % i, right_unigram[:i])
-                    if rsln > 0:
-                        for i in range(1, rsln + 1):
-                            if wd_ln >= i:
-                                self.add('suff+1-%i' % i, right_unigram[-i:])
+                    if self.index + 1 < len(self.attrs.words):
+                        t = self.attrs.word_ids[self.index + 1]
+                        self.add_cached_feats(self.attrs.right_affix_feats[t])
+                    else:
+                        self.add_cached_feats(right_affix_features(
+                            right_unigram, rpln, rsln))
                 # ngram
                 # if n > 1:
                 #    right_ngram = rwds[:n]
@@ -650,7 +1825,8 @@ class Instance:
             # current word
             # ------------------------------------------------------------
             word = self.word
-            uc = upper.search(word)
+            shape = self.attrs.shapes[self.attrs.word_ids[self.index]]
+            uc = shape & SHAPE_UPPER
             lex_tags = dico.get(word, {})
             if not lex_tags and self.index == 0:
                 # try lc'ed version for sent initial words
@@ -668,7 +1844,7 @@ class Instance:
                 for t in lex_tags:
                     self.add('%s-in' % feat_suffix, t)
                     # ?                   f = u'%s=%s:%s' %(feat_suffix,t,lex_tags[t])
-            if uc is not None:
+            if uc:
                 uc_lex_tags = dico.get(word.lower(), {})
                 if len(uc_lex_tags) == 0:
                     self.add('%s' % feat_suffix, "uc-unk")
@@ -738,6 +1914,68 @@ class Instance:
         r_tags = self.train_right_tags
         self._add_lex_features(lex, l_tags, r_tags, feat_suffix='tdict')
         return
+############################ corpus_reader.py ############################
+
+
+class BrownReader:
+    """ Data reader for corpora in the Brown format, one sentence per line:
+    Le/DET prix/NC de/P vente/NC ...
+    """
+
+    def __init__(self, infile, encoding='utf-8'):
+        self.infile = infile
+        self.encoding = encoding
+        return
+
+    def __iter__(self):
+        with codecs.open(self.infile, 'r', encoding=self.encoding) as stream:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                sentence = []
+                for item in line.split():
+                    m = WD_TAG_RE.match(item)
+                    if not m:
+                        raise ValueError(
+                            "Error: Incorrect token/tag pair: %s" % item)
+                    sentence.append(m.groups())
+                yield sentence
+
+
+class ConllReader:
+    """ Data reader for corpora in the CoNLL-X/CoNLL-U format, sentences
+    separated by blank lines; tags are read from `tag_column` (default:
+    the POSTAG/XPOS column)
+    """
+
+    def __init__(self, infile, tag_column=4, encoding='utf-8'):
+        self.infile = infile
+        self.tag_column = tag_column
+        self.encoding = encoding
+        return
+
+    def __iter__(self):
+        with codecs.open(self.infile, 'r', encoding=self.encoding) as stream:
+            sentence = []
+            for line in stream:
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    if sentence:
+                        yield sentence
+                    sentence = []
+                    continue
+                if line.startswith('#'):
+                    continue
+                cols = line.split('\t')
+                # skip multiword tokens and empty nodes
+                if '-' in cols[0] or '.' in cols[0]:
+                    continue
+                sentence.append((cols[1], cols[self.tag_column]))
+            if sentence:
+                yield sentence
+
+
 ############################ utils.py ############################
 
 
@@ -762,6 +2000,13 @@ def word_list(file_path, t=5):
     return filtered_wd_list
 
 
+def serialize(datastruct, filepath, encoding="utf-8"):
+    _file = codecs.open(filepath, 'w', encoding=encoding)
+    _file.write(dumps(datastruct, ensure_ascii=False))
+    _file.close()
+    return
+
+
 def unserialize(filepath, encoding="utf-8"):
     _file = codecs.open(filepath, 'r', encoding=encoding)
     datastruct = loads(_file.read())
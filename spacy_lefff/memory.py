@@ -0,0 +1,53 @@
+# coding: utf8
+"""
+Approximate memory accounting of the loaded resources.
+
+    >>> tagger.memory_usage()['weights']
+    {'size': 104857728, 'entries': 409600, 'load_time': 0.08}
+
+`size` is the deep size in bytes of a resource (containers, strings and
+NumPy buffers it references, each counted once), `entries` its number of
+entries (keys of a mapping, rows of an array) and `load_time` the time in
+seconds it took to load, when it was loaded from disk.
+"""
+
+import sys
+
+
+def deep_sizeof(obj):
+    """ approximate size in bytes of obj and of the objects it references
+    through dicts, lists, tuples and sets """
+    import numpy as np
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            # memory-mapped arrays and views don't own their buffer
+            size += max(sys.getsizeof(o), o.nbytes)
+            continue
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+    return size
+
+
+def resource_usage(resource, load_time=None):
+    """ size, number of entries and load time of a resource """
+    return {
+        'size': deep_sizeof(resource),
+        'entries': len(resource),
+        'load_time': load_time,
+    }
+
+
+def total_size(usage):
+    """ sum of the sizes of a `memory_usage()` report """
+    return sum(stats['size'] for stats in usage.values())
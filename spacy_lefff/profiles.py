@@ -0,0 +1,114 @@
+# coding: utf8
+"""
+Feature template profiles of the MElt tagger, importable without loading
+the tagger and its dependencies, and the checks that a model was trained
+for them.
+"""
+
+import re
+
+# extra options dict for feature selection
+feat_select_options = {
+    # previous default values
+    # 'win':2, # context window size
+    # 'pwin':2, # context window size for predicted tags (left context)
+    # 'lex_wd':1, # lefff current word features
+    # 'lex_lhs':1, # lefff LHS context features
+    # 'lex_rhs':1, # lefff RHS context features
+    # 'pln':4,
+    # 'sln':4,
+    # 'rpln':1,
+    # 'rsln':0,
+    # 'ffthrsld':2, # min feat occ: will discard any features occurring (strictly) less than ffthrsld times in the training data
+    # 'norm':0, # normalization (0=none, 1=L1, 2=L2)
+    # new default values (Sagot HDR)
+    'win': 2,  # context window size
+    'pwin': 2,  # context window size for predicted tags (left context)
+    'lex_wd': 1,  # lefff current word features
+    'lex_lhs': 1,  # lefff LHS context features
+    'lex_rhs': 1,  # lefff RHS context features
+    'pln': 4,
+    'sln': 5,
+    'rpln': 3,
+    'rsln': 3,
+    'ffthrsld': 1,  # min feat occ: will discard any features occurring (strictly) less than ffthrsld times in the training data
+    'norm': 0,  # normalization (0=none, 1=L1, 2=L2)
+}
+
+# named feature template sets, trading accuracy for speed: a model can only
+# be used with the templates it was trained for, or with a subset of them
+# once pruned (see check_profile and train.prune_to_profile)
+PROFILES = {
+    'accurate': feat_select_options,
+    'balanced': dict(feat_select_options, pln=3, sln=4, rpln=1, rsln=1),
+    'fast': dict(feat_select_options, win=1, pwin=1, lex_lhs=0, lex_rhs=0,
+                 pln=2, sln=3, rpln=1, rsln=0),
+}
+DEFAULT_PROFILE = 'accurate'
+
+
+class ProfileMismatchError(ValueError):
+    """Raised when a model wasn't trained for the feature templates of the
+    selected profile"""
+    pass
+
+
+# templates whose names end with a context size or an affix length
+_SIZED_TEMPLATES = [
+    (re.compile(r'^pref(\d+)$'), lambda n, o: n <= o.get('pln', 4)),
+    (re.compile(r'^suff(\d+)$'), lambda n, o: n <= o.get('sln', 4)),
+    (re.compile(r'^pref\+1-(\d+)$'),
+     lambda n, o: o.get('win', 2) >= 1 and n <= o.get('rpln', 1)),
+    (re.compile(r'^suff\+1-(\d+)$'),
+     lambda n, o: o.get('win', 2) >= 1 and n <= o.get('rsln', 1)),
+    (re.compile(r'^wd[+-](\d+)$'), lambda n, o: n <= o.get('win', 2)),
+    (re.compile(r'^surr_wds-(\d+)$'),
+     lambda n, o: o.get('win', 2) % 2 == 0 and n <= o.get('win', 2)),
+    (re.compile(r'^ptagS?-(\d+)$'), lambda n, o: n <= o.get('pwin', 2)),
+    (re.compile(r'^(?:lex|tdict)S?\+(\d+)$'),
+     lambda n, o: o.get('lex_rhs', 0) and n <= o.get('win', 2)),
+]
+_WORD_TEMPLATES = set(['wd', 'nb', 'hyph', 'uc', 'niuc', 'auc'])
+_LEX_WD_TEMPLATES = set(
+    ['%s%s' % (lex, suffix) for lex in ('lex', 'tdict')
+     for suffix in ('', '-u', '-disj', '-in', '-uc-u', '-uc-disj', '-uc-in')])
+
+
+def template_allowed(template, feat_options):
+    ''' whether features of the given template are extracted with
+    feat_options '''
+    if template in _WORD_TEMPLATES:
+        return True
+    if template in _LEX_WD_TEMPLATES:
+        return bool(feat_options.get('lex_wd', 0))
+    if template == 'lpred-rlex-surr':
+        return bool(feat_options.get('lex_rhs', 0))
+    for pattern, allowed in _SIZED_TEMPLATES:
+        match = pattern.match(template)
+        if match:
+            return bool(allowed(int(match.group(1)), feat_options))
+    return False
+
+
+def model_templates(feature2int):
+    ''' templates of the features of a model '''
+    return set(f.split('=', 1)[0] for f in feature2int)
+
+
+def check_profile(feature2int, feat_options, profile_info=None):
+    ''' raise ProfileMismatchError unless a model (its features, and the
+    feature options it was trained with when known) matches feat_options.
+    Only the options are compared, so a model trained with custom options
+    (a profile named None) matches them. '''
+    if profile_info is not None and \
+            profile_info.get('feat_options') != feat_options:
+        raise ProfileMismatchError(
+            "Model trained for profile '%s' (%s), not for %s" % (
+                profile_info.get('name'), profile_info.get('feat_options'),
+                feat_options))
+    unknown = sorted(t for t in model_templates(feature2int)
+                     if not template_allowed(t, feat_options))
+    if unknown:
+        raise ProfileMismatchError(
+            "Model has features (%s) not extracted with %s" % (
+                ', '.join(unknown[:10]), feat_options))
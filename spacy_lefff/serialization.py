@@ -0,0 +1,47 @@
+# coding: utf8
+"""
+Helpers of the `to_bytes`/`from_bytes` methods of the components: the
+directory written by `to_disk` is packed into an (uncompressed) tar
+archive.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+
+
+def dir_to_bytes(path):
+    """ tar archive of the content of directory `path` """
+    import tarfile
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name in sorted(os.listdir(path)):
+            tar.add(os.path.join(path, name), arcname=name)
+    return buf.getvalue()
+
+
+def to_bytes(component, **kwargs):
+    """ serialize `component` through its `to_disk` method """
+    tmp_dir = tempfile.mkdtemp(prefix='spacy-lefff-')
+    try:
+        component.to_disk(tmp_dir, **kwargs)
+        return dir_to_bytes(tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def from_bytes(component, bytes_data, **kwargs):
+    """ restore `component` through its `from_disk` method, loading the
+    resources in memory (the unpacked files are removed afterwards) """
+    from .downloader import Downloader
+    tmp_dir = tempfile.mkdtemp(prefix='spacy-lefff-')
+    try:
+        archive = os.path.join(tmp_dir, 'bundle.tar')
+        with open(archive, 'wb') as f:
+            f.write(bytes_data)
+        bundle_dir = os.path.join(tmp_dir, 'bundle')
+        Downloader._extract(archive, bundle_dir)
+        return component.from_disk(bundle_dir, mmap=False, **kwargs)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
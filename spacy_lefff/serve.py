@@ -0,0 +1,284 @@
+# coding: utf8
+"""
+Local HTTP/JSON tagging service.
+
+Concurrent requests are coalesced into micro-batches: a batch is closed
+when it reaches `max_batch_size` sentences or when its oldest request has
+waited `max_latency` seconds, then decoded in one pass through
+`POSTagger.tag_token_sequences` and lemmatized with `LefffLemmatizer`.
+
+    python -m spacy_lefff.serve --port 8080 --max-latency 0.01
+
+    curl -s localhost:8080/tag -d '{"sentences": [["Il", "y", "a"], "Je pense."]}'
+
+Each sentence is either a list of tokens (pre-tokenized) or a raw string,
+which is tokenized with spaCy's French tokenizer.
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from queue import Queue, Empty
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from Queue import Queue, Empty
+
+from .lefff import LefffLemmatizer
+from .melt_tagger import POSTagger, Token
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+MAX_BATCH_SIZE = 64
+MAX_LATENCY = 0.01
+
+
+class _PendingRequest(object):
+    """ Sentences of one request waiting to be tagged """
+
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.received = time.time()
+        self.started = None
+        self.finished = None
+        self.batch_size = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+    Coalesce concurrent tagging requests into batches.
+
+    A single worker thread waits for a first request, then keeps
+    collecting requests until either `max_batch_size` sentences are queued
+    or `max_latency` seconds have passed since the first one arrived.
+    """
+
+    def __init__(self, tagger, lemmatizer=None,
+                 max_batch_size=MAX_BATCH_SIZE,
+                 max_latency=MAX_LATENCY,
+                 beam_size=3):
+        self.tagger = tagger
+        self.lemmatizer = lemmatizer
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.beam_size = beam_size
+        self._queue = Queue()
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, sentences):
+        """ Tag a list of pre-tokenized sentences, blocking until the batch
+        holding them was processed. Returns the tagged sentences along with
+        the request timing (in milliseconds). """
+        request = _PendingRequest(sentences)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        timing = {
+            'queue_ms': (request.started - request.received) * 1000.,
+            'tagging_ms': (request.finished - request.started) * 1000.,
+            'total_ms': (request.finished - request.received) * 1000.,
+            'batch_size': request.batch_size,
+        }
+        return request.result, timing
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        n_sentences = len(batch[0].sentences)
+        deadline = batch[0].received + self.max_latency
+        while n_sentences < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except Empty:
+                break
+            batch.append(request)
+            n_sentences += len(request.sentences)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.time()
+            sentences = [s for request in batch for s in request.sentences]
+            try:
+                tagged = self._tag(sentences)
+            except Exception as e:
+                if len(batch) == 1:
+                    LOGGER.exception('Failure while tagging batch')
+                    self._finish(batch[0], started, len(sentences), error=e)
+                    continue
+                # retry the requests one by one, so that a request that
+                # fails doesn't fail the others
+                LOGGER.warning('Failure while tagging batch, retrying its '
+                               '%d requests one by one', len(batch))
+                for request in batch:
+                    try:
+                        result = self._tag(request.sentences)
+                    except Exception as e:
+                        LOGGER.exception('Failure while tagging request')
+                        self._finish(request, started, len(sentences),
+                                     error=e)
+                    else:
+                        self._finish(request, started, len(sentences),
+                                     result=result)
+                continue
+            offset = 0
+            for request in batch:
+                n = len(request.sentences)
+                self._finish(request, started, len(sentences),
+                             result=tagged[offset:offset + n])
+                offset += n
+
+    @staticmethod
+    def _finish(request, started, batch_size, result=None, error=None):
+        request.result = result
+        request.error = error
+        request.started = started
+        request.finished = time.time()
+        request.batch_size = batch_size
+        request.done.set()
+
+    def _tag(self, sentences):
+        tagged_sequences = self.tagger.tag_token_sequences(
+            [[Token(string=wd) for wd in words] for words in sentences],
+            beam_size=self.beam_size)
+        results = []
+        for tagged_tokens in tagged_sequences:
+            sentence = []
+            for tok in tagged_tokens:
+                entry = {'token': tok.string, 'tag': tok.label}
+                if self.lemmatizer is not None:
+                    entry['lemma'] = self.lemmatizer.lemmatize(
+                        tok.string, tok.label.lower(), from_melt=True)
+                sentence.append(entry)
+            results.append(sentence)
+        return results
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TaggingRequestHandler(BaseHTTPRequestHandler):
+    """ POST /tag with {"sentences": [...]}, GET /health """
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            self._send(200, {'status': 'ok'})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/tag':
+            self._send(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('content-length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            sentences = [self.server.tokenize(s)
+                         for s in payload['sentences']]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': 'invalid request: %s' % e})
+            return
+        try:
+            result, timing = self.server.batcher.submit(sentences)
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+        self._send(200, {'sentences': result, 'timing': timing})
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+class TaggingServer(_ThreadingHTTPServer):
+    """ HTTP server forwarding requests to a shared `MicroBatcher` """
+
+    def __init__(self, batcher, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        _ThreadingHTTPServer.__init__(
+            self, (host, port), TaggingRequestHandler)
+        self.batcher = batcher
+        self._tokenizer = None
+        self._tokenizer_lock = threading.Lock()
+
+    def tokenize(self, sentence):
+        """ tokens of a sentence given as a list of tokens or a string;
+        raises TypeError for any other value """
+        if isinstance(sentence, list):
+            for wd in sentence:
+                if not isinstance(wd, STRING_TYPES):
+                    raise TypeError('token %r is not a string' % (wd,))
+            return [wd for wd in sentence if wd.strip()]
+        if not isinstance(sentence, STRING_TYPES):
+            raise TypeError('sentence %r is neither a list of tokens nor '
+                            'a string' % (sentence,))
+        with self._tokenizer_lock:
+            if self._tokenizer is None:
+                import spacy
+                self._tokenizer = spacy.blank('fr').tokenizer
+            return [t.text for t in self._tokenizer(sentence)
+                    if not t.is_space]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m spacy_lefff.serve',
+        description='Serve MElt tags and Lefff lemmas over HTTP/JSON.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE,
+                        help='maximum number of sentences per batch')
+    parser.add_argument('--max-latency', type=float, default=MAX_LATENCY,
+                        help='maximum time (s) a request waits for its '
+                             'batch to fill up')
+    parser.add_argument('--beam-size', type=int, default=3)
+    parser.add_argument('--no-lemma', action='store_true',
+                        help='do not load the Lefff lemmatizer')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    lemmatizer = None if args.no_lemma else LefffLemmatizer()
+    batcher = MicroBatcher(POSTagger(), lemmatizer,
+                           max_batch_size=args.max_batch_size,
+                           max_latency=args.max_latency,
+                           beam_size=args.beam_size)
+    server = TaggingServer(batcher, host=args.host, port=args.port)
+    LOGGER.info('Serving on http://%s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# coding: utf8
+"""
+MElt tagging and Lefff lemmatization in a single pipeline component.
+
+    nlp.add_pipe(POSTaggerLemmatizer(), name='melt_lefff', after='parser')
+
+sets `token._.melt_tagger` and `token._.lefff_lemma` as `POSTagger`
+followed by `LefffLemmatizer(after_melt=True)` would.
+"""
+
+import os
+import logging
+
+from .lefff import LefffLemmatizer
+from .melt_tagger import POSTagger, FeatureCache
+
+LOGGER = logging.getLogger(__name__)
+
+# lemmatizer directory of a bundle written by to_disk
+LEMMATIZER_DIR = 'lefff'
+
+
+class POSTaggerLemmatizer(POSTagger):
+    """
+    MElt tagger also setting the Lefff lemma of each token.
+
+    The lemmas of a word form for every MElt tag are looked up once, and
+    cached as a row indexed by tag id: the lemma of a token is then read
+    from the row of its form at the id of the tag it was given. An
+    existing `LefffLemmatizer` can be passed to share its lemma
+    dictionary.
+    """
+
+    def __init__(self, data_dir=None, lemmatizer=None, **kwargs):
+        POSTagger.__init__(self, data_dir=data_dir, **kwargs)
+        self.lemmatizer = lemmatizer or LefffLemmatizer(after_melt=True)
+
+    def _configure(self, **config):
+        POSTagger._configure(self, **config)
+        # form -> lemma of the form for each tag id
+        self.lemma_rows = FeatureCache(thread_safe=self.thread_safe)
+        self._row_classes = None
+        self._row_overlay = None
+        self._class_ids = {}
+        self._categories = []
+
+    def _check_classes(self):
+        """ (re)build the tag id mapping when the model changed, and drop
+        the cached lemmas when the lemmatizer entries changed """
+        classes = self.classifier.classes
+        overlay = self.lemmatizer.overlay
+        if overlay is not self._row_overlay:
+            self.lemma_rows.clear()
+            self._row_overlay = overlay
+        if classes is not self._row_classes:
+            self.lemma_rows.clear()
+            self._class_ids = dict((cl, i) for i, cl in enumerate(classes))
+            # Lefff categories tried for each tag, as
+            # LefffLemmatizer(after_melt)
+            self._categories = [
+                self.lemmatizer.categories(cl.lower(), from_melt=True)
+                for cl in classes]
+            self._row_classes = classes
+        return self._class_ids
+
+    def lemma_row(self, form):
+        """ lemmas of `form` for each tag id """
+        self._check_classes()
+        row = self.lemma_rows.get(form)
+        if row is None:
+            text = form.lower()
+            missing = text if self.lemmatizer.default else None
+            # all the lemmas of the form in one probe
+            lemmas = self.lemmatizer.lemmas(text)
+            row = tuple(next((lemmas[category] for category in categories
+                              if category in lemmas), missing)
+                        for categories in self._categories)
+            row = self.lemma_rows.setdefault(form, row)
+        return row
+
+    def _set_annotations(self, doc, tagged_tokens):
+        labels = POSTagger._set_annotations(self, doc, tagged_tokens)
+        class_ids = self._check_classes()
+        for i, token in enumerate(doc):
+            # a label missing from the classes was given by a model
+            # swapped out since
+            if i < len(labels) and labels[i] in class_ids:
+                lemma = self.lemma_row(token.text)[class_ids[labels[i]]]
+            else:
+                lemma = self.lemmatizer.lemmatize(token.text, token.pos_)
+            token._.lefff_lemma = lemma
+        return labels
+
+    def to_disk(self, path, exclude=tuple(), **kwargs):
+        POSTagger.to_disk(self, path, exclude=exclude)
+        self.lemmatizer.to_disk(os.path.join(path, LEMMATIZER_DIR))
+
+    def from_disk(self, path, exclude=tuple(), mmap=True, **kwargs):
+        POSTagger.from_disk(self, path, exclude=exclude, mmap=mmap)
+        # don't modify a lemmatizer shared with other components
+        self.lemmatizer = LefffLemmatizer.__new__(LefffLemmatizer)
+        self.lemmatizer.from_disk(os.path.join(path, LEMMATIZER_DIR))
+        return self
+
+    def __getstate__(self):
+        state = POSTagger.__getstate__(self)
+        if 'files' in state:
+            state['lemmatizer'] = self.lemmatizer
+        return state
+
+    def __setstate__(self, state):
+        POSTagger.__setstate__(self, state)
+        if 'lemmatizer' in state:
+            self.lemmatizer = state['lemmatizer']
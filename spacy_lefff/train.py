@@ -0,0 +1,315 @@
+# coding: utf8
+"""
+Training of the MElt maximum entropy model.
+
+Features are extracted with the same `Instance` templates as the tagger
+(gold labels are used for the left context), stored as a sparse
+instance x feature matrix in CSR-like arrays, and the multinomial logistic
+regression is fitted with minibatch AdaGrad: scores, probabilities and
+gradients of a whole minibatch are computed with vectorized NumPy
+operations. The output directory can be loaded with
+`POSTagger.load_model`, `load_lexicon` and `load_tag_dictionary`.
+
+    spacy-lefff train corpus.brown -o models/my-domain --epochs 10
+
+A model is trained for the feature templates of a profile (see
+`profiles.PROFILES`), recorded in its profile.json along with its
+accuracy and speed on a development corpus when one is given.
+"""
+
+import os
+import shutil
+import logging
+import time
+
+import numpy as np
+
+from .melt_tagger import (Instance, MaxEntClassifier, FeatureCache, Token,
+                          TokenAttributes, BrownReader, ConllReader,
+                          POSTagger, LEXICON_FILE, PROFILE_FILE_NAME,
+                          serialize, unserialize)
+from .profiles import (PROFILES, feat_select_options, model_templates,
+                       template_allowed)
+
+LOGGER = logging.getLogger(__name__)
+
+CORPUS_READERS = {'brown': BrownReader, 'conll': ConllReader}
+
+
+def build_tag_dict(sentences):
+    """ word -> {tag: count} over the training corpus """
+    tag_dict = {}
+    for sentence in sentences:
+        for wd, tag in sentence:
+            tags = tag_dict.setdefault(wd, {})
+            tags[tag] = tags.get(tag, 0) + 1
+    return tag_dict
+
+
+def extract_instances(sentences, lex_dict, tag_dict,
+                      feat_options=feat_select_options):
+    """ yield (label, feature list) for every token of the corpus """
+    cache = FeatureCache()
+    for sentence in sentences:
+        tokens = [Token(string=wd, label=tag) for wd, tag in sentence]
+        attrs = TokenAttributes(tokens, lex_dict, tag_dict, feat_options,
+                                cache)
+        for i, token in enumerate(tokens):
+            inst = Instance(label=token.label, index=i, tokens=tokens,
+                            feat_selection=feat_options,
+                            lex_dict=lex_dict, tag_dict=tag_dict,
+                            cache=cache, attrs=attrs)
+            inst.get_features()
+            yield inst.label, inst.fv
+
+
+class MaxEntTrainer(object):
+    """
+    Minibatch AdaGrad trainer for `MaxEntClassifier`.
+
+    An existing classifier can be given to `train` to domain-adapt it:
+    its classes, features and weights are used as a starting point, and
+    new classes and features are added with zero weights.
+    """
+
+    def __init__(self, feat_options=feat_select_options, epochs=10,
+                 batch_size=256, learning_rate=0.1, l2=1e-6, prune=0.,
+                 seed=0):
+        self.feat_options = feat_options
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.prune = prune
+        self.seed = seed
+
+    def train(self, sentences, lex_dict, tag_dict=None, classifier=None):
+        sentences = list(sentences)
+        if tag_dict is None:
+            tag_dict = build_tag_dict(sentences)
+        instances = list(extract_instances(sentences, lex_dict, tag_dict,
+                                           self.feat_options))
+        LOGGER.info("  TAGGER (TRAIN): %d instances", len(instances))
+        classes, feature2int, weights, bias_weights = self._init_model(
+            instances, classifier)
+        labels, indptr, indices = self._build_matrix(
+            instances, classes, feature2int)
+        del instances
+        self._fit(labels, indptr, indices, weights, bias_weights)
+        trained = MaxEntClassifier()
+        trained.classes = classes
+        trained.feature2int = feature2int
+        trained.weights = weights
+        trained.bias_weights = bias_weights
+        if self.prune > 0:
+            prune_classifier(trained, self.prune)
+        return trained
+
+    def _init_model(self, instances, classifier=None):
+        classes = list(classifier.classes) if classifier is not None else []
+        for label, _ in instances:
+            if label not in classes:
+                classes.append(label)
+        if classifier is None:
+            feature2int = {}
+        else:
+            feature2int = dict(classifier.feature2int)
+        # discard features occurring less than ffthrsld times
+        threshold = self.feat_options.get('ffthrsld', 1)
+        counts = {}
+        for _, fv in instances:
+            for f in fv:
+                if f not in feature2int:
+                    counts[f] = counts.get(f, 0) + 1
+        for f in sorted(counts):
+            if counts[f] >= threshold:
+                feature2int[f] = len(feature2int)
+        weights = np.zeros((len(feature2int), len(classes)))
+        bias_weights = np.zeros(len(classes))
+        if classifier is not None:
+            n_features, n_classes = classifier.weights.shape
+            weights[:n_features, :n_classes] = classifier.weights
+            bias_weights[:n_classes] = classifier.bias_weights
+        LOGGER.info("  TAGGER (TRAIN): %d features, %d classes",
+                    len(feature2int), len(classes))
+        return classes, feature2int, weights, bias_weights
+
+    def _build_matrix(self, instances, classes, feature2int):
+        class2int = dict((cl, i) for i, cl in enumerate(classes))
+        labels = np.array([class2int[label] for label, _ in instances],
+                          dtype=np.int32)
+        indptr = [0]
+        indices = []
+        for _, fv in instances:
+            indices.extend(feature2int[f] for f in fv if f in feature2int)
+            indptr.append(len(indices))
+        return (labels, np.array(indptr, dtype=np.int64),
+                np.array(indices, dtype=np.int32))
+
+    def _fit(self, labels, indptr, indices, weights, bias_weights):
+        rng = np.random.RandomState(self.seed)
+        n_instances = len(labels)
+        lengths = np.diff(indptr)
+        # AdaGrad accumulators
+        weights_g2 = np.zeros(weights.shape[0])
+        bias_g2 = np.zeros_like(bias_weights)
+        eps = 1e-8
+        for epoch in range(self.epochs):
+            order = rng.permutation(n_instances)
+            loss = 0.
+            for start in range(0, n_instances, self.batch_size):
+                batch = order[start:start + self.batch_size]
+                batch_lengths = lengths[batch]
+                # gather the feature ids of the minibatch instances
+                shift = np.repeat(
+                    indptr[batch] - (np.cumsum(batch_lengths) -
+                                     batch_lengths), batch_lengths)
+                batch_indices = indices[
+                    np.arange(batch_lengths.sum()) + shift]
+                rows = np.repeat(np.arange(len(batch)), batch_lengths)
+                scores = np.tile(bias_weights, (len(batch), 1))
+                np.add.at(scores, rows, weights[batch_indices])
+                scores -= scores.max(axis=1)[:, np.newaxis]
+                probs = np.exp(scores)
+                probs /= probs.sum(axis=1)[:, np.newaxis]
+                gold = labels[batch]
+                loss -= np.log(
+                    np.maximum(probs[np.arange(len(batch)), gold], 1e-300)
+                ).sum()
+                # gradient of the negative log-likelihood
+                probs[np.arange(len(batch)), gold] -= 1.
+                probs /= len(batch)
+                touched, inverse = np.unique(batch_indices,
+                                             return_inverse=True)
+                grad = np.zeros((len(touched), weights.shape[1]))
+                np.add.at(grad, inverse, probs[rows])
+                grad += self.l2 * weights[touched]
+                weights_g2[touched] += (grad ** 2).sum(axis=1)
+                weights[touched] -= self.learning_rate * grad / (
+                    np.sqrt(weights_g2[touched])[:, np.newaxis] + eps)
+                bias_grad = probs.sum(axis=0)
+                bias_g2 += bias_grad ** 2
+                bias_weights -= self.learning_rate * bias_grad / (
+                    np.sqrt(bias_g2) + eps)
+            LOGGER.info("  TAGGER (TRAIN): epoch %d, loss %.4f",
+                        epoch + 1, loss / max(n_instances, 1))
+        return weights, bias_weights
+
+
+def prune_classifier(classifier, threshold):
+    """ drop the features whose weights are all below `threshold` in
+    absolute value, re-indexing the feature map """
+    return _keep_features(
+        classifier, np.abs(classifier.weights).max(axis=1) >= threshold)
+
+
+def prune_to_profile(classifier, feat_options):
+    """ drop the features of the templates not extracted with
+    `feat_options`, e.g. to adapt a model to a faster profile """
+    allowed = dict((t, template_allowed(t, feat_options))
+                   for t in model_templates(classifier.feature2int))
+    keep = np.zeros(len(classifier.weights), dtype=bool)
+    for f, i in classifier.feature2int.items():
+        keep[i] = allowed[f.split('=', 1)[0]]
+    return _keep_features(classifier, keep)
+
+
+def _keep_features(classifier, keep):
+    new_ids = np.cumsum(keep) - 1
+    classifier.feature2int = dict(
+        (f, int(new_ids[i])) for f, i in classifier.feature2int.items()
+        if keep[i])
+    classifier.weights = classifier.weights[keep]
+    return classifier
+
+
+def read_corpus(filepath, corpus_format='brown'):
+    return list(CORPUS_READERS[corpus_format](filepath))
+
+
+def evaluate(tagger, sentences, beam_size=3, batch_size=64,
+             feat_options=None):
+    """ accuracy and speed (tokens per second) of `tagger` on tagged
+    sentences """
+    n_tokens = 0
+    n_correct = 0
+    t0 = time.time()
+    for start in range(0, len(sentences), batch_size):
+        batch = sentences[start:start + batch_size]
+        tagged_sequences = tagger.tag_token_sequences(
+            [[Token(string=wd) for wd, _ in sentence] for sentence in batch],
+            feat_options=feat_options,
+            beam_size=beam_size)
+        for sentence, tagged_tokens in zip(batch, tagged_sequences):
+            n_tokens += len(sentence)
+            n_correct += sum(1 for (_, tag), tok in
+                             zip(sentence, tagged_tokens) if tag == tok.label)
+    elapsed = time.time() - t0
+    return {
+        'tokens': n_tokens,
+        'accuracy': n_correct / float(n_tokens) if n_tokens else None,
+        'tokens_per_second': n_tokens / elapsed if elapsed > 0 else None,
+        'beam_size': beam_size,
+    }
+
+
+def train_model(corpus_path, output_dir, corpus_format='brown',
+                lexicon_file_name=LEXICON_FILE, init_model=None,
+                trainer=None, profile=None, dev_path=None):
+    """
+    Train a model from a tagged corpus and write it to `output_dir`
+    (classes.json, feature_map.json, weights.npy, bias_weights.npy, plus
+    the lexicon.json and tag_dict.json used to train it).
+
+    The model is trained for the feature templates of `profile` (those of
+    `trainer` when no profile is given), recorded in profile.json with its
+    evaluation on the `dev_path` corpus if given.
+    """
+    if profile is None:
+        trainer = trainer or MaxEntTrainer()
+        profile = _profile_name(trainer.feat_options)
+    elif trainer is None:
+        trainer = MaxEntTrainer(feat_options=PROFILES[profile])
+    elif trainer.feat_options != PROFILES[profile]:
+        raise ValueError("The trainer's feature options don't match "
+                         "profile %s" % profile)
+    sentences = read_corpus(corpus_path, corpus_format)
+    lex_dict = unserialize(lexicon_file_name)
+    tag_dict = build_tag_dict(sentences)
+    classifier = None
+    if init_model is not None:
+        classifier = MaxEntClassifier()
+        classifier.load(init_model)
+        prune_to_profile(classifier, trainer.feat_options)
+        init_tag_dict = os.path.join(init_model, 'tag_dict.json')
+        if os.path.exists(init_tag_dict):
+            # keep the tags seen in the original training data
+            for wd, tags in unserialize(init_tag_dict).items():
+                for tag, ct in tags.items():
+                    tag_dict.setdefault(wd, {}).setdefault(tag, ct)
+    classifier = trainer.train(sentences, lex_dict, tag_dict, classifier)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    classifier.dump(output_dir)
+    serialize(tag_dict, os.path.join(output_dir, 'tag_dict.json'))
+    lexicon_copy = os.path.join(output_dir, 'lexicon.json')
+    if os.path.abspath(lexicon_file_name) != os.path.abspath(lexicon_copy):
+        shutil.copyfile(lexicon_file_name, lexicon_copy)
+    profile_info = {'name': profile, 'feat_options': trainer.feat_options}
+    if dev_path is not None:
+        tagger = POSTagger.from_files(
+            lexicon_copy, os.path.join(output_dir, 'tag_dict.json'),
+            output_dir, profile=profile or trainer.feat_options)
+        profile_info['evaluation'] = evaluate(
+            tagger, read_corpus(dev_path, corpus_format),
+            feat_options=trainer.feat_options)
+        LOGGER.info("  TAGGER (TRAIN): %s", profile_info['evaluation'])
+    serialize(profile_info, os.path.join(output_dir, PROFILE_FILE_NAME))
+    return classifier
+
+
+def _profile_name(feat_options):
+    for name, options in PROFILES.items():
+        if options == feat_options:
+            return name
+    return None
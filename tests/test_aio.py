@@ -0,0 +1,181 @@
+# coding: utf-8
+
+import sys
+
+import pytest
+
+if sys.version_info < (3, 6):
+    pytest.skip('asyncio API needs Python 3.6+', allow_module_level=True)
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from spacy_lefff.aio import AsyncPipeline
+
+
+class Recorder(object):
+    """ component recording the batches it runs on """
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, item):
+        return item * 2
+
+    def run_batch(self, items):
+        with self.lock:
+            self.batches.append(list(items))
+        return [item * 2 for item in items]
+
+
+class Blocking(object):
+    """ component waiting for an event """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def __call__(self, item):
+        self.event.wait(10)
+        return item * 2
+
+
+class Pickled(object):
+    """ component counting how many times it is pickled """
+    pickles = 0
+
+    def __call__(self, item):
+        return item * 2
+
+    def __getstate__(self):
+        Pickled.pickles += 1
+        return {}
+
+
+class AsyncRange(object):
+
+    def __init__(self, n):
+        self.items = iter(range(n))
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        try:
+            return asyncio.sleep(0, next(self.items))
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def atag_all(pipeline, items):
+    """ results of concurrent `atag` calls """
+    loop = asyncio.new_event_loop()
+    try:
+        tasks = [loop.create_task(pipeline.atag(item)) for item in items]
+        return loop.run_until_complete(asyncio.gather(*tasks))
+    finally:
+        pipeline.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+
+def run_tasks(pipeline, items, before_close=None):
+    """ results or errors of concurrent `atag` calls, the pipeline being
+    closed once they are all started """
+    loop = asyncio.new_event_loop()
+    try:
+        tasks = [loop.create_task(pipeline.atag(item)) for item in items]
+        loop.run_until_complete(asyncio.sleep(0.1))
+        if before_close is not None:
+            before_close()
+        pipeline.close()
+        return loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+    finally:
+        loop.close()
+
+
+def collect(agen):
+    """ items of an async generator, consumed in one event loop """
+    loop = asyncio.new_event_loop()
+    items = []
+    try:
+        while True:
+            try:
+                items.append(loop.run_until_complete(agen.__anext__()))
+            except StopAsyncIteration:
+                return items
+    finally:
+        loop.close()
+
+
+def test_apipe_in_order():
+    component = Recorder()
+    pipeline = AsyncPipeline(component, batch_size=4, max_pending=2,
+                             batch_method='run_batch',
+                             executor=ThreadPoolExecutor(3))
+    assert collect(pipeline.apipe(range(10))) == \
+        [2 * i for i in range(10)]
+    assert sorted(len(b) for b in component.batches) == [2, 4, 4]
+    assert collect(pipeline.apipe(AsyncRange(5))) == [0, 2, 4, 6, 8]
+
+
+def test_atag_batches_concurrent_calls():
+    component = Recorder()
+    pipeline = AsyncPipeline(component, batch_size=8, max_queue=4,
+                             batch_method='run_batch')
+    results = atag_all(pipeline, range(20))
+    assert results == [2 * i for i in range(20)]
+    assert max(len(b) for b in component.batches) > 1
+    assert sum(len(b) for b in component.batches) == 20
+
+
+def test_atag_error():
+    pipeline = AsyncPipeline(lambda item: 1 // item)
+    with pytest.raises(ZeroDivisionError):
+        atag_all(pipeline, [1, 0])
+
+
+def test_atag_pos_tagger():
+    from spacy_lefff import POSTagger
+    pipeline = AsyncPipeline(POSTagger(), batch_method='tag_sentences')
+    sentences = [[u"Il", u"y", u"a", u"des", u"Françaises", u"."],
+                 [u"J'", u"ai", u"une", u"maison", u"."]]
+    results = atag_all(pipeline, sentences)
+    expected = pipeline.component.tag_sentences(sentences)
+    assert [r.tolist() for r in results] == [e.tolist() for e in expected]
+
+
+def test_atag_submit_error():
+    # batches that can't be submitted fail, and free their slot
+    executor = ThreadPoolExecutor(1)
+    executor.shutdown()
+    pipeline = AsyncPipeline(lambda item: item, executor=executor,
+                             batch_size=1, max_pending=1)
+    results = run_tasks(pipeline, range(3))
+    assert [type(r) for r in results] == [RuntimeError] * 3
+
+
+def test_close_fails_queued_calls():
+    component = Blocking()
+    pipeline = AsyncPipeline(component, batch_size=1, max_pending=1,
+                             max_queue=2, executor=ThreadPoolExecutor(1))
+    # one batch running, one waiting for a slot, two queued, one waiting
+    # for room in the queue
+    results = run_tasks(pipeline, range(5), before_close=component.event.set)
+    assert results[0] == 0
+    assert [type(r) for r in results[1:]] == [RuntimeError] * 4
+
+
+def test_process_pool():
+    Pickled.pickles = 0
+    pipeline = AsyncPipeline(Pickled(), processes=2, batch_size=2)
+    try:
+        assert collect(pipeline.apipe(range(10))) == \
+            [2 * i for i in range(10)]
+    finally:
+        pipeline.close()
+    if sys.version_info >= (3, 7):
+        # sent to the workers when they start, not with every batch
+        assert Pickled.pickles == 1
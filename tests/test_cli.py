@@ -0,0 +1,68 @@
+# coding: utf-8
+
+import io
+import json
+
+from spacy_lefff.cli import (main, read_sentences, tag_stream, format_conllu,
+                             PROFILE_NAMES)
+
+SENTENCES = [u"Il y a des Costariciennes .",
+             u"J' ai une maison à Paris .",
+             u"",
+             u"Les abaissements de température sont gênants ."]
+
+
+def test_read_sentences():
+    lines = [u'{"tokens": ["Il", "y", "a"]}\n', u'\n',
+             u'{"text": "J\' ai une maison"}\n']
+    assert list(read_sentences(lines, 'jsonl')) == \
+        [[u"Il", u"y", u"a"], [], [u"J'", u"ai", u"une", u"maison"]]
+    assert list(read_sentences(SENTENCES))[1] == SENTENCES[1].split()
+
+
+def test_tag_stream_workers_keep_order():
+    sentences = list(read_sentences(SENTENCES * 5))
+    single = list(tag_stream(sentences, workers=1, batch_size=2))
+    parallel = list(tag_stream(sentences, workers=2, batch_size=2))
+    assert [r[0] for r in single] == sentences
+    assert single == parallel
+    tokens, tags, lemmas, probas = single[0]
+    assert tags == [u"CLS", u"CLO", u"V", u"DET", u"NPP", u"PONCT"]
+
+
+def test_format_conllu():
+    out = format_conllu([u"ai"], [u"V"], [u"avoir"], [0.5], with_probas=True)
+    assert out == u"1\tai\tavoir\t_\tV\t_\t_\t_\t_\tMeltProba=0.500000\n\n"
+    assert format_conllu([], [], [], []) == u"# text = \n\n"
+
+
+def test_tag_command(tmpdir):
+    infile = tmpdir.join('input.txt')
+    infile.write_text(u"\n".join(SENTENCES), encoding='utf-8')
+    outfile = tmpdir.join('output.jsonl')
+    assert main(['tag', infile.strpath, '-o', outfile.strpath,
+                 '--output-format', 'jsonl', '--probas']) == 0
+    with io.open(outfile.strpath, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    # one record per input line
+    assert len(records) == 4
+    assert records[1]['lemmas'][1] == u"avoir"
+    assert records[2]['tokens'] == []
+    assert len(records[3]['probas']) == len(records[3]['tokens'])
+
+
+def test_tag_command_conllu(tmpdir):
+    infile = tmpdir.join('input.txt')
+    infile.write_text(u"\n".join(SENTENCES), encoding='utf-8')
+    outfile = tmpdir.join('output.conllu')
+    assert main(['tag', infile.strpath, '-o', outfile.strpath]) == 0
+    with io.open(outfile.strpath, encoding='utf-8') as f:
+        blocks = f.read().split(u"\n\n")[:-1]
+    # one sentence block per input line
+    assert len(blocks) == 4
+    assert blocks[2] == u"# text = "
+
+
+def test_profile_names():
+    from spacy_lefff.melt_tagger import PROFILES
+    assert sorted(PROFILES) == sorted(PROFILE_NAMES)
@@ -3,14 +3,24 @@
 
 import os
 import io
+import logging
+import json
+import hashlib
+import threading
 import pytest
 import tarfile
 import tempfile
 from mock import patch, Mock, MagicMock
 import requests
 from spacy_lefff import Downloader
+from spacy_lefff.downloader import DownloadError, MANIFEST_FILE_NAME
 from spacy_lefff.melt_tagger import URL_MODEL
 
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
 def test_url_model():
     assert requests.get(URL_MODEL).status_code == 200
 
@@ -46,52 +56,240 @@ def _mock_response(
         )
     return mock_resp
 
-@pytest.fixture(scope='session')
-def _tmp_dir(tmpdir_factory):
+def _tar_bytes(tmpdir, members):
     '''
-    Creating a tar file from a test file in a tmp folder.
+    Creating a tar.gz archive holding the given {name: content} files.
     '''
-    dirtmp = tmpdir_factory.mktemp('models')
-    tmpfile = dirtmp.join('model')
-    tmpfile.write('TEST')
-    tar = tarfile.open(os.path.join(dirtmp.strpath, "model.tar.gz"), "w:gz")
-    tar.add(tmpfile.strpath, 'model')
+    path = os.path.join(tmpdir.strpath, 'archive.tar.gz')
+    tar = tarfile.open(path, 'w:gz')
+    for name, content in members.items():
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
     tar.close()
-    os.remove(tmpfile.strpath)
-    return dirtmp
-
-@patch('spacy_lefff.downloader.requests.get')
-@patch('spacy_lefff.downloader.tarfile')
-def test_downloader(mock_tarfile, mock_get, _tmp_dir):
-    content_disposition = 'attachment; filename="model.tar.gz"; filename*=UTF-8''model.tar.gz'
-    model_tarfile = tarfile.open(os.path.join(_tmp_dir.strpath, 'model.tar.gz'), 'r:gz')
-    headers = {'content-disposition': content_disposition, 'content-length': 100000}
-    mock_resp = _mock_response(headers=headers)
-    mock_get.return_value = mock_resp
-    mock_tarfile.open.return_value = model_tarfile 
-    d = Downloader('test', download_dir=_tmp_dir.strpath, url=URL_MODEL)
-    test_folder = os.path.join(_tmp_dir.strpath, 'test')
-    m = os.path.join(test_folder, 'model')
-    assert len(_tmp_dir.listdir()) == 2 #test folder, temp model tar
-    f = io.open(m, mode='r', encoding='utf-8')
-    #checking if untar model is the same as the one in _tmp_dir tar file
-    assert str(f.read()) == 'TEST'
-
-@patch('spacy_lefff.downloader.requests.get')
-def test_downloader_failed(mock_get, _tmp_dir):
+    with open(path, 'rb') as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+class _ArchiveHandler(BaseHTTPRequestHandler):
+    '''
+    Local stand-in for the model host, supporting range requests. The first
+    `server.truncate` responses are cut after half of the payload.
+    '''
+
+    def do_GET(self):
+        data = self.server.data
+        self.server.requests.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Disposition',
+                         'attachment; filename="model.tar.gz"')
+        self.end_headers()
+        if self.server.truncate > 0:
+            self.server.truncate -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def archive_server():
+    server = HTTPServer(('127.0.0.1', 0), _ArchiveHandler)
+    server.data = b''
+    server.truncate = 0
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.url = 'http://127.0.0.1:%d/model.tar.gz?dl=1' % server.server_port
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_downloader(archive_server, tmpdir):
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST' * 10000})
+    d = Downloader('test', download_dir=tmpdir.strpath,
+                   url=archive_server.url)
+    test_folder = os.path.join(tmpdir.strpath, 'test')
+    # test folder and lock file only: no temporary directory nor partial
+    # archive left
+    assert sorted(tmpdir.listdir()) == \
+        sorted([tmpdir.join('test'), tmpdir.join('.test.lock')])
+    with io.open(os.path.join(test_folder, 'model'), mode='r',
+                 encoding='utf-8') as f:
+        assert f.read() == u'TEST' * 10000
+    with open(os.path.join(test_folder, MANIFEST_FILE_NAME)) as f:
+        manifest = json.load(f)
+    assert manifest['files'] == {'model': 40000}
+    assert manifest['sha256'] == \
+        hashlib.sha256(archive_server.data).hexdigest()
+
+
+def test_downloader_prepare(archive_server, tmpdir):
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST'})
+
+    def prepare(directory):
+        with open(os.path.join(directory, 'model'), 'ab') as f:
+            f.write(b'ED')
+
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url,
+               prepare=prepare)
+    test_folder = os.path.join(tmpdir.strpath, 'test')
+    with open(os.path.join(test_folder, 'model'), 'rb') as f:
+        assert f.read() == b'TESTED'
+    # the manifest lists the prepared files
+    with open(os.path.join(test_folder, MANIFEST_FILE_NAME)) as f:
+        assert json.load(f)['files'] == {'model': 6}
+    d = Downloader('test', download_dir=tmpdir.strpath,
+                   url=archive_server.url, prepare=prepare)
+    assert d.is_installed()
+    assert len(archive_server.requests) == 1
+
+
+def test_downloader_resume(archive_server, tmpdir):
+    archive_server.data = _tar_bytes(tmpdir, {'model': os.urandom(100000)})
+    archive_server.truncate = 1
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url,
+               chunk_size=1024)
+    assert archive_server.requests[0] is None
+    assert archive_server.requests[1].startswith('bytes=')
+    assert os.path.getsize(
+        os.path.join(tmpdir.strpath, 'test', 'model')) == 100000
+
+
+def test_downloader_checksum_mismatch(archive_server, tmpdir):
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST'})
+    with pytest.raises(DownloadError):
+        Downloader('test', download_dir=tmpdir.strpath,
+                   url=archive_server.url, sha256='0' * 64)
+    assert not os.path.exists(os.path.join(tmpdir.strpath, 'test'))
+
+
+def test_downloader_unsafe_archive(archive_server, tmpdir):
+    archive_server.data = _tar_bytes(tmpdir, {'../evil': b'TEST'})
+    with pytest.raises(DownloadError):
+        Downloader('test', download_dir=tmpdir.strpath,
+                   url=archive_server.url)
+    assert not os.path.exists(os.path.join(tmpdir.strpath, 'evil'))
+    assert not os.path.exists(os.path.join(tmpdir.strpath, 'test'))
+
+
+def test_downloader_checksum(archive_server, tmpdir, caplog):
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST'})
+    digest = hashlib.sha256(archive_server.data).hexdigest()
+    caplog.set_level(logging.WARNING)
+    Downloader('test', download_dir=tmpdir.join('a').strpath,
+               url=archive_server.url, sha256=digest)
+    assert 'no checksum' not in caplog.text
+    # without a checksum, the data is installed with a warning
+    Downloader('test', download_dir=tmpdir.join('b').strpath,
+               url=archive_server.url)
+    assert 'no checksum' in caplog.text
+    assert digest in caplog.text
+
+
+@patch('requests.get')
+def test_downloader_failed(mock_get, tmpdir):
     mock_resp = _mock_response()
     mock_get.return_value = mock_resp
     with pytest.raises(Exception) as e_info:
-        d = Downloader('test', download_dir=_tmp_dir.strpath, url='')
+        d = Downloader('test', download_dir=tmpdir.strpath, url='')
         assert e_info.value.message == "Couldn't fetch model data."
 
-def test_downloader_data_already_set_up(_tmp_dir, caplog):
+
+def test_downloader_data_already_set_up(archive_server, tmpdir, caplog):
     '''
-    Testing if data is already set up, 
-    meaning folder named 'test' already in download_dir
+    Testing if data is already set up,
+    meaning folder named 'test' holds the files listed in its manifest
     '''
-    if not os.path.exists(os.path.join(_tmp_dir.strpath, 'test')):
-        os.mkdir(os.path.join(_tmp_dir.strpath, 'test'))
-    d = Downloader('test', download_dir=_tmp_dir.strpath, url=URL_MODEL)
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST'})
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url)
+    caplog.clear()
+    caplog.set_level(logging.INFO)
+    d = Downloader('test', download_dir=tmpdir.strpath,
+                   url=archive_server.url)
+    assert len(archive_server.requests) == 1
     assert caplog.records[0].levelname == 'INFO'
     assert 'data already set up' in caplog.text
+
+
+def test_downloader_repairs_incomplete_install(archive_server, tmpdir):
+    '''
+    A folder left by an interrupted install (no manifest) is replaced.
+    '''
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST'})
+    os.mkdir(os.path.join(tmpdir.strpath, 'test'))
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url)
+    assert os.path.exists(os.path.join(tmpdir.strpath, 'test', 'model'))
+    # a missing file is detected on the next start
+    os.remove(os.path.join(tmpdir.strpath, 'test', 'model'))
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url)
+    assert len(archive_server.requests) == 2
+    assert os.path.exists(os.path.join(tmpdir.strpath, 'test', 'model'))
+
+
+def test_downloader_concurrent_installs(archive_server, tmpdir):
+    '''
+    Downloaders started at once on the same data directory fetch the data
+    once.
+    '''
+    archive_server.data = _tar_bytes(tmpdir, {'model': os.urandom(100000)})
+    errors = []
+
+    def install():
+        try:
+            Downloader('test', download_dir=tmpdir.strpath,
+                       url=archive_server.url, chunk_size=1024)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=install) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert archive_server.requests == [None]
+    assert os.path.getsize(
+        os.path.join(tmpdir.strpath, 'test', 'model')) == 100000
+
+
+def test_downloader_empty_manifest(archive_server, tmpdir):
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST'})
+    os.mkdir(os.path.join(tmpdir.strpath, 'test'))
+    with open(os.path.join(tmpdir.strpath, 'test', MANIFEST_FILE_NAME),
+              'w') as f:
+        json.dump({'files': {}}, f)
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url)
+    assert os.path.exists(os.path.join(tmpdir.strpath, 'test', 'model'))
+
+
+def test_downloader_discards_foreign_part(archive_server, tmpdir):
+    '''
+    A partial file left by the download of another URL is not resumed.
+    '''
+    archive_server.data = _tar_bytes(tmpdir, {'model': b'TEST' * 1000})
+    part = os.path.join(tmpdir.strpath, '.test.part')
+    with open(part, 'wb') as f:
+        f.write(b'garbage')
+    with open(part + '.json', 'w') as f:
+        json.dump({'url': 'http://elsewhere/model.tar.gz'}, f)
+    Downloader('test', download_dir=tmpdir.strpath, url=archive_server.url)
+    assert archive_server.requests == [None]
+    assert not os.path.exists(part) and not os.path.exists(part + '.json')
+    with open(os.path.join(tmpdir.strpath, 'test', 'model'), 'rb') as f:
+        assert f.read() == b'TEST' * 1000
@@ -0,0 +1,51 @@
+# coding: utf-8
+import subprocess
+import sys
+
+import pytest
+
+# cumulative import time budget of the package, in microseconds: loose,
+# as timings vary across machines; the modules loaded are checked below
+IMPORT_BUDGET = 1000000
+# dependencies only needed by the tagger or to download data
+HEAVY_MODULES = ['numpy', 'spacy', 'requests', 'tqdm', 'tarfile',
+                 'spacy_lefff.melt_tagger']
+
+
+def _run(code, *options):
+    return subprocess.check_output(
+        [sys.executable] + list(options) + ['-c', code],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+def _loaded_modules(code):
+    """ modules loaded after running `code` in a new interpreter """
+    return set(_run(code + '\nimport sys\nprint("\\n".join(sys.modules))')
+               .split())
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason='-X importtime and module __getattr__ are 3.7+')
+def test_import_time():
+    cumulative = None
+    for line in _run('import spacy_lefff', '-X', 'importtime').splitlines():
+        if line.endswith('| spacy_lefff'):
+            cumulative = int(line.split('|')[1])
+    assert cumulative is not None, 'no import time reported for spacy_lefff'
+    assert cumulative <= IMPORT_BUDGET
+    loaded = _loaded_modules('import spacy_lefff')
+    assert not [name for name in HEAVY_MODULES if name in loaded]
+    # the lemmatizer doesn't pull the tagger and download dependencies
+    loaded = _loaded_modules('import spacy_lefff\n'
+                             'spacy_lefff.LefffLemmatizer')
+    assert 'spacy_lefff.lefff' in loaded
+    assert not [name for name in HEAVY_MODULES if name in loaded]
+
+
+def test_lazy_attributes():
+    import spacy_lefff
+    from spacy_lefff.lefff import LefffLemmatizer
+    assert spacy_lefff.LefffLemmatizer is LefffLemmatizer
+    assert 'POSTagger' in dir(spacy_lefff)
+    with pytest.raises(AttributeError):
+        spacy_lefff.Unknown
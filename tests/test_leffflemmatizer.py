@@ -1,8 +1,12 @@
 # coding: utf-8
+import io
+import pickle
 import pytest
+import numpy as np
 
 import spacy
 from spacy_lefff import LefffLemmatizer
+from spacy_lefff.lefff import read_lefff, read_lefff_index, read_delta_log
 
 """
 Test suite coming from spacy.
@@ -47,3 +51,150 @@ def test_lemmatizer_exception():
 def test_lemmatizer_default():
     french_lemmatizer = LefffLemmatizer(default=True)
     assert french_lemmatizer.lemmatize(u"Apple", u"NOUN") == u"apple"
+
+
+def test_lemmatizer_serialization(tmpdir):
+    french_lemmatizer = LefffLemmatizer(after_melt=True)
+    french_lemmatizer.to_disk(tmpdir.strpath)
+    restored = LefffLemmatizer().from_disk(tmpdir.strpath)
+    assert restored.after_melt
+    assert restored.lemma_dict == french_lemmatizer.lemma_dict
+    restored = LefffLemmatizer().from_bytes(french_lemmatizer.to_bytes())
+    assert restored.lemmatize(u"maisons", u"nc", from_melt=True) == \
+        u"maison"
+
+
+def test_lemmatizer_pickle():
+    french_lemmatizer = LefffLemmatizer(default=True)
+    data = pickle.dumps(french_lemmatizer, 2)
+    assert len(data) < 10000
+    restored = pickle.loads(data)
+    assert restored.default
+    assert restored.lemmatize(u"maisons", u"NOUN") == u"maison"
+
+
+def test_lemmatize_batch():
+    french_lemmatizer = LefffLemmatizer()
+    forms = [u"maisons", u"Paris", u"maisons", u"unknow34", None]
+    tags = [u"NOUN", u"PROPN", u"NOUN", u"NOUN", u"NOUN"]
+    lemmas, found = french_lemmatizer.lemmatize_batch(forms, np.array(tags))
+    assert lemmas.tolist() == [
+        french_lemmatizer.lemmatize(form, tag) if form else None
+        for form, tag in zip(forms, tags)]
+    assert found.tolist() == [True, lemmas[1] is not None, True, False,
+                              False]
+    lemmas, found = french_lemmatizer.lemmatize_batch(
+        [u"ai", u"maison"], [u"V", u"NC"], from_melt=True)
+    assert lemmas.tolist() == [u"avoir", u"maison"]
+    assert found.all()
+
+
+def test_lemmatize_batch_default():
+    french_lemmatizer = LefffLemmatizer(default=True)
+    lemmas, found = french_lemmatizer.lemmatize_batch(
+        [u"Unknow34"], [u"NOUN"])
+    assert lemmas.tolist() == [u"unknow34"]
+    assert not found[0]
+    with pytest.raises(ValueError):
+        french_lemmatizer.lemmatize_batch([u"maisons"], [])
+
+
+def test_lemmatize_types():
+    french_lemmatizer = LefffLemmatizer()
+    # an untagged token has no lemma
+    assert french_lemmatizer.lemmatize(u"maisons", None) is None
+    with pytest.raises(TypeError):
+        french_lemmatizer.lemmatize(3, u"NOUN")
+    with pytest.raises(TypeError):
+        french_lemmatizer.lemmatize(u"maisons", [u"NOUN"])
+    with pytest.raises(TypeError):
+        french_lemmatizer.lemmatize_batch([u"maisons"], [1.5])
+
+
+def test_add_remove_entries(tmpdir):
+    log = tmpdir.join('delta.log').strpath
+    french_lemmatizer = LefffLemmatizer(delta_log=log)
+    french_lemmatizer.add_entries([(u"iphones", u"nc", u"iphone")])
+    french_lemmatizer.remove_entries([(u"maisons", u"nc")])
+    assert french_lemmatizer.lemmatize(u"iPhones", u"NOUN") == u"iphone"
+    assert french_lemmatizer.lemmatize(u"maisons", u"NOUN") is None
+    assert (u"maisons", u"nc") in french_lemmatizer.lemma_dict
+    # a restart replays the changes
+    restarted = LefffLemmatizer(delta_log=log)
+    assert restarted.overlay == french_lemmatizer.overlay
+    assert restarted.lemmatize(u"iphones", u"nc", from_melt=True) == \
+        u"iphone"
+    restored = pickle.loads(pickle.dumps(restarted, 2))
+    assert restored.lemmatize(u"maisons", u"NOUN") is None
+    # a truncated change is skipped
+    with io.open(log, 'ab') as f:
+        f.write(u'{"add": ["chât'.encode('utf-8')[:-1])
+    torn = LefffLemmatizer(delta_log=log)
+    assert torn.overlay == restarted.overlay
+    # and doesn't swallow the next change
+    torn.add_entries([(u"chattes", u"nc", u"chatte")])
+    restarted = LefffLemmatizer(delta_log=log)
+    assert restarted.lemmatize(u"chattes", u"NOUN") == u"chatte"
+    assert restarted.overlay == torn.overlay
+
+
+def test_delta_log_skips_non_changes(tmpdir):
+    log = tmpdir.join('delta.log')
+    log.write_binary(b'[]\n1\n"add"\n{}\n'
+                     b'{"add": ["iphones", "nc", "iphone"]}\n'
+                     b'null\n{"remove": ["maisons", "nc"]}\n')
+    assert read_delta_log(log.strpath) == {
+        (u"iphones", u"nc"): u"iphone", (u"maisons", u"nc"): None}
+
+
+def test_entries_serialization(tmpdir):
+    french_lemmatizer = LefffLemmatizer()
+    french_lemmatizer.add_entries([(u"iphones", u"nc", u"iphone")])
+    french_lemmatizer.remove_entries([(u"maisons", u"nc")])
+    # without a delta log, the entries themselves are pickled
+    restored = pickle.loads(pickle.dumps(french_lemmatizer, 2))
+    assert restored.lemmatize(u"iphones", u"NOUN") == u"iphone"
+    assert restored.lemmatize(u"maisons", u"NOUN") is None
+    assert not restored.overlay
+    assert restored.lemma_dict == french_lemmatizer.entries()
+
+
+def test_fallbacks():
+    french_lemmatizer = LefffLemmatizer()
+    # ADP maps to det first, PRON to cln first
+    assert french_lemmatizer.lemmatize(u"à", u"ADP") == u"à"
+    assert french_lemmatizer.lemmatize(u"lui", u"PRON") == u"lui"
+    assert french_lemmatizer.lemmatize(u"ai", u"vs", from_melt=True) == \
+        u"avoir"
+    assert french_lemmatizer.categories(u"ADP")[0] == u"det"
+    # whatever the case of the tag
+    assert french_lemmatizer.categories(u"adp") == \
+        french_lemmatizer.categories(u"ADP")
+    assert french_lemmatizer.categories(u"P+D", from_melt=True) == \
+        french_lemmatizer.categories(u"p+d", from_melt=True) == \
+        (u"prep", u"det")
+    assert french_lemmatizer.lemmatize(u"ai", u"VS", from_melt=True) == \
+        u"avoir"
+    lemmas = french_lemmatizer.lemmas(u"lui")
+    assert lemmas[u"pro"] == u"lui" and lemmas[u"v"] == u"luire"
+    strict = LefffLemmatizer(fallbacks={}, melt_fallbacks={})
+    assert strict.lemmatize(u"à", u"ADP") is None
+    assert strict.lemmatize(u"maisons", u"NOUN") == u"maison"
+    # without fallbacks, MElt tags map to a single category
+    assert strict.categories(u"p+d", from_melt=True) == (u"prep",)
+    assert strict.lemmatize(u"ai", u"vs", from_melt=True) == u"avoir"
+    assert strict.lemmatize(u"lui", u"pro", from_melt=True) == u"lui"
+    restored = pickle.loads(pickle.dumps(strict, 2))
+    assert restored.fallbacks == {} and restored.melt_fallbacks == {}
+
+
+def test_lemma_index(tmpdir):
+    french_lemmatizer = LefffLemmatizer()
+    pairs = read_lefff(french_lemmatizer.lefff_file)
+    assert len(french_lemmatizer.lemma_dict) == len(pairs)
+    assert french_lemmatizer.lemma_dict[(u"maisons", u"nc")] == u"maison"
+    path = tmpdir.join('lefff.mlex').strpath
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u"lui\tpro\tlui\t\nlui\tv\tlui\t\nlui\tv\tluire\t\n")
+    assert read_lefff_index(path) == {u"lui": (u"pro", u"lui",
+                                               u"v", u"luire")}
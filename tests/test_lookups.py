@@ -0,0 +1,51 @@
+# coding: utf-8
+import pytest
+
+from spacy_lefff import LefffLemmatizer
+from spacy_lefff.lookups import lookups_tables, install_lookups
+
+
+@pytest.fixture(scope='module')
+def lemmatizer():
+    lemmatizer = LefffLemmatizer()
+    lemmatizer.add_entries([(u"iphones", u"nc", u"iphone")])
+    return lemmatizer
+
+
+@pytest.fixture(scope='module')
+def tables(lemmatizer):
+    return lookups_tables(lemmatizer)
+
+
+def test_tables_agree_with_lemmatizer(lemmatizer, tables):
+    exc = tables['lemma_exc']
+    for form, pos in [(u"maisons", u"NOUN"), (u"ai", u"VERB"),
+                      (u"à", u"ADP"), (u"lui", u"PRON"),
+                      (u"Paris", u"PROPN"), (u"iphones", u"NOUN"),
+                      (u"gênants", u"ADJ"), (u"unknow34", u"NOUN")]:
+        lemmas = exc[pos.lower()].get(form)
+        assert (lemmas[0] if lemmas else None) == \
+            lemmatizer.lemmatize(form, pos)
+    assert tables['lemma_lookup'][u"maisons"] == [u"maison"]
+    assert tables['lemma_lookup'][u"iphones"] == [u"iphone"]
+    assert set(tables['lemma_rules']) == set(exc)
+
+
+def test_install_lookups(lemmatizer):
+    spacy = pytest.importorskip('spacy')
+    pytest.importorskip('spacy.lookups')
+    nlp = spacy.blank('fr')
+    lookups = install_lookups(nlp, lemmatizer)
+    assert lookups is nlp.vocab.lookups
+    assert lookups.get_table('lemma_lookup')[u"maisons"] == [u"maison"]
+    assert lookups.get_table('lemma_exc')['verb'][u"ai"] == [u"avoir"]
+
+
+def test_lemmas_of_processed_doc(lemmatizer):
+    spacy = pytest.importorskip('spacy')
+    pytest.importorskip('spacy.lookups')
+    nlp = spacy.blank('fr')
+    install_lookups(nlp, lemmatizer)
+    doc = nlp(u"Les maisons et les iphones")
+    assert doc[1].lemma_ == u"maison"
+    assert doc[4].lemma_ == u"iphone"
@@ -0,0 +1,61 @@
+# coding: utf-8
+import pytest
+import numpy as np
+
+from spacy_lefff import POSTagger, LefffLemmatizer
+from spacy_lefff.memory import deep_sizeof, total_size
+
+tracemalloc = pytest.importorskip('tracemalloc')
+
+MB = 1024 * 1024
+# memory budget of each component, in bytes
+LEMMATIZER_BUDGET = 200 * MB
+TAGGER_BUDGET = 600 * MB
+
+
+def _traced_load(factory):
+    tracemalloc.start()
+    try:
+        component = factory()
+        traced, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return component, traced
+
+
+def test_deep_sizeof():
+    array = np.zeros((10, 10))
+    assert deep_sizeof(array) >= array.nbytes
+    shared = u'x' * 1000
+    # shared objects are counted once
+    assert deep_sizeof([shared, shared]) < 2 * deep_sizeof(shared)
+    assert deep_sizeof({u'a': [shared]}) > deep_sizeof(shared)
+
+
+def test_lemmatizer_memory_budget():
+    lemmatizer, traced = _traced_load(LefffLemmatizer)
+    usage = lemmatizer.memory_usage()
+    stats = usage['lemma_index']
+    assert stats['entries'] == len(lemmatizer.lemma_index)
+    assert stats['load_time'] > 0
+    assert total_size(usage) <= LEMMATIZER_BUDGET
+    # the accounting agrees with the allocations made while loading
+    assert 0.8 * traced <= stats['size'] <= 1.25 * traced
+
+
+def test_tagger_memory_budget():
+    tagger, traced = _traced_load(POSTagger)
+    usage = tagger.memory_usage()
+    assert set(usage) == set(['lex_dict', 'tag_dict', 'feature2int',
+                              'weights', 'bias_weights', 'cache'])
+    assert usage['weights']['entries'] == len(tagger.classifier.feature2int)
+    assert usage['weights']['size'] >= tagger.classifier.weights.nbytes
+    for name in ('lex_dict', 'tag_dict', 'feature2int', 'weights'):
+        assert usage[name]['load_time'] is not None
+    assert total_size(usage) <= TAGGER_BUDGET
+    assert 0.8 * traced <= total_size(usage) <= 1.25 * traced
+    # the feature cache fills up while tagging
+    from spacy_lefff.melt_tagger import Token
+    tagger.tag_token_sequence([Token(string=wd) for wd in
+                               u'Il y a des Françaises .'.split()])
+    assert tagger.memory_usage()['cache']['entries'] > 0
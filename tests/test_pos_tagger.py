@@ -1,11 +1,18 @@
 # coding: utf-8
 
 from spacy_lefff import POSTagger, LefffLemmatizer
-from spacy_lefff.melt_tagger import MODELS_DIR
+from spacy_lefff.melt_tagger import MODELS_DIR, Token, Hypothesis, TokenAttributes
+from spacy_lefff.melt_tagger import SHAPE_UPPER, SHAPE_ALLCAPS, SHAPE_HYPHEN
+from spacy_lefff.melt_tagger import (PROBAS_KEY, MaxEntClassifier,
+                                     save_plain_weights)
 
 import pytest
 import spacy
 import os
+import pickle
+import threading
+
+import numpy as np
 
 
 def test_sentence_one(add_lefff_lemma_nlp):
@@ -60,3 +67,356 @@ def test_load_tag():
     tag = os.path.join(MODELS_DIR, 'tag_dict.json')
     french_pos_tagger.load_lexicon(tag)
     assert french_pos_tagger.tag_dict == tag_dict
+
+
+def test_class_distributions():
+    french_pos_tagger = POSTagger()
+    classifier = french_pos_tagger.classifier
+    features = [['wd=maison', 'suff1=n=1'], [], ['wd=Paris', 'unknown=1']]
+    distributions = classifier.class_distributions(features)
+    assert distributions.shape == (3, len(classifier.classes))
+    for fv, row in zip(features, distributions):
+        expected = [pr for _, pr in classifier.class_distribution(fv)]
+        assert row.tolist() == pytest.approx(expected)
+
+
+def test_tag_token_sequences_batch():
+    french_pos_tagger = POSTagger()
+    sentences = [u"Il y a des Costariciennes .".split(),
+                 u"J' ai une maison à Paris .".split(),
+                 u"Bonjour".split()]
+    batch = french_pos_tagger.tag_token_sequences(
+        [[Token(string=wd) for wd in words] for words in sentences])
+    for words, tagged in zip(sentences, batch):
+        single = french_pos_tagger.tag_token_sequence(
+            [Token(string=wd) for wd in words])
+        assert [t.label for t in tagged] == [t.label for t in single]
+
+
+def test_thread_safe_tagging():
+    french_pos_tagger = POSTagger(thread_safe=True)
+    sentences = [u"Il y a des Costariciennes .".split(),
+                 u"J' ai une maison à Paris .".split(),
+                 u"Les abaissements de température sont gênants .".split()]
+    expected = [[t.label for t in french_pos_tagger.tag_token_sequence(
+        [Token(string=wd) for wd in words])] for words in sentences]
+    french_pos_tagger.cache.clear()
+    errors = []
+
+    def run():
+        for _ in range(20):
+            for words, labels in zip(sentences, expected):
+                tagged = french_pos_tagger.tag_token_sequence(
+                    [Token(string=wd) for wd in words])
+                if [t.label for t in tagged] != labels:
+                    errors.append(words)
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(french_pos_tagger.cache) > 0
+
+
+def test_melt_probas(nlp_pos):
+    tokens = nlp_pos(u"Il y a des Costariciennes.")
+    assert PROBAS_KEY not in tokens.user_data
+    assert tokens[0]._.melt_probas is None
+    french_pos_tagger = POSTagger(print_probas=True)
+    tokens = french_pos_tagger(
+        nlp_pos.tokenizer(u"Il y a des Costariciennes."))
+    assert tokens.user_data[PROBAS_KEY][1].dtype == np.float32
+    probas = tokens[0]._.melt_probas
+    assert sum(probas.values()) == pytest.approx(1., abs=1e-5)
+    assert tokens[0]._.melt_tagger in probas
+
+
+def test_label_pr_distrib_materialized():
+    french_pos_tagger = POSTagger()
+    tagged = french_pos_tagger.tag_token_sequence(
+        [Token(string=wd) for wd in u"Il y a des Costariciennes .".split()])
+    distrib = dict(tagged[2].label_pr_distrib)
+    assert sorted(distrib) == sorted(french_pos_tagger.classifier.classes)
+    assert distrib[tagged[2].label] == pytest.approx(tagged[2].proba)
+
+
+def test_hypothesis_history():
+    root = Hypothesis()
+    hyp = Hypothesis(3, parent=Hypothesis(2, parent=Hypothesis(1,
+                                                                parent=root)))
+    assert hyp.history(2) == [2, 3]
+    assert hyp.history(5) == [1, 2, 3]
+    assert root.history(2) == []
+
+
+def test_token_attributes():
+    tokens = [Token(string=wd) for wd in u"Le chat et le TGV-Est , le".split()]
+    attrs = TokenAttributes(tokens, lex_dict={u"le": {u"DET": "1"}},
+                            feat_selection={'pln': 2, 'sln': 1})
+    assert attrs.word_ids == [0, 1, 2, 3, 4, 5, 3]
+    assert attrs.lex_sigs[3] == u"DET"
+    assert attrs.lex_sigs[0] == u"unk"
+    assert attrs.word_feats[1] == (u"wd=chat", u"pref1=c", u"pref2=ch",
+                                   u"suff1=t=1")
+    shape = attrs.shapes[4]
+    assert shape & SHAPE_UPPER and shape & SHAPE_HYPHEN
+    assert not shape & SHAPE_ALLCAPS
+
+
+def test_melt_tag_store(nlp_pos):
+    tokens = nlp_pos(u"Il y a des Costariciennes.")
+    tags = [t._.melt_tagger for t in tokens]
+    assert tags[0] == u"CLS"
+    tokens[1]._.melt_tagger = u"ADV"
+    assert tokens[1]._.melt_tagger == u"ADV"
+    assert [t._.melt_tagger for t in tokens][2:] == tags[2:]
+
+
+def test_set_native_attrs():
+    nlp = spacy.load('fr')
+    nlp.add_pipe(POSTagger(set_tag=True, set_pos=True), name='POSTagger',
+                 after='parser')
+    tokens = nlp(u"Il y a des Costariciennes.")
+    assert [t.tag_ for t in tokens] == [t._.melt_tagger for t in tokens]
+    assert tokens[0].pos_ == u"PRON"
+    assert tokens[2].pos_ == u"VERB"
+    # a single attribute
+    nlp = spacy.load('fr')
+    nlp.add_pipe(POSTagger(set_tag=True), name='POSTagger', after='parser')
+    tokens = nlp(u"Il y a des Costariciennes.")
+    assert [t.tag_ for t in tokens] == [t._.melt_tagger for t in tokens]
+
+
+def _labels(tagger, words):
+    return [t.label for t in tagger.tag_token_sequence(
+        [Token(string=wd) for wd in words])]
+
+
+def test_to_disk_from_disk(tmpdir):
+    words = u"Il y a des Costariciennes .".split()
+    french_pos_tagger = POSTagger(set_tag=True)
+    french_pos_tagger.to_disk(tmpdir.strpath)
+    restored = POSTagger().from_disk(tmpdir.strpath)
+    assert restored.set_tag
+    assert isinstance(restored.classifier.weights, np.memmap)
+    assert restored.lex_dict == french_pos_tagger.lex_dict
+    assert _labels(restored, words) == _labels(french_pos_tagger, words)
+
+
+def test_save_plain_weights(tmpdir):
+    model_dir = tmpdir.mkdir('model')
+    POSTagger().classifier.dump(model_dir.strpath)
+    weights = np.load(model_dir.join('weights.npy').strpath)
+    # pickled, as in the hosted model archive
+    with open(model_dir.join('weights.npy').strpath, 'wb') as f:
+        pickle.dump(weights, f, 2)
+    classifier = MaxEntClassifier()
+    classifier.load(model_dir.strpath, mmap_mode='r')
+    assert not isinstance(classifier.weights, np.memmap)
+    assert save_plain_weights(tmpdir.strpath) == \
+        [model_dir.join('weights.npy').strpath]
+    classifier.load(model_dir.strpath, mmap_mode='r')
+    assert isinstance(classifier.weights, np.memmap)
+    assert (classifier.weights == weights).all()
+    assert save_plain_weights(tmpdir.strpath) == []
+
+
+def test_to_bytes_from_bytes():
+    words = u"Il y a des Costariciennes .".split()
+    french_pos_tagger = POSTagger()
+    restored = POSTagger().from_bytes(french_pos_tagger.to_bytes())
+    assert _labels(restored, words) == _labels(french_pos_tagger, words)
+
+
+def test_pickle_carries_paths():
+    words = u"Il y a des Costariciennes .".split()
+    french_pos_tagger = POSTagger(thread_safe=True)
+    data = pickle.dumps(french_pos_tagger, 2)
+    # the resources are loaded again from their files
+    assert len(data) < 10000
+    restored = pickle.loads(data)
+    assert restored.thread_safe
+    assert restored.files == french_pos_tagger.files
+    assert _labels(restored, words) == _labels(french_pos_tagger, words)
+    # without files to point to, the data itself is pickled
+    restored.from_bytes(french_pos_tagger.to_bytes())
+    restored = pickle.loads(pickle.dumps(restored, 2))
+    assert _labels(restored, words) == _labels(french_pos_tagger, words)
+
+
+def test_tag_token_stream():
+    french_pos_tagger = POSTagger()
+    words = (u"Il y a des Costariciennes . J' ai une maison à Paris . "
+             u"Les abaissements de température sont gênants .").split() * 5
+    expected = _labels(french_pos_tagger, words)
+    for chunk_size in (1, 7, 256):
+        tagged = list(french_pos_tagger.tag_token_stream(
+            words, chunk_size=chunk_size, max_lookahead=len(words)))
+        assert [t.string for t in tagged] == words
+        assert [t.label for t in tagged] == expected
+
+
+def test_tag_token_stream_bounded_lookahead():
+    french_pos_tagger = POSTagger()
+    words = (u"Il y a des Costariciennes .".split() * 50)
+    read = []
+
+    def stream():
+        for wd in words:
+            read.append(wd)
+            yield wd
+    tagged = french_pos_tagger.tag_token_stream(stream(), max_lookahead=4,
+                                                chunk_size=8)
+    for i, token in enumerate(tagged):
+        assert token.string == words[i]
+        # tags are emitted before the end of the stream is read
+        assert len(read) - i <= 8 + 2 + 4 + 1
+    assert i == len(words) - 1
+
+
+def test_swap(tmpdir):
+    words = u"Il y a des Costariciennes .".split()
+    tagger = POSTagger()
+    expected = _labels(tagger, words)
+    tagger.to_disk(tmpdir.strpath)
+    model_dir = tmpdir.join('model').strpath
+    old = tagger.snapshot
+    # a stream started before the swap goes on with the old snapshot
+    stream = tagger.tag_token_stream(iter(words * 3), chunk_size=4)
+    first = next(stream)
+    new = tagger.swap(model_path=model_dir)
+    assert tagger.snapshot is new and new is not old
+    assert tagger.files['model'] == model_dir
+    assert new.lex_dict is old.lex_dict
+    assert [first.label] + [t.label for t in stream] == expected * 3
+    assert _labels(tagger, words) == expected
+
+
+def test_swap_failure(tmpdir):
+    from spacy_lefff.melt_tagger import ModelLoadError
+    tagger = POSTagger()
+    snapshot = tagger.snapshot
+    with pytest.raises(ModelLoadError):
+        tagger.swap(model_path=tmpdir.strpath)
+    with pytest.raises(ModelLoadError):
+        tagger.load_model(tmpdir.strpath)
+    assert tagger.snapshot is snapshot
+    results = []
+    thread = tagger.swap_async(model_path=tmpdir.strpath,
+                               callback=lambda *args: results.append(args))
+    thread.join()
+    [(new, error)] = results
+    assert new is None and isinstance(error, ModelLoadError)
+    assert tagger.snapshot is snapshot
+
+
+def test_time_budget():
+    import time
+    from spacy_lefff.melt_tagger import DEGRADATION_KEY, DEGRADATION_LEVELS
+    words = u"Il y a des Costariciennes .".split()
+    tagger = POSTagger()
+    tokens = [Token(string=wd) for wd in words]
+    tagged, level = tagger.tag_token_sequence_budget(tokens,
+                                                     time.time() + 60)
+    assert level == 0
+    assert [t.label for t in tagged] == _labels(tagger, words)
+    # past the deadline, the lexicons decide
+    tagged, level = tagger.tag_token_sequence_budget(tokens, 0)
+    assert DEGRADATION_LEVELS[level] == 'lexicon'
+    for wd, token in zip(words, tagged):
+        counts = tagger.tag_dict.get(wd)
+        if counts:
+            assert token.label == max(counts, key=counts.get)
+    assert all(0 < t.proba <= 1 for t in tagged)
+    nlp = spacy.load('fr')
+    nlp.add_pipe(POSTagger(time_budget=60), name='POSTagger',
+                 after='parser')
+    doc = nlp(u"Il y a des Costariciennes.")
+    assert doc.user_data[DEGRADATION_KEY] == 'beam'
+
+
+def test_degradation_levels():
+    from spacy_lefff.melt_tagger import (DEGRADATION_LEVELS, beam_widths,
+                                         next_level)
+    assert beam_widths(3) == [3, 2, 1]
+    assert beam_widths(8) == [8, 4, 1]
+    assert beam_widths(2) == [2, 1, 1]
+
+    def names(beam_size, level):
+        return DEGRADATION_LEVELS[next_level(level, beam_widths(beam_size))]
+
+    assert names(3, 0) == 'narrow_beam'
+    assert names(3, 1) == 'greedy'
+    assert names(3, 2) == 'lexicon'
+    # a narrow beam of 1 would be the greedy decoding
+    assert names(2, 0) == 'greedy'
+    assert names(1, 0) == 'greedy'
+
+
+def test_constrained_class_distributions():
+    classifier = POSTagger().classifier
+    features = [['wd=maison', 'suff1=n=1'], [], ['wd=Paris', 'unknown=1']]
+    n_classes = len(classifier.classes)
+    legal = [[0, 2], [1], None]
+    full = classifier.class_distributions(features)
+    constrained = classifier.class_distributions(features, legal)
+    assert constrained.shape == full.shape
+    # the full distribution restricted to the legal classes
+    expected = full[0, [0, 2]] / full[0, [0, 2]].sum()
+    assert constrained[0, [0, 2]].tolist() == pytest.approx(expected)
+    assert constrained[0].sum() == pytest.approx(1)
+    assert constrained[1].tolist() == [float(c == 1)
+                                       for c in range(n_classes)]
+    assert constrained[2].tolist() == pytest.approx(full[2])
+
+
+def test_constrained_softmax_tagging():
+    words = u"Il y a des Costariciennes .".split()
+    tagger = POSTagger(constrained_softmax=True)
+    assert tagger.config['constrained_softmax']
+    tagged = tagger.tag_token_sequence([Token(string=wd) for wd in words])
+    for wd, token in zip(words, tagged):
+        legal = tagger.legal_classes(wd)
+        if len(legal) < len(tagger.classifier.classes):
+            row = token.distribs.array[token.distrib_row]
+            assert row.sum() == pytest.approx(1)
+            assert row[legal].sum() == pytest.approx(1)
+
+
+def test_legal_classes_cached():
+    tagger = POSTagger()
+    legal = tagger.legal_classes(u'maison')
+    assert tagger.legal_classes(u'maison') is legal
+    assert not legal.flags.writeable
+    unknown = tagger.legal_classes(u'xqzw')
+    assert unknown.tolist() == list(range(len(tagger.classifier.classes)))
+    # new lexicons start a new cache
+    snapshot = tagger.snapshot.replace(tag_dict={u'maison': {u'V': 1}})
+    assert snapshot.legal_classes(u'maison') is not legal
+    assert tagger.snapshot.replace().legal_cache is tagger.snapshot.legal_cache
+
+
+def test_tag_sentences():
+    tagger = POSTagger()
+    sentences = [u'Il y a des Françaises .'.split(), [],
+                 u'Le chat dort .'.split()]
+    expected = [_labels(tagger, words) for words in sentences]
+    ids = tagger.tag_sentences(sentences, batch_size=2)
+    assert [ids[1].dtype.kind, len(ids[1])] == ['i', 0]
+    assert [[tagger.classifier.classes[c] for c in tags]
+            for tags in ids] == expected
+    results = tagger.tag_sentences(sentences, as_strings=True,
+                                   return_probas=True)
+    assert [tags for tags, _ in results] == expected
+    assert all(((0 < probas) & (probas <= 1)).all()
+               for _, probas in results)
+
+
+def test_tag_sentences_cap_only():
+    tagger = POSTagger()
+    words = u'IL Y A DES FRANÇAISES .'.split()
+    tags = tagger.tag_sentences([words], as_strings=True,
+                                lowerCaseCapOnly=True)
+    assert tags == [_labels(tagger, [wd.lower() for wd in words])]
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import json
+import threading
+
+import pytest
+
+from spacy_lefff import POSTagger, LefffLemmatizer
+from spacy_lefff.serve import MicroBatcher, TaggingServer
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import urlopen, HTTPError
+
+
+@pytest.fixture(scope='module')
+def batcher():
+    return MicroBatcher(POSTagger(), LefffLemmatizer(),
+                        max_batch_size=16, max_latency=0.05)
+
+
+def test_batcher_coalesces_requests(batcher):
+    sentences = [[u"Il", u"y", u"a", u"des", u"Françaises", u"."],
+                 [u"J'", u"ai", u"une", u"maison", u"."]]
+    results = [None] * 8
+
+    def run(k):
+        results[k] = batcher.submit([sentences[k % 2]])
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(timing['batch_size'] for _, timing in results) > 1
+    for k, (tagged, timing) in enumerate(results):
+        assert [e['token'] for e in tagged[0]] == sentences[k % 2]
+        assert timing['total_ms'] >= timing['tagging_ms']
+    assert results[0][0] == results[2][0]
+    assert results[1][0][0][1]['lemma'] == u"avoir"
+
+
+class _FailingTagger(object):
+    """ tagger failing on sentences holding a given word """
+
+    def __init__(self, tagger, word):
+        self.tagger = tagger
+        self.word = word
+
+    def tag_token_sequences(self, sequences, **kwargs):
+        if any(tok.string == self.word for seq in sequences for tok in seq):
+            raise ValueError('cannot tag %s' % self.word)
+        return self.tagger.tag_token_sequences(sequences, **kwargs)
+
+
+def test_batcher_isolates_failing_request():
+    batcher = MicroBatcher(_FailingTagger(POSTagger(), u"BOOM"),
+                           max_batch_size=16, max_latency=0.2)
+    sentences = [[u"Il", u"y", u"a", u"BOOM", u"."],
+                 [u"J'", u"ai", u"une", u"maison", u"."]]
+    results = [None, None]
+
+    def run(k):
+        try:
+            results[k] = batcher.submit([sentences[k]])
+        except ValueError as e:
+            results[k] = e
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert isinstance(results[0], ValueError)
+    tagged, timing = results[1]
+    assert timing['batch_size'] == 2
+    assert [e['token'] for e in tagged[0]] == sentences[1]
+
+
+def test_server_roundtrip(batcher):
+    server = TaggingServer(batcher, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://%s:%d/tag' % server.server_address
+        body = json.dumps({'sentences': [
+            [u"Il", u"y", u"a", u"des", u"Costariciennes", u"."]]})
+        response = json.loads(
+            urlopen(url, body.encode('utf-8')).read().decode('utf-8'))
+        assert [e['tag'] for e in response['sentences'][0]] == \
+            [u"CLS", u"CLO", u"V", u"DET", u"NPP", u"PONCT"]
+        assert 'total_ms' in response['timing']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_server_rejects_invalid_sentences(batcher):
+    server = TaggingServer(batcher, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://%s:%d/tag' % server.server_address
+        for sentences in [[[u"Il", 3]], [[u"Il", None]], [{u"a": 1}]]:
+            body = json.dumps({'sentences': sentences})
+            with pytest.raises(HTTPError) as error:
+                urlopen(url, body.encode('utf-8'))
+            assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
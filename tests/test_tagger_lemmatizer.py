@@ -0,0 +1,58 @@
+# coding: utf-8
+import pickle
+
+import spacy
+from spacy_lefff import POSTaggerLemmatizer
+
+
+SENTENCES = [u"Il y a des Françaises.",
+             u"J'ai une maison à Paris.",
+             u"Les abaissements de température sont gênants."]
+
+
+def _annotations(doc):
+    return [(t._.melt_tagger, t._.lefff_lemma) for t in doc]
+
+
+def test_same_as_tagger_then_lemmatizer(add_lefff_lemma_nlp):
+    fused = POSTaggerLemmatizer()
+    nlp = spacy.load('fr')
+    nlp.add_pipe(fused, name='melt_lefff', after='parser')
+    for text in SENTENCES:
+        assert _annotations(nlp(text)) == \
+            _annotations(add_lefff_lemma_nlp(text))
+    assert len(fused.lemma_rows) > 0
+
+
+def test_shared_lemmatizer():
+    first = POSTaggerLemmatizer()
+    second = POSTaggerLemmatizer(lemmatizer=first.lemmatizer)
+    assert second.lemmatizer.lemma_dict is first.lemmatizer.lemma_dict
+    row = second.lemma_row(u"Maisons")
+    classes = second.classifier.classes
+    assert len(row) == len(classes)
+    for cl, lemma in zip(classes, row):
+        assert lemma == first.lemmatizer.lemmatize(
+            u"Maisons", cl.lower(), from_melt=True)
+
+
+def test_pickle(tmpdir):
+    fused = POSTaggerLemmatizer()
+    restored = pickle.loads(pickle.dumps(fused, 2))
+    assert restored.lemmatizer.lemma_dict == fused.lemmatizer.lemma_dict
+    fused.to_disk(tmpdir.strpath)
+    restored = POSTaggerLemmatizer().from_disk(tmpdir.strpath)
+    assert restored.lemmatizer is not fused.lemmatizer
+    nlp = spacy.load('fr')
+    nlp.add_pipe(restored, name='melt_lefff', after='parser')
+    assert all(t._.melt_tagger for t in nlp(SENTENCES[0]))
+
+
+def test_lemmatizer_entries_update():
+    component = POSTaggerLemmatizer()
+    assert u'logis' not in component.lemma_row(u'maison')
+    # the cached lemmas are dropped when the entries change
+    component.lemmatizer.add_entries(
+        [(u'maison', category, u'logis') for category in
+         set(c for categories in component._categories for c in categories)])
+    assert set(component.lemma_row(u'maison')) == set([u'logis'])
@@ -0,0 +1,126 @@
+# coding: utf-8
+
+import io
+import json
+import os
+
+import pytest
+
+from spacy_lefff import POSTagger
+from spacy_lefff.melt_tagger import BrownReader, ConllReader, Token
+from spacy_lefff.profiles import PROFILES, ProfileMismatchError, check_profile
+from spacy_lefff.train import (MaxEntTrainer, evaluate, prune_to_profile,
+                               train_model)
+
+CORPUS = u"""Il/CLS y/CLO a/V des/DET Costariciennes/NPP ./PONCT
+J'/CLS ai/V une/DET maison/NC à/P Paris/NPP ./PONCT
+Les/DET abaissements/NC de/P température/NC sont/V gênants/ADJ ./PONCT
+Le/DET chat/NC mange/V la/DET souris/NC ./PONCT
+"""
+
+CONLL = u"""# sent_id = 1
+1\tLe\tle\tDET\tDET\t_\t2\tdet\t_\t_
+2\tchat\tchat\tNOUN\tNC\t_\t3\tnsubj\t_\t_
+3-4\tdu\t_\t_\t_\t_\t_\t_\t_\t_
+3\tde\tde\tADP\tP\t_\t0\troot\t_\t_
+4\tle\tle\tDET\tDET\t_\t3\tdet\t_\t_
+
+1\tDort\tdormir\tVERB\tV\t_\t0\troot\t_\t_
+"""
+
+
+def _write(tmpdir, name, content):
+    path = tmpdir.join(name)
+    with io.open(path.strpath, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return path.strpath
+
+
+def test_corpus_readers(tmpdir):
+    brown = list(BrownReader(_write(tmpdir, 'corpus.txt', CORPUS)))
+    assert len(brown) == 4
+    assert brown[1][0] == (u"J'", u"CLS")
+    conll = list(ConllReader(_write(tmpdir, 'corpus.conllu', CONLL)))
+    assert conll == [[(u"Le", u"DET"), (u"chat", u"NC"), (u"de", u"P"),
+                      (u"le", u"DET")], [(u"Dort", u"V")]]
+
+
+def test_train_model(tmpdir):
+    corpus = _write(tmpdir, 'corpus.txt', CORPUS)
+    model_dir = os.path.join(tmpdir.strpath, 'model')
+    train_model(corpus, model_dir,
+                trainer=MaxEntTrainer(epochs=20, batch_size=8))
+    for name in ['classes.json', 'feature_map.json', 'weights.npy',
+                 'bias_weights.npy', 'lexicon.json', 'tag_dict.json']:
+        assert os.path.exists(os.path.join(model_dir, name))
+    french_pos_tagger = POSTagger()
+    french_pos_tagger.load_model(model_dir)
+    french_pos_tagger.load_tag_dictionary(
+        os.path.join(model_dir, 'tag_dict.json'))
+    for sentence in BrownReader(corpus):
+        tagged = french_pos_tagger.tag_token_sequence(
+            [Token(string=wd) for wd, _ in sentence])
+        assert [t.label for t in tagged] == [tag for _, tag in sentence]
+
+
+def test_train_profile(tmpdir):
+    corpus = _write(tmpdir, 'corpus.txt', CORPUS)
+    model_dir = os.path.join(tmpdir.strpath, 'model')
+    train_model(corpus, model_dir, profile='fast', dev_path=corpus,
+                trainer=MaxEntTrainer(feat_options=PROFILES['fast'],
+                                      epochs=20, batch_size=8))
+    with io.open(os.path.join(model_dir, 'profile.json'),
+                 encoding='utf-8') as f:
+        profile_info = json.load(f)
+    assert profile_info['name'] == 'fast'
+    assert profile_info['evaluation']['accuracy'] == 1.
+    assert profile_info['evaluation']['tokens_per_second'] > 0
+    files = [os.path.join(model_dir, 'lexicon.json'),
+             os.path.join(model_dir, 'tag_dict.json'), model_dir]
+    french_pos_tagger = POSTagger.from_files(*files, profile='fast')
+    assert french_pos_tagger.profile_info == profile_info
+    result = evaluate(french_pos_tagger, list(BrownReader(corpus)))
+    assert result['accuracy'] == 1.
+    # the profile defaults to the one the model was trained for
+    assert POSTagger.from_files(*files).profile == 'fast'
+    # a model can't be used with the templates of another profile
+    with pytest.raises(ProfileMismatchError):
+        POSTagger.from_files(*files, profile='accurate')
+
+
+def test_train_custom_feat_options(tmpdir):
+    corpus = _write(tmpdir, 'corpus.txt', CORPUS)
+    model_dir = os.path.join(tmpdir.strpath, 'model')
+    feat_options = dict(PROFILES['fast'], sln=2)
+    train_model(corpus, model_dir, dev_path=corpus,
+                trainer=MaxEntTrainer(feat_options=feat_options,
+                                      epochs=20, batch_size=8))
+    files = [os.path.join(model_dir, 'lexicon.json'),
+             os.path.join(model_dir, 'tag_dict.json'), model_dir]
+    french_pos_tagger = POSTagger.from_files(*files)
+    assert french_pos_tagger.profile_info['name'] is None
+    assert french_pos_tagger.feat_options == feat_options
+    assert french_pos_tagger.profile_info['evaluation']['accuracy'] == 1.
+    assert POSTagger.from_files(*files, profile=feat_options).profile == \
+        feat_options
+    with pytest.raises(ProfileMismatchError):
+        POSTagger.from_files(*files, profile='fast')
+
+
+def test_prune_to_profile():
+    french_pos_tagger = POSTagger()
+    classifier = french_pos_tagger.classifier
+    n_features = len(classifier.feature2int)
+    prune_to_profile(classifier, PROFILES['fast'])
+    assert 0 < len(classifier.feature2int) < n_features
+    assert classifier.weights.shape[0] == len(classifier.feature2int)
+    check_profile(classifier.feature2int, PROFILES['fast'])
+    # without a model trained for it, a profile prunes the default model
+    balanced = POSTagger(profile='balanced')
+    assert balanced.profile_info['name'] == 'balanced'
+    assert balanced.profile_info['pruned_from'] == \
+        french_pos_tagger.files['model']
+    check_profile(balanced.classifier.feature2int, PROFILES['balanced'],
+                  balanced.profile_info)
+    sentence = [u"J'", u"ai", u"une", u"maison", u"."]
+    assert len(balanced.tag_sentences([sentence])[0]) == len(sentence)